@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     "movies",
     "accounts", 
     "recommendations",
+    "streaming",
     
     # Original home app (will be replaced)
     "home",
@@ -158,7 +159,88 @@ CYNARA_SETTINGS = {
     'APP_DESCRIPTION': 'Personal Movie Streaming Platform',
     'MOVIES_PER_PAGE': 24,
     'RECOMMENDATIONS_COUNT': 6,
+    'RECOMMENDATIONS_TTL_HOURS': 24,  # Precomputed recommendation sets expire after this
+    'RECOMMENDATIONS_CACHE_SECONDS': 300,  # Per-user cache of the served recommendation list
+    'POPULAR_CACHE_SECONDS': 300,
+    'DEFAULT_RECOMMENDATION_ALGORITHM': 'hybrid',
+    'FEEDBACK_FLUSH_DELAY': 1.0,  # Seconds feedback is buffered before a batched upsert
+    'FEEDBACK_FLUSH_MAX_DELAY': 5.0,
+    'NEGATIVE_FILTER_TTL': 300,  # Seconds before a user's dismissed-movie set is reloaded
+    'NEGATIVE_FILTER_MAX_USERS': 10000,  # Users whose dismissed sets stay in process memory
+    'BANDIT_ENABLED': True,  # Pick each user's algorithm by Thompson sampling on feedback
+    'BANDIT_FLUSH_INTERVAL': 30,  # Seconds between writes/reads of the shared arm statistics
+    'BANDIT_ASSIGNMENT_SECONDS': 3600,  # How long a user's sampled algorithm stays put
+    'TRENDING_HALF_LIFE': 0.25,  # Trending half-life as a fraction of each window
+    'TRENDING_CACHE_SECONDS': 60,
     'MAX_UPLOAD_SIZE': 5 * 1024 * 1024 * 1024,  # 5GB
+    'SIMILARITY_INDEX_TTL': 300,  # Seconds before the in-memory embedding index is rebuilt
+    'EMBEDDING_SNAPSHOT_PATH': BASE_DIR / 'snapshots' / 'embeddings.bin',  # Shared by all workers
+    'EMBEDDING_SNAPSHOT_CHECK_INTERVAL': 10,  # Seconds between checks for a newer snapshot
+    'ANN_INDEX_PATH': BASE_DIR / 'snapshots' / 'ann',  # Built by `manage.py build_ann_index`
+    'ANN_NPROBE': 8,  # IVF lists probed per query; higher = better recall, slower
+    'ANN_MIN_CATALOG': 20000,  # Below this many movies exact search is already fast enough
+    'EMBEDDING_BACKEND': 'openai' if OPENAI_API_KEY else 'local',  # 'local' runs offline
+    'EMBEDDING_MODEL': 'text-embedding-3-small',
+    'EMBEDDING_BATCH_SIZE': 256,  # Texts per embedding request
+    'EMBEDDING_CONCURRENCY': 4,  # Embedding requests in flight at once
+    'EMBEDDING_MAX_RETRIES': 5,  # Attempts per batch before the run gives up
+    'USER_SIMILARITY_TOP_K': 50,  # Neighbours kept per user in UserSimilarity
+    'USER_SIMILARITY_BLOCK_SIZE': 512,  # Users per sparse product block; bounds peak memory
+    'MOVIE_SIMILARITY_TOP_K': 30,  # Similar movies kept per movie from metadata overlap
+    'MOVIE_SIMILARITY_BLOCK_SIZE': 256,  # Movies per sparse product block
+    'MOVIE_FEATURES_TTL': 3600,  # Seconds before a process rebuilds its cached metadata features
+    'BACKGROUND_TASKS': True,  # Run debounced updates in a worker thread (False = inline)
+    'PROFILE_UPDATE_DELAY': 2.0,  # Seconds of quiet before a user's profile is updated
+    'PROFILE_UPDATE_MAX_DELAY': 10.0,  # Upper bound on how long a busy user's update waits
+    'PROFILE_NEIGHBOUR_CANDIDATES': 5000,  # Co-watchers considered by incremental neighbour updates
+    'HYBRID_WEIGHTS': {  # Signal blend for the hybrid ranker; missing keys use the defaults
+        'content': 0.45,
+        'collaborative': 0.3,
+        'popularity': 0.15,
+        'recency': 0.1,
+    },
+    'HYBRID_DIVERSITY': 0.3,  # MMR trade-off: 0 = pure relevance, 1 = pure novelty
+    'HYBRID_CANDIDATES': 500,  # Candidates pulled from each source before ranking
+    'HYBRID_MMR_POOL': 5,  # MMR re-orders the top (count x this) of the blend
+    'HYBRID_RECENCY_HALF_LIFE_DAYS': 30,  # Age at which the recency signal halves
+    'STREAM_OFFLOAD': os.getenv('STREAM_OFFLOAD') or None,  # 'x-accel-redirect' (nginx), 'x-sendfile' or None
+    'STREAM_OFFLOAD_PREFIX': '/protected-movies/',  # nginx internal location that maps to MOVIES_ROOT
+    'STREAM_MAX_RANGE_BYTES': 8 * 1024 * 1024,  # Open-ended ranges (bytes=N-) are answered with at most this much
+    'STREAM_MAX_RANGES': 16,  # More ranges than this (after merging) get the whole file
+    'STREAM_ASYNC_CHUNK_SIZE': 64 * 1024,  # Bytes per read on the ASGI path; two chunks in memory per stream
+    'STREAM_ASYNC_READ_THREADS': 8,  # Threads doing blocking file reads for the ASGI path
+    'STREAM_VALIDATOR_CACHE_SECONDS': 5,  # ETag/Last-Modified are reused this long before the file is stat'ed again
+    'STREAM_CACHE_SECONDS': 3600,  # Browser cache lifetime of movie files (revalidated with ETags after)
+    'RENDITIONS_ROOT': BASE_DIR / 'renditions',  # HLS ladder output, one directory per movie
+    'RENDITION_SEGMENT_SECONDS': 6,
+    'RENDITION_ENCODER_COMMAND': None,  # Argument list with {input} {output} {start} ... (None = ffmpeg/libx264)
+    'RENDITION_ENCODER_THREADS': 2,  # Threads per encoder process
+    'RENDITION_CONCURRENCY': 1,  # Encoder processes at once
+    'RENDITION_NICE': 10,  # Encoders run at this lower CPU priority
+    'RENDITION_SEGMENTS_PER_MINUTE': None,  # Cap on segment starts (None = no cap)
+    'RENDITION_MAX_LOAD': 0.75,  # Pause while the load average per CPU is above this
+    'RENDITION_STALE_SECONDS': 1800,  # A running rendition this quiet is picked up again
+    'RENDITION_CACHE_SECONDS': 86400,  # Browser cache lifetime of finished playlists and segments
+    'TRICKPLAY_ROOT': BASE_DIR / 'trickplay',  # Seek-bar preview sprites, one directory per movie
+    'TRICKPLAY_INTERVAL': 10,  # Seconds between preview tiles
+    'TRICKPLAY_TILE_WIDTH': 160,
+    'TRICKPLAY_COLUMNS': 10,  # Tiles per sheet: columns x rows
+    'TRICKPLAY_ROWS': 10,
+    'TRICKPLAY_FORMAT': 'jpeg',  # 'jpeg' or 'webp'
+    'TRICKPLAY_QUALITY': 70,
+    'TRICKPLAY_FRAME_COMMAND': None,  # Argument list with {input} {interval} {width} {height} (None = ffmpeg)
+    'TRICKPLAY_WORKERS': None,  # Processes generating previews (None = one per CPU)
+    'LIBRARY_SCAN_THREADS': 8,  # Directories listed in parallel by import_library
+    'LIBRARY_BATCH_SIZE': 500,  # Rows per import transaction
+    'LIBRARY_SETTLE_SECONDS': 5,  # watch_library imports a file once its size held this long
+    'LIBRARY_WATCH_BATCH_SIZE': 20,  # Files per watch_library import batch
+    'LIBRARY_POLL_SECONDS': 30,  # Rescan interval when inotify isn't available
+    'FINGERPRINT_BLOCKS': 16,  # Blocks sampled per file to recognise moved and duplicate files (at least 2)
+    'FINGERPRINT_BLOCK_SIZE': 64 * 1024,  # Bytes per sampled block
+    'ANALYSIS_WORKERS': None,  # Processes reading container headers in analyze_media (None = one per CPU)
+    'PROGRESS_FLUSH_INTERVAL': 30,  # Seconds watch progress is buffered before a bulk write
+    'PROGRESS_FLUSH_SIZE': 1000,  # Write early once this many (user, movie) positions are waiting
+    'PROGRESS_SESSION_GAP_HOURS': 6,  # A report this long after a session started begins a new one
 }
 
 # Color Palette
@@ -29,6 +29,9 @@ urlpatterns = [
     # Recommendations and AI features
     path("recommendations/", include("recommendations.urls")),
     
+    # Movie playback
+    path("stream/", include("streaming.urls")),
+    
     # Redirect old home URL to movies
     path("home/", RedirectView.as_view(url='/', permanent=True)),
 ]
@@ -5,7 +5,9 @@ Cynara Recommendations Admin Configuration
 from django.contrib import admin
 from .models import (
     MovieEmbedding, RecommendationSet, RecommendationItem,
-    UserSimilarity, RecommendationFeedback
+    UserSimilarity, RecommendationFeedback, UserTasteVector,
+    AlgorithmFeedbackStats, TrendingMovie, TrendingState, MovieSimilarity,
+    BanditArm
 )
 
 
@@ -16,6 +18,13 @@ class MovieEmbeddingAdmin(admin.ModelAdmin):
     readonly_fields = ('embedding_vector', 'created_at', 'updated_at')
 
 
+@admin.register(UserTasteVector)
+class UserTasteVectorAdmin(admin.ModelAdmin):
+    list_display = ('user', 'updated_at')
+    search_fields = ('user__username',)
+    readonly_fields = ('vector', 'updated_at')
+
+
 class RecommendationItemInline(admin.TabularInline):
     model = RecommendationItem
     extra = 0
@@ -50,3 +59,38 @@ class RecommendationFeedbackAdmin(admin.ModelAdmin):
     list_filter = ('feedback_type', 'recommendation_algorithm', 'created_at')
     search_fields = ('user__username', 'movie__title')
     readonly_fields = ('created_at',)
+
+
+@admin.register(AlgorithmFeedbackStats)
+class AlgorithmFeedbackStatsAdmin(admin.ModelAdmin):
+    list_display = ('algorithm', 'feedback_type', 'count')
+    list_filter = ('algorithm', 'feedback_type')
+    readonly_fields = ('algorithm', 'feedback_type', 'count')
+
+
+@admin.register(TrendingMovie)
+class TrendingMovieAdmin(admin.ModelAdmin):
+    list_display = ('movie', 'window', 'score', 'updated_at')
+    list_filter = ('window',)
+    search_fields = ('movie__title',)
+    ordering = ('window', '-score')
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(TrendingState)
+class TrendingStateAdmin(admin.ModelAdmin):
+    list_display = ('window', 'last_event_id', 'computed_at')
+    readonly_fields = ('window', 'last_event_id', 'computed_at')
+
+
+@admin.register(MovieSimilarity)
+class MovieSimilarityAdmin(admin.ModelAdmin):
+    list_display = ('movie', 'similar_movie', 'score', 'updated_at')
+    search_fields = ('movie__title', 'similar_movie__title')
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(BanditArm)
+class BanditArmAdmin(admin.ModelAdmin):
+    list_display = ('arm', 'successes', 'failures', 'pulls', 'updated_at')
+    readonly_fields = ('updated_at',)
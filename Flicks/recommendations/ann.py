@@ -0,0 +1,310 @@
+"""
+Cynara Approximate Nearest Neighbours
+
+An inverted-file (IVF) index over the normalized embedding matrix. Vectors
+are clustered with spherical k-means; each query scores the centroids, then
+only the `nprobe` closest lists. `nprobe` trades recall for latency: probing
+every list is exact brute force, probing one is fastest.
+
+The index is built offline (``manage.py build_ann_index``) into a directory of
+.npy files that workers load with mmap_mode='r', like the embedding snapshot.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .similarity import get_similarity_index, normalize_rows
+
+META_FILE = 'meta.json'
+
+
+def _spherical_kmeans(vectors, n_lists, iterations, rng):
+    """Cluster unit vectors by cosine; returns normalized centroids"""
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        # Re-seed empty lists with random points so no centroid is wasted
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def assign_lists(vectors, centroids, chunk_size=8192):
+    """Index of the closest centroid for every vector, in bounded-memory chunks"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        block = vectors[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """Inverted-file index with vectors stored contiguously per list"""
+
+    def __init__(self, centroids, offsets, vectors, movie_ids, version=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.movie_ids = movie_ids
+        self.version = version
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, movie_ids, matrix, n_lists=None, iterations=15, sample_size=None, seed=0):
+        """Cluster a normalized matrix and regroup its rows by list"""
+        rng = np.random.default_rng(seed)
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        matrix = np.asarray(matrix, dtype=np.float32)
+
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(len(matrix))))
+        n_lists = min(n_lists, len(matrix))
+
+        # Training on a sample keeps build time flat as the catalog grows
+        sample_size = sample_size or 64 * n_lists
+        if len(matrix) > sample_size:
+            sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+        else:
+            sample = matrix
+        centroids = _spherical_kmeans(np.ascontiguousarray(sample), n_lists, iterations, rng)
+
+        assignments = assign_lists(matrix, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_lists)
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        return cls(
+            centroids.astype(np.float32),
+            offsets,
+            np.ascontiguousarray(matrix[order]),
+            movie_ids[order],
+        )
+
+    def search(self, vector, k=12, nprobe=None, exclude=()):
+        """Return [(movie_id, score), ...] for the k best rows in the nprobe closest lists"""
+        if not len(self) or k <= 0:
+            return []
+        if nprobe is None:
+            nprobe = settings.CYNARA_SETTINGS.get('ANN_NPROBE', 8)
+        nprobe = max(1, min(nprobe, self.n_lists))
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        centroid_scores = self.centroids @ query
+        lists = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        # One matmul per probed list over a contiguous slice; no row gathering
+        scores = []
+        ids = []
+        for list_id in lists:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            scores.append(self.vectors[start:end] @ query)
+            ids.append(self.movie_ids[start:end])
+        if not scores:
+            return []
+        scores = np.concatenate(scores)
+        ids = np.concatenate(ids)
+
+        exclude = np.fromiter(exclude, dtype=np.int64)
+        if len(exclude):
+            scores[np.isin(ids, exclude)] = -np.inf
+
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in best if np.isfinite(scores[i])]
+
+    def save(self, path):
+        """Write the index directory atomically (build in a temp dir, then rename)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        previous = load_meta(path)
+        version = (previous['version'] + 1) if previous else 1
+
+        temp_dir = Path(tempfile.mkdtemp(dir=path.parent, prefix=path.name, suffix='.tmp'))
+        try:
+            np.save(temp_dir / 'centroids.npy', self.centroids)
+            np.save(temp_dir / 'offsets.npy', self.offsets)
+            np.save(temp_dir / 'vectors.npy', self.vectors)
+            np.save(temp_dir / 'movie_ids.npy', self.movie_ids)
+            with open(temp_dir / META_FILE, 'w') as meta:
+                json.dump({
+                    'version': version,
+                    'rows': len(self),
+                    'lists': self.n_lists,
+                    'dimensions': int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+                    'built_at': time.time(),
+                }, meta)
+            os.chmod(temp_dir, 0o755)
+
+            # Directories can't be replaced atomically, so swap via a rename
+            # of the old one; readers holding mmaps keep their open files
+            old_dir = None
+            if path.exists():
+                old_dir = path.with_name(f'{path.name}.old')
+                shutil.rmtree(old_dir, ignore_errors=True)
+                os.rename(path, old_dir)
+            os.rename(temp_dir, path)
+            if old_dir is not None:
+                shutil.rmtree(old_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+        self.version = version
+        return version
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a saved index read-only"""
+        path = Path(path)
+        meta = load_meta(path)
+        if meta is None:
+            raise FileNotFoundError(path / META_FILE)
+        return cls(
+            np.load(path / 'centroids.npy'),
+            np.load(path / 'offsets.npy'),
+            np.load(path / 'vectors.npy', mmap_mode='r'),
+            np.load(path / 'movie_ids.npy', mmap_mode='r'),
+            version=meta['version'],
+        )
+
+
+def load_meta(path):
+    try:
+        with open(Path(path) / META_FILE) as meta:
+            return json.load(meta)
+    except (OSError, ValueError):
+        return None
+
+
+def recall_report(ann_index, exact_index, nprobes=(1, 2, 4, 8, 16, 32), k=10, queries=200, seed=0):
+    """
+    Compare ANN results with brute force for sample catalog items.
+
+    Returns one row per nprobe with mean recall@k and latency percentiles, so
+    the knob can be chosen from measurements rather than guessed.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(exact_index), min(queries, len(exact_index)), replace=False)
+    query_ids = [int(exact_index.movie_ids[row]) for row in rows]
+
+    exact = {}
+    exact_times = []
+    for movie_id in query_ids:
+        started = time.perf_counter()
+        exact[movie_id] = {m for m, _ in exact_index.similar_to(movie_id, k=k)}
+        exact_times.append(time.perf_counter() - started)
+
+    report = {
+        'k': k,
+        'queries': len(query_ids),
+        'rows': len(exact_index),
+        'lists': ann_index.n_lists,
+        'exact_ms': _percentiles(exact_times),
+        'nprobe': [],
+    }
+    for nprobe in nprobes:
+        if nprobe > ann_index.n_lists:
+            break
+        recalls = []
+        times = []
+        for movie_id in query_ids:
+            vector = exact_index.vector_for(movie_id)
+            started = time.perf_counter()
+            found = ann_index.search(vector, k=k, nprobe=nprobe, exclude=(movie_id,))
+            times.append(time.perf_counter() - started)
+            expected = exact[movie_id]
+            if expected:
+                recalls.append(len(expected & {m for m, _ in found}) / len(expected))
+        report['nprobe'].append({
+            'nprobe': nprobe,
+            'recall': float(np.mean(recalls)) if recalls else 0.0,
+            'latency_ms': _percentiles(times),
+        })
+    return report
+
+
+def _percentiles(seconds):
+    values = np.array(seconds) * 1000
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+    }
+
+
+def get_ann_path():
+    path = settings.CYNARA_SETTINGS.get('ANN_INDEX_PATH')
+    return Path(path) if path else None
+
+
+_ann_index = None
+_ann_checked_at = 0.0
+_ann_lock = threading.Lock()
+
+
+def get_ann_index():
+    """Process-wide IVF index, swapped for a newer build when one appears"""
+    global _ann_index, _ann_checked_at
+
+    path = get_ann_path()
+    if path is None:
+        return None
+
+    now = time.monotonic()
+    interval = settings.CYNARA_SETTINGS.get('EMBEDDING_SNAPSHOT_CHECK_INTERVAL', 10)
+    if _ann_checked_at and now - _ann_checked_at < interval:
+        return _ann_index
+
+    with _ann_lock:
+        _ann_checked_at = now
+        meta = load_meta(path)
+        if meta is None:
+            _ann_index = None
+        elif _ann_index is None or meta['version'] != _ann_index.version:
+            try:
+                _ann_index = IVFIndex.load(path)
+            except (OSError, ValueError):
+                pass
+    return _ann_index
+
+
+def search_candidates(vector, k=100, exclude=(), nprobe=None):
+    """
+    Candidate retrieval for the recommendation generators.
+
+    Uses the IVF index once the catalog is large enough for it to pay off,
+    and exact search over the similarity index otherwise.
+    """
+    ann_index = get_ann_index()
+    min_rows = settings.CYNARA_SETTINGS.get('ANN_MIN_CATALOG', 20000)
+    if ann_index is not None and len(ann_index) >= min_rows:
+        return ann_index.search(vector, k=k, nprobe=nprobe, exclude=exclude)
+    return get_similarity_index().top_k(vector, k=k, exclude=exclude)
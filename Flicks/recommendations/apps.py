@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RecommendationsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "recommendations"
+
+    def ready(self):
+        # Register signal handlers that keep the in-memory indexes fresh
+        from . import profiles, related, similarity  # noqa: F401
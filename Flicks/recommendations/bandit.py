@@ -0,0 +1,174 @@
+"""
+Cynara Algorithm Bandit
+
+Learns which recommendation algorithm to serve from RecommendationFeedback.
+Each algorithm is an arm with a Beta posterior over "this list gets a
+positive reaction": liked and watched feedback count as successes,
+disliked and not interested as failures. At serve time every arm's
+posterior is sampled once (Thompson sampling) and the best sample wins.
+
+Statistics live in per-process NumPy arrays, so recording feedback and
+choosing an arm are O(1) in the number of events. Local increments are
+added to BanditArm with F() expressions every BANDIT_FLUSH_INTERVAL
+seconds and the merged totals from all workers are read back.
+"""
+
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import BanditArm, RecommendationSet
+from .tasks import batcher
+
+ALGORITHMS = [choice for choice, _ in RecommendationSet._meta.get_field('algorithm_used').choices]
+
+REWARDS = {
+    'liked': 1.0,
+    'watched': 1.0,
+    'disliked': 0.0,
+    'not_interested': 0.0,
+}
+
+
+def bandit_enabled():
+    return settings.CYNARA_SETTINGS.get('BANDIT_ENABLED', True)
+
+
+class AlgorithmBandit:
+    """Beta-Bernoulli Thompson sampling over recommendation algorithms"""
+
+    def __init__(self, arms=None):
+        self.arms = list(arms or settings.CYNARA_SETTINGS.get('BANDIT_ARMS') or ALGORITHMS)
+        self._positions = {arm: position for position, arm in enumerate(self.arms)}
+        size = len(self.arms)
+        # Totals as last read from the database, and increments not yet written
+        self._stored = np.zeros((3, size))  # successes, failures, pulls
+        self._pending = np.zeros((3, size))
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _interval(self):
+        return settings.CYNARA_SETTINGS.get('BANDIT_FLUSH_INTERVAL', 30)
+
+    def _refresh(self, force=False):
+        """Re-read the shared totals when they're older than the flush interval"""
+        now = time.monotonic()
+        if not force and self._loaded_at is not None and now - self._loaded_at < self._interval():
+            return
+        self._loaded_at = now
+        stored = np.zeros((3, len(self.arms)))
+        for arm, successes, failures, pulls in BanditArm.objects.filter(arm__in=self.arms).values_list(
+            'arm', 'successes', 'failures', 'pulls'
+        ):
+            stored[:, self._positions[arm]] = (successes, failures, pulls)
+        with self._lock:
+            self._stored = stored
+
+    def statistics(self):
+        """(successes, failures, pulls) arrays aligned to self.arms, including unflushed events"""
+        self._refresh()
+        with self._lock:
+            totals = self._stored + self._pending
+        return totals[0], totals[1], totals[2]
+
+    def record(self, arm, feedback_type, count=1):
+        """Fold `count` feedback events of one type into the arm's posterior"""
+        position = self._positions.get(arm)
+        reward = REWARDS.get(feedback_type)
+        if position is None or reward is None:
+            return
+        with self._lock:
+            self._pending[0, position] += reward * count
+            self._pending[1, position] += (1.0 - reward) * count
+        bandit_flushes.add(arm)
+
+    def choose(self, user_id=None, record_pull=True):
+        """
+        Thompson-sample an arm.
+
+        With a user id the draw is seeded by (user, assignment window), so a
+        user keeps the same algorithm across page views until the window
+        rolls over or the posteriors move enough to change the winner. A
+        user's assignment counts as one pull per window, however many pages
+        they view. Pass record_pull=False to look up an assignment without
+        counting it.
+        """
+        successes, failures, _ = self.statistics()
+        if user_id is None:
+            rng = np.random.default_rng()
+        else:
+            seconds = settings.CYNARA_SETTINGS.get('BANDIT_ASSIGNMENT_SECONDS', 3600)
+            window = int(time.time() // seconds)
+            rng = np.random.default_rng([zlib.crc32(str(user_id).encode()), window])
+        position = int(np.argmax(rng.beta(successes + 1.0, failures + 1.0)))
+        if record_pull and user_id is not None:
+            # cache.add only succeeds for the first view of this assignment
+            key = f'cynara:bandit:pull:{user_id}:{window}:{self.arms[position]}'
+            record_pull = cache.add(key, True, seconds)
+        if record_pull:
+            with self._lock:
+                self._pending[2, position] += 1
+            bandit_flushes.add(self.arms[position])
+        return self.arms[position]
+
+    def flush(self):
+        """Add pending increments to BanditArm and reload the merged totals"""
+        with self._lock:
+            pending, self._pending = self._pending, np.zeros_like(self._pending)
+        with transaction.atomic():
+            for position, arm in enumerate(self.arms):
+                successes, failures, pulls = pending[:, position]
+                if not (successes or failures or pulls):
+                    continue
+                updated = BanditArm.objects.filter(arm=arm).update(
+                    successes=F('successes') + successes,
+                    failures=F('failures') + failures,
+                    pulls=F('pulls') + int(pulls),
+                )
+                if not updated:
+                    BanditArm.objects.create(arm=arm, successes=successes, failures=failures, pulls=int(pulls))
+        self._refresh(force=True)
+
+    def summary(self, samples=2000):
+        """
+        Per-arm statistics for inspection.
+
+        `share` is the Monte Carlo probability that the arm wins a draw,
+        i.e. the fraction of users it is currently being served to.
+        """
+        successes, failures, pulls = self.statistics()
+        alpha = successes + 1.0
+        beta = failures + 1.0
+        draws = np.random.default_rng().beta(alpha, beta, size=(samples, len(self.arms)))
+        share = np.bincount(np.argmax(draws, axis=1), minlength=len(self.arms)) / samples
+        mean = alpha / (alpha + beta)
+        spread = np.sqrt(alpha * beta / ((alpha + beta) ** 2 * (alpha + beta + 1)))
+        return [
+            {
+                'arm': arm,
+                'successes': float(successes[position]),
+                'failures': float(failures[position]),
+                'pulls': int(pulls[position]),
+                'mean': round(float(mean[position]), 4),
+                'std': round(float(spread[position]), 4),
+                'share': round(float(share[position]), 4),
+            }
+            for position, arm in enumerate(self.arms)
+        ]
+
+
+algorithm_bandit = AlgorithmBandit()
+
+
+@batcher(
+    delay=settings.CYNARA_SETTINGS.get('BANDIT_FLUSH_INTERVAL', 30),
+    max_delay=settings.CYNARA_SETTINGS.get('BANDIT_FLUSH_INTERVAL', 30),
+)
+def bandit_flushes(arms):
+    algorithm_bandit.flush()
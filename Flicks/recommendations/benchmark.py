@@ -0,0 +1,331 @@
+"""
+Cynara Recommendation Benchmark
+
+Generates a seeded synthetic catalog and interaction log, runs the whole
+offline pipeline (embeddings, snapshot, ANN index, user and movie
+similarity) and every recommendation algorithm against it, and reports
+timings, peak memory and ranking quality on a held-out split.
+
+Users get a hidden taste over genres; movies get a genre, a Zipf
+popularity and genre-flavoured metadata, so content, collaborative and
+popularity signals all carry real (and different) information. A fraction
+of each user's positive interactions is held back and never written; the
+metrics measure how many of those each algorithm recovers.
+
+Everything here writes to the current database, so callers run it
+against a throwaway one (see the benchmark_recommendations command).
+"""
+
+import math
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from movies.models import Genre, Movie, Rating, WatchHistory
+from .ann import IVFIndex, _percentiles
+from .embeddings import LocalEmbedder, build_embeddings
+from .engine import ALGORITHMS, popularity_scores, recommend_for_users, save_recommendations
+from .models import MovieEmbedding, RecommendationFeedback
+from .profiles import rebuild_user_profiles
+from .related import compute_movie_similarities
+from .similarity import SimilarityIndex, invalidate_similarity_index
+from .snapshot import write_snapshot
+
+GENRE_NAMES = [
+    'Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family',
+    'Fantasy', 'History', 'Horror', 'Music', 'Mystery', 'Romance', 'Science Fiction',
+    'Thriller', 'War', 'Western',
+]
+
+FILLER_WORDS = ['story', 'journey', 'life', 'night', 'city', 'family', 'secret', 'world', 'time', 'love']
+
+
+class Timer:
+    """Wall time and peak traced allocation of one phase"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.peak_bytes = 0
+
+    def as_dict(self):
+        result = {'seconds': round(self.seconds, 4)}
+        if self.peak_bytes:
+            result['peak_mb'] = round(self.peak_bytes / 2 ** 20, 2)
+        return result
+
+
+@contextmanager
+def measure(trace_memory=True):
+    """
+    Time a phase and, optionally, its peak Python/NumPy allocation.
+
+    tracemalloc slows allocation-heavy code noticeably, so timings taken
+    with trace_memory on are comparable with each other, not with a run
+    that has it off.
+    """
+    timer = Timer()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.seconds = time.perf_counter() - started
+        if trace_memory:
+            timer.peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def generate_dataset(movies=2000, users=1000, interactions=40, genres=12, holdout=0.2, seed=42):
+    """
+    Write a synthetic catalog and interaction log.
+
+    Returns {user_id: set(held-out movie ids)}: positive interactions (4+
+    stars, or completed without a rating) removed before writing.
+    """
+    rng = np.random.default_rng(seed)
+    genres = min(genres, len(GENRE_NAMES))
+    genre_objects = Genre.objects.bulk_create([
+        Genre(name=name, slug=name.lower().replace(' ', '-')) for name in GENRE_NAMES[:genres]
+    ])
+
+    # Movies: one primary genre, sometimes a second; Zipf popularity
+    primary = rng.integers(genres, size=movies)
+    secondary = np.where(rng.random(movies) < 0.4, rng.integers(genres, size=movies), -1)
+    popularity = 1.0 / np.arange(1, movies + 1) ** 0.8
+    rng.shuffle(popularity)
+
+    movie_objects = []
+    for index in range(movies):
+        genre = primary[index]
+        words = rng.choice(FILLER_WORDS, size=6).tolist()
+        words += [f'{GENRE_NAMES[genre].lower()}{n}' for n in rng.integers(8, size=4)]
+        movie_objects.append(Movie(
+            title=f'Synthetic Movie {index}',
+            slug=f'synthetic-movie-{index}',
+            description=' '.join(words),
+            year=int(rng.integers(1950, 2026)),
+            director=f'Director {genre}-{rng.integers(15)}',
+            cast=', '.join(f'Actor {genre}-{n}' for n in rng.choice(60, size=3, replace=False)),
+            file_path=f'synthetic/{index}.mp4',
+            is_available=True,
+        ))
+    movie_objects = Movie.objects.bulk_create(movie_objects, batch_size=1000)
+    movie_ids = [movie.id for movie in movie_objects]
+
+    # The through table directly: no m2m signals, one insert
+    through = Movie.genres.through
+    links = [through(movie_id=movie_ids[i], genre_id=genre_objects[primary[i]].id) for i in range(movies)]
+    links += [
+        through(movie_id=movie_ids[i], genre_id=genre_objects[secondary[i]].id)
+        for i in range(movies) if secondary[i] >= 0 and secondary[i] != primary[i]
+    ]
+    through.objects.bulk_create(links, batch_size=1000)
+
+    user_objects = User.objects.bulk_create(
+        [User(username=f'synthetic-{index}', password='!') for index in range(users)], batch_size=1000
+    )
+
+    # Users: a Dirichlet taste over genres, concentrated on a few
+    taste = rng.dirichlet(np.full(genres, 0.3), size=users)
+    ratings = []
+    watches = []
+    feedback = []
+    held_out = {}
+    view_counts = np.zeros(movies, dtype=np.int64)
+
+    for row, user in enumerate(user_objects):
+        affinity = taste[row][primary]
+        weights = popularity * (0.05 + affinity)
+        count = int(min(max(rng.poisson(interactions), 3), movies // 2))
+        chosen = rng.choice(movies, size=count, replace=False, p=weights / weights.sum())
+
+        liking = affinity[chosen] / affinity.max()
+        rated = rng.random(count) < 0.6
+        stars = np.clip(np.round(1.5 + 3.5 * liking + rng.normal(0, 0.7, count)), 1, 5).astype(int)
+        completed = rng.random(count) < 0.3 + 0.6 * liking
+        progress = np.where(completed, 1.0, rng.random(count))
+
+        positive = np.flatnonzero((rated & (stars >= 4)) | (~rated & completed))
+        rng.shuffle(positive)
+        cut = int(round(len(positive) * holdout)) if len(positive) > 1 else 0
+        held_out[user.id] = {movie_ids[chosen[position]] for position in positive[:cut]}
+        kept = np.ones(count, dtype=bool)
+        kept[positive[:cut]] = False
+
+        for position in np.flatnonzero(kept).tolist():
+            movie_id = movie_ids[chosen[position]]
+            if rated[position]:
+                ratings.append(Rating(user_id=user.id, movie_id=movie_id, rating=int(stars[position])))
+            watches.append(WatchHistory(
+                user_id=user.id, movie_id=movie_id, completed=bool(completed[position]),
+                progress_seconds=int(5400 * progress[position]),
+            ))
+        np.add.at(view_counts, chosen[kept], 1)
+
+        # A few dismissals of movies from genres the user doesn't care for
+        disliked = np.flatnonzero(affinity < 0.01)
+        for movie_index in rng.choice(disliked, size=min(2, len(disliked)), replace=False):
+            feedback.append(RecommendationFeedback(
+                user_id=user.id, movie_id=movie_ids[movie_index],
+                feedback_type='not_interested', recommendation_algorithm='hybrid',
+            ))
+
+    Rating.objects.bulk_create(ratings, batch_size=2000)
+    WatchHistory.objects.bulk_create(watches, batch_size=2000)
+    RecommendationFeedback.objects.bulk_create(feedback, batch_size=2000)
+    for movie, views in zip(movie_objects, view_counts):
+        movie.view_count = int(views)
+    Movie.objects.bulk_update(movie_objects, ['view_count'], batch_size=1000)
+
+    return {user_id: relevant for user_id, relevant in held_out.items() if relevant}
+
+
+def ranking_metrics(recommended, relevant, k):
+    """precision@k, recall@k and binary NDCG@k for one user"""
+    top = recommended[:k]
+    gains = [1.0 if movie_id in relevant else 0.0 for movie_id in top]
+    hits = sum(gains)
+    dcg = sum(gain / math.log2(position + 2) for position, gain in enumerate(gains))
+    ideal = sum(1.0 / math.log2(position + 2) for position in range(min(len(relevant), k)))
+    return hits / k, hits / len(relevant), dcg / ideal if ideal else 0.0
+
+
+def build_pipeline(workdir, trace_memory=True):
+    """Run every offline build step once; returns {step: timings}"""
+    steps = {}
+    with measure(trace_memory) as timer:
+        build_embeddings(LocalEmbedder(), concurrency=1)
+    steps['embeddings'] = timer.as_dict()
+
+    with measure(trace_memory) as timer:
+        rows = MovieEmbedding.objects.order_by('movie_id').values_list('movie_id', 'embedding_vector')
+        write_snapshot(os.path.join(workdir, 'embeddings.bin'), rows.iterator(chunk_size=2000))
+        invalidate_similarity_index()
+    steps['snapshot'] = timer.as_dict()
+
+    with measure(trace_memory) as timer:
+        exact = SimilarityIndex.from_queryset()
+        IVFIndex.build(exact.movie_ids, exact.matrix).save(os.path.join(workdir, 'ann'))
+    steps['ann_index'] = timer.as_dict()
+
+    with measure(trace_memory) as timer:
+        rebuild_user_profiles()
+    steps['user_profiles'] = timer.as_dict()
+
+    with measure(trace_memory) as timer:
+        compute_movie_similarities()
+    steps['movie_similarity'] = timer.as_dict()
+    return steps
+
+
+def evaluate_algorithm(algorithm, held_out, k, chunk_size=500, latency_samples=200, seed=0, trace_memory=True):
+    """Batch-score every user, then time single-user queries and score quality"""
+    user_ids = sorted(User.objects.filter(username__startswith='synthetic-').values_list('id', flat=True))
+    popular = popularity_scores()
+
+    results = {}
+    with measure(trace_memory) as timer:
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = recommend_for_users(user_ids[start:start + chunk_size], algorithm, count=k, popular=popular)
+            save_recommendations(chunk, algorithm)
+            results.update(chunk)
+    batch = timer.as_dict()
+    batch['users_per_second'] = round(len(user_ids) / timer.seconds, 1) if timer.seconds else None
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(user_ids, size=min(latency_samples, len(user_ids)), replace=False)
+    latencies = []
+    for user_id in sample.tolist():
+        started = time.perf_counter()
+        recommend_for_users([user_id], algorithm, count=k, popular=popular)
+        latencies.append(time.perf_counter() - started)
+
+    scores = np.array([
+        ranking_metrics([movie_id for movie_id, _, _ in results.get(user_id, [])], relevant, k)
+        for user_id, relevant in held_out.items()
+    ]).reshape(-1, 3)
+    quality = dict(zip(
+        (f'precision@{k}', f'recall@{k}', f'ndcg@{k}'),
+        (round(float(value), 4) for value in (scores.mean(axis=0) if len(scores) else (0.0, 0.0, 0.0))),
+    ))
+    quality['users_evaluated'] = len(scores)
+
+    return {
+        'batch': batch,
+        'latency_ms': {key: round(value, 3) for key, value in _percentiles(latencies).items()},
+        'quality': quality,
+    }
+
+
+def run_benchmark(movies=2000, users=1000, interactions=40, genres=12, holdout=0.2, k=10,
+                  algorithms=None, latency_samples=200, seed=42, trace_memory=True, progress=None):
+    """Generate data, build everything, evaluate each algorithm; returns the JSON-able report"""
+    algorithms = algorithms or ALGORITHMS
+    report = {
+        'created_at': timezone.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+        },
+        'config': {
+            'movies': movies, 'users': users, 'interactions': interactions, 'genres': genres,
+            'holdout': holdout, 'k': k, 'seed': seed, 'latency_samples': latency_samples,
+            'trace_memory': trace_memory,
+        },
+    }
+
+    with tempfile.TemporaryDirectory(prefix='cynara-bench-') as workdir:
+        overrides = dict(
+            settings.CYNARA_SETTINGS,
+            EMBEDDING_SNAPSHOT_PATH=os.path.join(workdir, 'embeddings.bin'),
+            ANN_INDEX_PATH=os.path.join(workdir, 'ann'),
+            BACKGROUND_TASKS=False,
+        )
+        with override_settings(CYNARA_SETTINGS=overrides):
+            if progress:
+                progress('generating data')
+            with measure(trace_memory) as timer:
+                held_out = generate_dataset(movies, users, interactions, genres, holdout, seed)
+            report['generate'] = timer.as_dict()
+            report['dataset'] = {
+                'ratings': Rating.objects.count(),
+                'watches': WatchHistory.objects.count(),
+                'feedback': RecommendationFeedback.objects.count(),
+                'held_out': sum(len(relevant) for relevant in held_out.values()),
+            }
+
+            if progress:
+                progress('building indexes')
+            report['build'] = build_pipeline(workdir, trace_memory)
+
+            report['algorithms'] = {}
+            for algorithm in algorithms:
+                if progress:
+                    progress(f'evaluating {algorithm}')
+                report['algorithms'][algorithm] = evaluate_algorithm(
+                    algorithm, held_out, k, latency_samples=latency_samples, seed=seed,
+                    trace_memory=trace_memory,
+                )
+            invalidate_similarity_index()
+
+    if resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report['peak_rss_mb'] = round(max_rss / (2 ** 20 if platform.system() == 'Darwin' else 2 ** 10), 1)
+    return report
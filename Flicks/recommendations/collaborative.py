@@ -0,0 +1,172 @@
+"""
+Cynara Collaborative Filtering
+
+Builds a sparse user x movie matrix from completed watches and ratings and
+computes each user's top-k neighbours for UserSimilarity. Similarities are
+produced a block of users at a time with sparse matrix products, so memory
+is bounded by the block size rather than by the number of user pairs.
+"""
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from scipy import sparse
+
+from movies.models import Rating, WatchHistory
+from .engine import COMPLETED_WATCH_RATING
+from .models import UserSimilarity
+
+
+class UserItemMatrix:
+    """Row-normalized CSR matrix with the user/movie ids for each row/column"""
+
+    def __init__(self, user_ids, movie_ids, matrix):
+        self.user_ids = user_ids
+        self.movie_ids = movie_ids
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @classmethod
+    def build(cls, user_ids=None):
+        """
+        Stream watches and ratings once each into COO arrays, then compress.
+
+        Values are centred on 3 stars so dislikes count against similarity;
+        an explicit rating replaces the implicit signal of a completed watch.
+        """
+        watches = WatchHistory.objects.filter(completed=True)
+        ratings = Rating.objects.all()
+        if user_ids is not None:
+            watches = watches.filter(user_id__in=user_ids)
+            ratings = ratings.filter(user_id__in=user_ids)
+
+        watch_pairs = np.fromiter(
+            (value for pair in watches.values_list('user_id', 'movie_id').iterator(chunk_size=10000)
+             for value in pair),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        rating_rows = np.fromiter(
+            (value for row in ratings.values_list('user_id', 'movie_id', 'rating').iterator(chunk_size=10000)
+             for value in row),
+            dtype=np.int64,
+        ).reshape(-1, 3)
+
+        users = np.concatenate((watch_pairs[:, 0], rating_rows[:, 0]))
+        movies = np.concatenate((watch_pairs[:, 1], rating_rows[:, 1]))
+        values = np.concatenate((
+            np.full(len(watch_pairs), COMPLETED_WATCH_RATING - 3, dtype=np.float32),
+            (rating_rows[:, 2] - 3).astype(np.float32),
+        ))
+
+        user_ids, rows = np.unique(users, return_inverse=True)
+        movie_ids, columns = np.unique(movies, return_inverse=True)
+
+        # Ratings come after watches, so keeping the *last* entry per cell
+        # lets explicit ratings win
+        cells = rows * len(movie_ids) + columns
+        _, last = np.unique(cells[::-1], return_index=True)
+        keep = len(cells) - 1 - last
+
+        matrix = sparse.csr_matrix(
+            (values[keep], (rows[keep], columns[keep])),
+            shape=(len(user_ids), len(movie_ids)),
+            dtype=np.float32,
+        )
+        matrix.eliminate_zeros()
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        matrix = sparse.diags(1.0 / norms).dot(matrix).tocsr().astype(np.float32)
+        return cls(user_ids, movie_ids, matrix)
+
+    def row_for(self, user_id):
+        row = int(np.searchsorted(self.user_ids, user_id))
+        if row < len(self.user_ids) and self.user_ids[row] == user_id:
+            return row
+        return None
+
+
+def top_k_neighbours(matrix, rows, k, others=None, min_score=0.0):
+    """
+    Cosine top-k for the given rows of a row-normalized CSR matrix.
+
+    Returns (row_index, neighbour_row_indices, scores) per row. `others` is
+    the matrix to compare against (defaults to `matrix` itself); pass its
+    transpose pre-computed when calling repeatedly.
+    """
+    others_t = others if others is not None else matrix.T.tocsr()
+    products = (matrix[rows] @ others_t).tocsr()
+
+    results = []
+    for position, row in enumerate(rows):
+        start, end = products.indptr[position], products.indptr[position + 1]
+        neighbours = products.indices[start:end]
+        scores = products.data[start:end]
+
+        mask = (neighbours != row) & (scores > min_score)
+        neighbours = neighbours[mask]
+        scores = scores[mask]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            neighbours = neighbours[best]
+            scores = scores[best]
+        order = np.argsort(-scores, kind='stable')
+        results.append((row, neighbours[order], scores[order]))
+    return results
+
+
+def save_neighbours(user_matrix, results):
+    """Upsert one block of neighbour lists in a single transaction"""
+    user_ids = user_matrix.user_ids
+    objects = [
+        UserSimilarity(
+            user1_id=int(user_ids[row]),
+            user2_id=int(user_ids[neighbour]),
+            similarity_score=round(float(score), 6),
+        )
+        for row, neighbours, scores in results
+        for neighbour, score in zip(neighbours, scores)
+    ]
+    if objects:
+        with transaction.atomic():
+            UserSimilarity.objects.bulk_create(
+                objects,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['user1', 'user2'],
+                update_fields=['similarity_score', 'last_calculated'],
+            )
+    return len(objects)
+
+
+def compute_user_similarities(k=None, block_size=None, progress=None):
+    """
+    Recompute UserSimilarity for every user with interactions.
+
+    `progress`, if given, is called with (users_done, users_total) after
+    each block is written. Returns the number of pairs stored.
+    """
+    options = settings.CYNARA_SETTINGS
+    k = k or options.get('USER_SIMILARITY_TOP_K', 50)
+    block_size = block_size or options.get('USER_SIMILARITY_BLOCK_SIZE', 512)
+
+    calculated_at = timezone.now()
+    user_matrix = UserItemMatrix.build()
+    if not len(user_matrix):
+        return 0
+
+    transposed = user_matrix.matrix.T.tocsr()
+    stored = 0
+    for start in range(0, len(user_matrix), block_size):
+        rows = np.arange(start, min(start + block_size, len(user_matrix)))
+        results = top_k_neighbours(user_matrix.matrix, rows, k, others=transposed)
+        stored += save_neighbours(user_matrix, results)
+        if progress is not None:
+            progress(rows[-1] + 1, len(user_matrix))
+
+    # Every pair still valid was just rewritten; anything older is stale
+    UserSimilarity.objects.filter(last_calculated__lt=calculated_at).delete()
+    return stored
@@ -0,0 +1,286 @@
+"""
+Cynara Embeddings
+
+Builds MovieEmbedding vectors from each movie's text (title, description,
+genres, cast, director). The text is hashed together with the backend name
+so unchanged movies are skipped; changed ones are embedded in batches with
+a bounded number of requests in flight and written with bulk operations.
+
+Backends share one interface, `embed(texts) -> [[float, ...], ...]`:
+OpenAIEmbedder calls the embeddings API; LocalEmbedder is a deterministic
+hashed bag-of-words projection that needs no network, for development and
+benchmarks.
+"""
+
+import hashlib
+import random
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from movies.models import Movie
+from .models import MovieEmbedding
+from .similarity import invalidate_similarity_index
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+class EmbeddingError(Exception):
+    """An embedding request failed; `retryable` says whether to try again"""
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class EmbeddingBackend:
+    """Interface for embedding providers"""
+    name = 'base'
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+
+class LocalEmbedder(EmbeddingBackend):
+    """
+    Signed feature hashing of word unigrams and bigrams.
+
+    Each token is hashed (blake2b, so results don't depend on PYTHONHASHSEED)
+    to one of `dimensions` buckets with a +/-1 sign, which is a sparse random
+    projection of the bag of words. Term counts are log-scaled and vectors
+    L2-normalized, so cosine similarity behaves like TF cosine.
+    """
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+        self.name = f'local-hash-{dimensions}'
+
+    def _features(self, text):
+        words = _TOKEN.findall(text.lower())
+        tokens = words + [f'{a}_{b}' for a, b in zip(words, words[1:])]
+        buckets = np.empty(len(tokens), dtype=np.int64)
+        signs = np.empty(len(tokens), dtype=np.float32)
+        for position, token in enumerate(tokens):
+            digest = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little')
+            buckets[position] = digest % self.dimensions
+            signs[position] = 1.0 if digest >> 63 else -1.0
+        return buckets, signs
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets, signs = self._features(text)
+            counts = np.zeros(self.dimensions, dtype=np.float32)
+            np.add.at(counts, buckets, signs)
+            matrix[row] = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        return matrix.tolist()
+
+
+class OpenAIEmbedder(EmbeddingBackend):
+    """OpenAI embeddings API over plain HTTP"""
+    url = 'https://api.openai.com/v1/embeddings'
+
+    def __init__(self, api_key, model='text-embedding-3-small', timeout=60):
+        if not api_key:
+            raise EmbeddingError('OPENAI_API_KEY is not configured')
+        self.model = model
+        self.name = f'openai-{model}'
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+    def embed(self, texts):
+        try:
+            response = self.session.post(
+                self.url, json={'model': self.model, 'input': texts}, timeout=self.timeout
+            )
+        except requests.RequestException as exc:
+            raise EmbeddingError(str(exc), retryable=True)
+
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get('Retry-After')
+            raise EmbeddingError(
+                f'HTTP {response.status_code}',
+                retryable=True,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        if response.status_code != 200:
+            raise EmbeddingError(f'HTTP {response.status_code}: {response.text[:200]}')
+
+        data = sorted(response.json()['data'], key=lambda item: item['index'])
+        return [item['embedding'] for item in data]
+
+
+def get_backend(name=None):
+    name = name or settings.CYNARA_SETTINGS.get('EMBEDDING_BACKEND', 'local')
+    if name == 'local':
+        return LocalEmbedder()
+    if name == 'openai':
+        return OpenAIEmbedder(
+            settings.OPENAI_API_KEY,
+            model=settings.CYNARA_SETTINGS.get('EMBEDDING_MODEL', 'text-embedding-3-small'),
+        )
+    raise EmbeddingError(f'Unknown embedding backend: {name}')
+
+
+def movie_text(title, description, genres, cast, director, year=None):
+    """The text a movie is embedded from; any change here re-embeds the catalog"""
+    parts = [title + (f' ({year})' if year else '')]
+    if genres:
+        parts.append('Genres: ' + ', '.join(sorted(genres)))
+    if director:
+        parts.append(f'Director: {director}')
+    if cast:
+        parts.append(f'Cast: {cast}')
+    if description:
+        parts.append(description)
+    return '\n'.join(parts)
+
+
+def content_hash(text, backend_name):
+    return hashlib.sha256(f'{backend_name}\n{text}'.encode()).hexdigest()
+
+
+def embed_with_retries(backend, texts, max_retries=None, base_delay=1.0):
+    """Call backend.embed, backing off exponentially (with jitter) on retryable errors"""
+    max_retries = max_retries or settings.CYNARA_SETTINGS.get('EMBEDDING_MAX_RETRIES', 5)
+    for attempt in range(1, max_retries + 1):
+        try:
+            return backend.embed(texts)
+        except EmbeddingError as exc:
+            if not exc.retryable or attempt == max_retries:
+                raise
+            delay = exc.retry_after or base_delay * 2 ** (attempt - 1)
+            time.sleep(delay * random.uniform(0.8, 1.2))
+
+
+def pending_movies(backend, force=False, limit=None, chunk_size=2000):
+    """
+    Yield (movie_id, text, hash) for movies whose embedding is missing or stale.
+
+    Reads the catalog a chunk at a time: movies, genres and stored hashes are
+    one query each per chunk.
+    """
+    queryset = Movie.objects.order_by('id').values_list('id', 'title', 'description', 'cast', 'director', 'year')
+    last_id = 0
+    yielded = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+        movie_ids = [row[0] for row in chunk]
+
+        genres = {}
+        for movie_id, name in Movie.genres.through.objects.filter(
+            movie_id__in=movie_ids
+        ).values_list('movie_id', 'genre__name'):
+            genres.setdefault(movie_id, []).append(name)
+        stored = {} if force else dict(
+            MovieEmbedding.objects.filter(movie_id__in=movie_ids).values_list('movie_id', 'content_hash')
+        )
+
+        for movie_id, title, description, cast, director, year in chunk:
+            text = movie_text(title, description, genres.get(movie_id), cast, director, year)
+            digest = content_hash(text, backend.name)
+            if stored.get(movie_id) != digest:
+                yield movie_id, text, digest
+                yielded += 1
+                if limit and yielded >= limit:
+                    return
+
+
+def save_embeddings(backend, batch, vectors):
+    """Write one batch: bulk_update existing rows, bulk_create new ones"""
+    now = timezone.now()
+    movie_ids = [movie_id for movie_id, _, _ in batch]
+    by_movie = {
+        embedding.movie_id: embedding
+        for embedding in MovieEmbedding.objects.filter(movie_id__in=movie_ids).only('id', 'movie_id')
+    }
+
+    updated = []
+    created = []
+    for (movie_id, _, digest), vector in zip(batch, vectors):
+        vector = [round(float(value), 6) for value in vector]
+        embedding = by_movie.get(movie_id)
+        if embedding is None:
+            created.append(MovieEmbedding(
+                movie_id=movie_id, embedding_vector=vector, content_hash=digest, model_name=backend.name
+            ))
+        else:
+            embedding.embedding_vector = vector
+            embedding.content_hash = digest
+            embedding.model_name = backend.name
+            embedding.updated_at = now
+            updated.append(embedding)
+
+    with transaction.atomic():
+        if updated:
+            MovieEmbedding.objects.bulk_update(
+                updated, ['embedding_vector', 'content_hash', 'model_name', 'updated_at'], batch_size=500
+            )
+        if created:
+            MovieEmbedding.objects.bulk_create(created, batch_size=500)
+    return len(updated) + len(created)
+
+
+def build_embeddings(backend=None, batch_size=None, concurrency=None, force=False, limit=None, progress=None):
+    """
+    Embed every movie whose text changed since it was last embedded.
+
+    At most `concurrency` batches are in flight; results are written from
+    this thread as they arrive, so a failure part-way keeps finished work.
+    `progress`, if given, is called with the running count of movies
+    written. Returns that count.
+    """
+    backend = backend or get_backend()
+    batch_size = batch_size or settings.CYNARA_SETTINGS.get('EMBEDDING_BATCH_SIZE', 256)
+    concurrency = concurrency or settings.CYNARA_SETTINGS.get('EMBEDDING_CONCURRENCY', 4)
+
+    def batches():
+        batch = []
+        for item in pending_movies(backend, force=force, limit=limit):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    written = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+        source = batches()
+        try:
+            while True:
+                while len(in_flight) < concurrency:
+                    batch = next(source, None)
+                    if batch is None:
+                        break
+                    future = executor.submit(embed_with_retries, backend, [text for _, text, _ in batch])
+                    in_flight[future] = batch
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    written += save_embeddings(backend, batch, future.result())
+                    if progress is not None:
+                        progress(written)
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if written:
+                # Bulk writes skip the post_save hook that normally does this
+                invalidate_similarity_index()
+    return written
@@ -0,0 +1,289 @@
+"""
+Cynara Recommendation Engine
+
+Candidate scoring for each RecommendationSet algorithm. Everything works on
+a chunk of users at a time: the per-user inputs (ratings, watch history,
+neighbours) are fetched with one query per table for the whole chunk, so
+precomputing thousands of users costs a handful of queries, not thousands.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from movies.models import Movie, Rating, WatchHistory
+from .ann import search_candidates
+from .feedback import negative_filters
+from .models import RecommendationItem, RecommendationSet, UserSimilarity
+from .ranking import HybridRanker, collaborative_arrays, get_catalog_features, lookup
+from .similarity import get_similarity_index
+
+ALGORITHMS = [choice for choice, _ in RecommendationSet._meta.get_field('algorithm_used').choices]
+
+REASONS = {
+    'collaborative': 'Viewers with similar taste enjoyed this',
+    'content_based': 'Similar to movies you enjoyed',
+    'hybrid': 'Picked for you',
+    'popularity': 'Popular on Cynara',
+}
+
+# A completed watch counts like a 4-star rating when building taste vectors
+COMPLETED_WATCH_RATING = 4
+
+
+def get_recommendation_count():
+    return settings.CYNARA_SETTINGS.get('RECOMMENDATIONS_COUNT', 6)
+
+
+def get_recommendation_ttl():
+    return timedelta(hours=settings.CYNARA_SETTINGS.get('RECOMMENDATIONS_TTL_HOURS', 24))
+
+
+class UserSignals:
+    """Ratings, watches and neighbours for a chunk of users, fetched in bulk"""
+
+    def __init__(self, user_ids, neighbours=20):
+        self.user_ids = list(user_ids)
+        self.seen = defaultdict(set)
+        self.preferences = defaultdict(dict)  # user_id -> {movie_id: rating-like weight}
+        self.neighbours = defaultdict(list)  # user_id -> [(other_user_id, similarity)]
+
+        for user_id, movie_id, completed in WatchHistory.objects.filter(
+            user_id__in=self.user_ids
+        ).values_list('user_id', 'movie_id', 'completed').iterator():
+            self.seen[user_id].add(movie_id)
+            if completed:
+                self.preferences[user_id].setdefault(movie_id, COMPLETED_WATCH_RATING)
+
+        # Explicit ratings override the implicit signal from completed watches
+        for user_id, movie_id, rating in Rating.objects.filter(
+            user_id__in=self.user_ids
+        ).values_list('user_id', 'movie_id', 'rating').iterator():
+            self.seen[user_id].add(movie_id)
+            self.preferences[user_id][movie_id] = rating
+
+        for user1_id, user2_id, score in UserSimilarity.objects.filter(
+            user1_id__in=self.user_ids
+        ).order_by('user1_id', '-similarity_score').values_list(
+            'user1_id', 'user2_id', 'similarity_score'
+        ).iterator():
+            if len(self.neighbours[user1_id]) < neighbours:
+                self.neighbours[user1_id].append((user2_id, score))
+
+    def taste_vector(self, user_id, index):
+        """Rating-weighted mean of the embeddings of movies the user liked"""
+        preferences = self.preferences.get(user_id)
+        if not preferences or not len(index):
+            return None
+        rows = []
+        weights = []
+        for movie_id, rating in preferences.items():
+            row = index.row_for(movie_id)
+            # Centre on 3 stars so disliked movies push the vector away
+            if row is not None and rating != 3:
+                rows.append(row)
+                weights.append(rating - 3)
+        if not rows:
+            return None
+        vector = np.asarray(weights, dtype=np.float32) @ index.matrix[rows]
+        return vector if np.any(vector) else None
+
+
+def popularity_scores(limit=200):
+    """[(movie_id, score)] for the most viewed available movies, scores in (0, 1]"""
+    rows = list(
+        Movie.objects.filter(is_available=True)
+        .order_by('-view_count')
+        .values_list('id', 'view_count')[:limit]
+    )
+    if not rows:
+        return []
+    top = max(rows[0][1], 1)
+    return [(movie_id, max(views, 0) / top) for movie_id, views in rows]
+
+
+def score_popularity(user_id, signals, popular, count):
+    seen = signals.seen.get(user_id, set())
+    return [(movie_id, score) for movie_id, score in popular if movie_id not in seen][:count]
+
+
+def score_content_based(user_id, signals, popular, count, index=None):
+    index = index if index is not None else get_similarity_index()
+    vector = signals.taste_vector(user_id, index)
+    if vector is None:
+        return []
+    return search_candidates(vector, k=count, exclude=signals.seen.get(user_id, ()))
+
+
+def score_collaborative(user_id, signals, popular, count, neighbour_preferences=None, catalog=None):
+    """Movies neighbours liked, weighted by how similar each neighbour is"""
+    neighbours = signals.neighbours.get(user_id)
+    if not neighbours:
+        return []
+    if neighbour_preferences is None:
+        neighbour_preferences = fetch_neighbour_preferences([signals])
+    catalog = catalog or get_catalog_features()
+
+    seen = signals.seen.get(user_id, set())
+    totals = defaultdict(float)
+    weight_sum = 0.0
+    for other_id, similarity in neighbours:
+        weight_sum += abs(similarity)
+        for movie_id, rating in neighbour_preferences.get(other_id, {}).items():
+            if movie_id not in seen:
+                totals[movie_id] += similarity * (rating - 3) / 2
+    if not totals or not weight_sum:
+        return []
+
+    # Neighbours' history includes movies that have since been withdrawn
+    movie_ids = np.fromiter(totals, dtype=np.int64, count=len(totals))
+    rows, known = lookup(catalog.movie_ids, movie_ids)
+    available = set(movie_ids[known & catalog.available[rows]].tolist())
+    ranked = sorted(
+        ((movie_id, score) for movie_id, score in totals.items() if movie_id in available),
+        key=lambda item: item[1], reverse=True,
+    )[:count]
+    return [(movie_id, max(0.0, min(1.0, score / weight_sum))) for movie_id, score in ranked if score > 0]
+
+
+def fetch_neighbour_preferences(signals_list):
+    """One query for the preferences of every neighbour in the chunk"""
+    other_ids = {
+        other_id
+        for signals in signals_list
+        for neighbours in signals.neighbours.values()
+        for other_id, _ in neighbours
+    }
+    if not other_ids:
+        return {}
+    return UserSignals(other_ids, neighbours=0).preferences
+
+
+def score_hybrid(user_id, signals, popular, count, neighbour_preferences=None, index=None, ranker=None):
+    """Content, collaborative, popularity and recency blended by the vectorized ranker"""
+    ranker = ranker or HybridRanker(index=index)
+    seen = signals.seen.get(user_id, set())
+    if neighbour_preferences is None:
+        neighbour_preferences = fetch_neighbour_preferences([signals])
+
+    taste = signals.taste_vector(user_id, ranker.index)
+    collaborative = collaborative_arrays(signals.neighbours.get(user_id, ()), neighbour_preferences, seen)
+    pool = settings.CYNARA_SETTINGS.get('HYBRID_CANDIDATES', 500)
+    candidates = ranker.candidates(
+        taste_vector=taste,
+        collaborative_ids=collaborative[0][np.argsort(-collaborative[1])[:pool]],
+        popular_ids=[movie_id for movie_id, _ in popular],
+        pool=pool,
+        exclude=seen,
+    )
+    liked = [movie_id for movie_id, rating in signals.preferences.get(user_id, {}).items() if rating >= 4]
+    return ranker.rank(
+        candidates, count,
+        taste_vector=taste,
+        collaborative=collaborative,
+        exclude=np.fromiter(seen, dtype=np.int64, count=len(seen)),
+        liked_ids=liked,
+    )
+
+
+SCORERS = {
+    'collaborative': score_collaborative,
+    'content_based': score_content_based,
+    'hybrid': score_hybrid,
+    'popularity': score_popularity,
+}
+
+
+def recommend_for_users(user_ids, algorithm='hybrid', count=None, popular=None):
+    """
+    Score recommendations for a chunk of users.
+
+    Returns {user_id: [(movie_id, score, reason), ...]}. Lists shorter than
+    `count` are topped up with popular movies so nobody gets an empty row.
+    """
+    count = count or get_recommendation_count()
+    popular = popular if popular is not None else popularity_scores()
+    signals = UserSignals(user_ids)
+    index = get_similarity_index()
+
+    # Dismissed movies are never recommended again; one query per chunk
+    negative_filters.load_many(signals.user_ids)
+    for user_id in signals.user_ids:
+        signals.seen[user_id].update(negative_filters.get(user_id).tolist())
+
+    extra = {}
+    if algorithm in ('collaborative', 'hybrid'):
+        extra['neighbour_preferences'] = fetch_neighbour_preferences([signals])
+    if algorithm == 'collaborative':
+        extra['catalog'] = get_catalog_features()
+    if algorithm == 'content_based':
+        extra['index'] = index
+    if algorithm == 'hybrid':
+        extra['ranker'] = HybridRanker(index=index)
+
+    scorer = SCORERS[algorithm]
+    results = {}
+    for user_id in signals.user_ids:
+        scored = scorer(user_id, signals, popular, count, **extra)
+        # Scorers may explain each item themselves; otherwise use the algorithm's reason
+        items = [(movie_id, score, reason[0] if reason else REASONS[algorithm]) for movie_id, score, *reason in scored]
+        if len(items) < count:
+            chosen = {movie_id for movie_id, _, _ in items}
+            for movie_id, score in score_popularity(user_id, signals, popular, count * 2):
+                if len(items) >= count:
+                    break
+                if movie_id not in chosen:
+                    items.append((movie_id, score * 0.5, REASONS['popularity']))
+        results[user_id] = items
+    return results
+
+
+def save_recommendations(results, algorithm, ttl=None):
+    """
+    Replace the users' sets for one algorithm in a single transaction.
+
+    Sets and items are written with one bulk_create each; the users' older
+    sets for the same algorithm are removed so the table doesn't grow.
+    Users with nothing to recommend get an empty set too, so serving sees a
+    fresh set and doesn't queue another refresh before it expires.
+    """
+    now = timezone.now()
+    expires_at = now + (ttl or get_recommendation_ttl())
+    user_ids = list(results)
+    if not user_ids:
+        return 0
+
+    with transaction.atomic():
+        RecommendationSet.objects.filter(
+            user_id__in=user_ids, algorithm_used=algorithm
+        ).delete()
+
+        sets = RecommendationSet.objects.bulk_create([
+            RecommendationSet(
+                user_id=user_id,
+                algorithm_used=algorithm,
+                confidence_score=(
+                    float(np.mean([score for _, score, _ in results[user_id]])) if results[user_id] else 0.0
+                ),
+                expires_at=expires_at,
+            )
+            for user_id in user_ids
+        ])
+
+        RecommendationItem.objects.bulk_create([
+            RecommendationItem(
+                recommendation_set=recommendation_set,
+                movie_id=movie_id,
+                score=round(float(score), 4),
+                reason=reason[:200],
+                position=position,
+            )
+            for recommendation_set in sets
+            for position, (movie_id, score, reason) in enumerate(results[recommendation_set.user_id], start=1)
+        ], batch_size=1000)
+
+    return len(user_ids)
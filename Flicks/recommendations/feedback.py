@@ -0,0 +1,226 @@
+"""
+Cynara Recommendation Feedback
+
+Feedback clicks are buffered per (user, movie), keeping only the latest,
+and written in batches with one upsert. Each process keeps the movies a
+user dismissed ("not_interested"/"disliked") as a sorted int array so the
+ranking code can drop them from candidate lists without another query.
+Counts are rolled up per recommendation algorithm as they are flushed,
+and outcomes that changed are credited to the algorithm bandit.
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from movies.models import Movie
+from .bandit import algorithm_bandit
+from .models import AlgorithmFeedbackStats, RecommendationFeedback
+from .tasks import batcher
+
+FEEDBACK_TYPES = [choice for choice, _ in RecommendationFeedback._meta.get_field('feedback_type').choices]
+NEGATIVE_TYPES = ('not_interested', 'disliked')
+
+_latest = {}
+_latest_lock = threading.Lock()
+
+
+def record_feedback(user_id, movie_id, feedback_type, algorithm):
+    """Buffer one feedback event; the newest event per (user, movie) wins"""
+    with _latest_lock:
+        _latest[(user_id, movie_id)] = (feedback_type, algorithm)
+    negative_filters.apply(user_id, movie_id, feedback_type in NEGATIVE_TYPES)
+    feedback_flushes.add((user_id, movie_id))
+
+
+@batcher(
+    delay=settings.CYNARA_SETTINGS.get('FEEDBACK_FLUSH_DELAY', 1.0),
+    max_delay=settings.CYNARA_SETTINGS.get('FEEDBACK_FLUSH_MAX_DELAY', 5.0),
+)
+def feedback_flushes(keys):
+    with _latest_lock:
+        events = {key: _latest.pop(key) for key in keys if key in _latest}
+    if not events:
+        return
+    try:
+        write_feedback(events)
+    except Exception:
+        # Keep the batch for the next flush, unless a newer click replaced it meanwhile
+        with _latest_lock:
+            for key, value in events.items():
+                _latest.setdefault(key, value)
+        feedback_flushes.retry(events)
+        raise
+
+
+def write_feedback(events):
+    """
+    Upsert {(user_id, movie_id): (feedback_type, algorithm)} in one statement
+    and adjust the per-algorithm rollup by the difference.
+    """
+    movie_ids = {movie_id for _, movie_id in events}
+    valid = set(Movie.objects.filter(id__in=movie_ids).values_list('id', flat=True))
+    events = {key: value for key, value in events.items() if key[1] in valid}
+    if not events:
+        return 0
+
+    user_ids = {user_id for user_id, _ in events}
+    previous = {
+        (user_id, movie_id): (feedback_type, algorithm)
+        for user_id, movie_id, feedback_type, algorithm in RecommendationFeedback.objects.filter(
+            user_id__in=user_ids, movie_id__in=valid
+        ).values_list('user_id', 'movie_id', 'feedback_type', 'recommendation_algorithm')
+    }
+
+    deltas = Counter()
+    outcomes = Counter()
+    for key, value in events.items():
+        old = previous.get(key)
+        if old == value:
+            continue
+        if old is not None:
+            deltas[old] -= 1
+        deltas[value] += 1
+        outcomes[value] += 1
+
+    with transaction.atomic():
+        RecommendationFeedback.objects.bulk_create(
+            [
+                RecommendationFeedback(
+                    user_id=user_id,
+                    movie_id=movie_id,
+                    feedback_type=feedback_type,
+                    recommendation_algorithm=algorithm,
+                )
+                for (user_id, movie_id), (feedback_type, algorithm) in events.items()
+            ],
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['user', 'movie'],
+            update_fields=['feedback_type', 'recommendation_algorithm'],
+        )
+        # At most algorithms x feedback types rows, so this stays a few queries.
+        # Missing rows are inserted at zero first; another worker may be inserting the same ones.
+        changed = {key: delta for key, delta in deltas.items() if delta}
+        AlgorithmFeedbackStats.objects.bulk_create(
+            [
+                AlgorithmFeedbackStats(algorithm=algorithm, feedback_type=feedback_type, count=0)
+                for feedback_type, algorithm in changed
+            ],
+            ignore_conflicts=True,
+        )
+        for (feedback_type, algorithm), delta in changed.items():
+            AlgorithmFeedbackStats.objects.filter(
+                algorithm=algorithm, feedback_type=feedback_type
+            ).update(count=F('count') + delta)
+
+    # The bandit learns from (user, movie) outcomes that changed, not from repeated clicks
+    for (feedback_type, algorithm), count in outcomes.items():
+        algorithm_bandit.record(algorithm, feedback_type, count)
+    return len(events)
+
+
+def algorithm_feedback_summary():
+    """{algorithm: {feedback_type: count, ..., 'total': n}} from the rollup table"""
+    summary = {}
+    for algorithm, feedback_type, count in AlgorithmFeedbackStats.objects.values_list(
+        'algorithm', 'feedback_type', 'count'
+    ):
+        row = summary.setdefault(algorithm, dict.fromkeys(FEEDBACK_TYPES, 0))
+        row[feedback_type] = count
+    for row in summary.values():
+        row['total'] = sum(row[feedback_type] for feedback_type in FEEDBACK_TYPES)
+    return summary
+
+
+class NegativeFilters:
+    """
+    Per-user sorted arrays of dismissed movie ids, held in process memory.
+
+    Entries are loaded in bulk, patched in place when this process records
+    feedback, and reloaded after NEGATIVE_FILTER_TTL so feedback recorded by
+    other workers shows up too. The least recently used users are evicted
+    beyond NEGATIVE_FILTER_MAX_USERS.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()  # user_id -> (loaded_at, np.ndarray)
+        self._lock = threading.Lock()
+
+    def _ttl(self):
+        return settings.CYNARA_SETTINGS.get('NEGATIVE_FILTER_TTL', 300)
+
+    def load_many(self, user_ids):
+        """Make sure every user has a fresh entry; one query for all misses"""
+        now = time.monotonic()
+        with self._lock:
+            missing = [
+                user_id for user_id in set(user_ids)
+                if user_id not in self._entries or now - self._entries[user_id][0] >= self._ttl()
+            ]
+        if not missing:
+            return
+
+        found = {user_id: [] for user_id in missing}
+        for user_id, movie_id in RecommendationFeedback.objects.filter(
+            user_id__in=missing, feedback_type__in=NEGATIVE_TYPES
+        ).values_list('user_id', 'movie_id').iterator():
+            found[user_id].append(movie_id)
+
+        with self._lock:
+            for user_id, movie_ids in found.items():
+                self._entries[user_id] = (now, np.unique(np.asarray(movie_ids, dtype=np.int64)))
+                self._entries.move_to_end(user_id)
+            # Pending, unflushed feedback from this process must still apply
+            with _latest_lock:
+                pending = [
+                    (user_id, movie_id, feedback_type in NEGATIVE_TYPES)
+                    for (user_id, movie_id), (feedback_type, _) in _latest.items()
+                    if user_id in found
+                ]
+            for user_id, movie_id, negative in pending:
+                self._patch(user_id, movie_id, negative)
+            limit = settings.CYNARA_SETTINGS.get('NEGATIVE_FILTER_MAX_USERS', 10000)
+            while len(self._entries) > limit:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id):
+        self.load_many([user_id])
+        with self._lock:
+            return self._entries[user_id][1]
+
+    def apply(self, user_id, movie_id, negative):
+        """Patch a loaded entry in place after feedback from this process"""
+        with self._lock:
+            if user_id in self._entries:
+                self._patch(user_id, movie_id, negative)
+
+    def _patch(self, user_id, movie_id, negative):
+        loaded_at, movie_ids = self._entries[user_id]
+        if negative:
+            movie_ids = np.union1d(movie_ids, [movie_id])
+        else:
+            movie_ids = movie_ids[movie_ids != movie_id]
+        self._entries[user_id] = (loaded_at, movie_ids)
+
+    def exclude(self, user_id, candidate_ids):
+        """Drop dismissed movies from an array of candidate ids, order preserved"""
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        dismissed = self.get(user_id)
+        if not len(dismissed) or not len(candidate_ids):
+            return candidate_ids
+        positions = np.minimum(np.searchsorted(dismissed, candidate_ids), len(dismissed) - 1)
+        return candidate_ids[dismissed[positions] != candidate_ids]
+
+    def is_dismissed(self, user_id, movie_id):
+        dismissed = self.get(user_id)
+        position = np.searchsorted(dismissed, movie_id)
+        return position < len(dismissed) and dismissed[position] == movie_id
+
+
+negative_filters = NegativeFilters()
@@ -0,0 +1,70 @@
+"""
+Benchmark every recommendation algorithm on seeded synthetic data.
+
+Usage: python manage.py benchmark_recommendations [--movies 2000] [--users 1000] [--output report.json]
+
+Runs against a throwaway test database (created and destroyed like the
+test runner does), so it never touches real data. The JSON report holds
+build timings, per-query latency percentiles, peak memory and
+precision/recall/NDCG@k on a held-out split; keep reports from each
+release to spot regressions.
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from recommendations.benchmark import run_benchmark
+from recommendations.engine import ALGORITHMS
+
+
+class Command(BaseCommand):
+    help = 'Measure recommendation build time, latency, memory and quality on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--interactions', type=int, default=40, help='Mean interactions per user')
+        parser.add_argument('--genres', type=int, default=12)
+        parser.add_argument('--holdout', type=float, default=0.2, help='Share of positives held out for scoring')
+        parser.add_argument('--k', type=int, default=10, help='Cut-off for the ranking metrics')
+        parser.add_argument('--algorithm', choices=ALGORITHMS, action='append', help='Repeatable (default: all)')
+        parser.add_argument('--latency-samples', type=int, default=200, help='Single-user queries timed')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc for undistorted timings')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['holdout'] < 1:
+            raise CommandError('--holdout must be in [0, 1).')
+
+        def progress(message):
+            self.stderr.write(f'  {message}...')
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = run_benchmark(
+                movies=options['movies'],
+                users=options['users'],
+                interactions=options['interactions'],
+                genres=options['genres'],
+                holdout=options['holdout'],
+                k=options['k'],
+                algorithms=options['algorithm'],
+                latency_samples=options['latency_samples'],
+                seed=options['seed'],
+                trace_memory=not options['no_memory'],
+                progress=progress if options['verbosity'] > 0 else None,
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        payload = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(payload)
+            self.stdout.write(self.style.SUCCESS(f"Benchmark report written to {options['output']}"))
+        else:
+            self.stdout.write(payload)
@@ -0,0 +1,74 @@
+"""
+Build the IVF approximate nearest-neighbour index over movie embeddings.
+
+Usage: python manage.py build_ann_index [--lists N] [--report report.json]
+
+The recall report compares the index with exact search for a sample of
+movies at several nprobe values; use it to pick ANN_NPROBE.
+"""
+
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations.ann import IVFIndex, get_ann_path, recall_report
+from recommendations.similarity import SimilarityIndex
+
+
+class Command(BaseCommand):
+    help = 'Build the approximate nearest-neighbour index and report recall vs exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lists', type=int, help='Number of IVF lists (default: 4 * sqrt(rows))')
+        parser.add_argument('--iterations', type=int, default=15, help='k-means iterations')
+        parser.add_argument('--output', help='Index directory (defaults to ANN_INDEX_PATH)')
+        parser.add_argument('--report', help='Also write the recall-vs-exact report as JSON to this path')
+        parser.add_argument('--queries', type=int, default=200, help='Sample queries for the report')
+        parser.add_argument('--k', type=int, default=10, help='Neighbours per query for the report')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        path = options['output'] or get_ann_path()
+        if not path:
+            raise CommandError('No output path given and ANN_INDEX_PATH is not set.')
+
+        # Always build from the database so the index can't lag a stale snapshot
+        exact_index = SimilarityIndex.from_queryset()
+        if not len(exact_index):
+            raise CommandError('No movie embeddings to index.')
+
+        started = time.perf_counter()
+        ann_index = IVFIndex.build(
+            exact_index.movie_ids,
+            exact_index.matrix,
+            n_lists=options['lists'],
+            iterations=options['iterations'],
+            seed=options['seed'],
+        )
+        version = ann_index.save(path)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Built ANN index v{version} at {path}: {len(ann_index)} movies in '
+            f'{ann_index.n_lists} lists ({elapsed:.2f}s)'
+        ))
+
+        report = recall_report(
+            ann_index, exact_index,
+            k=options['k'], queries=options['queries'], seed=options['seed']
+        )
+        self.stdout.write(
+            f"exact search: p50 {report['exact_ms']['p50']:.3f}ms  p99 {report['exact_ms']['p99']:.3f}ms"
+        )
+        self.stdout.write(f"{'nprobe':>7} {'recall@' + str(report['k']):>10} {'p50 ms':>9} {'p99 ms':>9}")
+        for row in report['nprobe']:
+            self.stdout.write(
+                f"{row['nprobe']:>7} {row['recall']:>10.3f} "
+                f"{row['latency_ms']['p50']:>9.3f} {row['latency_ms']['p99']:>9.3f}"
+            )
+
+        if options['report']:
+            with open(options['report'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+            self.stdout.write(f"Report written to {options['report']}")
@@ -0,0 +1,50 @@
+"""
+Write all MovieEmbedding vectors to the shared binary snapshot.
+
+Usage: python manage.py build_embedding_snapshot [--output PATH]
+
+Running workers notice the new version within
+EMBEDDING_SNAPSHOT_CHECK_INTERVAL seconds and swap to it without a restart.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations.models import MovieEmbedding
+from recommendations.snapshot import get_snapshot_path, write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Write a versioned, mmap-able snapshot of all movie embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help='Snapshot path (defaults to EMBEDDING_SNAPSHOT_PATH)'
+        )
+        parser.add_argument(
+            '--include-unavailable',
+            action='store_true',
+            help='Also include movies marked as unavailable'
+        )
+
+    def handle(self, *args, **options):
+        path = options['output'] or get_snapshot_path()
+        if not path:
+            raise CommandError('No output path given and EMBEDDING_SNAPSHOT_PATH is not set.')
+
+        queryset = MovieEmbedding.objects.all()
+        if not options['include_unavailable']:
+            queryset = queryset.filter(movie__is_available=True)
+        rows = queryset.order_by('movie_id').values_list(
+            'movie_id', 'embedding_vector'
+        ).iterator(chunk_size=2000)
+
+        started = time.perf_counter()
+        version, count, dimensions = write_snapshot(path, rows)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote snapshot v{version} to {path}: {count} movies x {dimensions} dims in {elapsed:.2f}s'
+        ))
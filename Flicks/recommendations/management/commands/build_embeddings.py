@@ -0,0 +1,54 @@
+"""
+Generate MovieEmbedding vectors for new and changed movies.
+
+Usage: python manage.py build_embeddings [--backend local|openai] [--force]
+
+Movies whose text hash matches the stored one are skipped, so repeated runs
+only pay for what changed. Run build_embedding_snapshot afterwards to
+publish the new vectors to running workers.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations.embeddings import EmbeddingError, build_embeddings, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Embed movies whose title, description, genres, cast or director changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=['local', 'openai'], help='Defaults to EMBEDDING_BACKEND')
+        parser.add_argument('--batch-size', type=int, help='Texts per embedding request')
+        parser.add_argument('--concurrency', type=int, help='Requests in flight at once')
+        parser.add_argument('--limit', type=int, help='Embed at most this many movies')
+        parser.add_argument('--force', action='store_true', help='Re-embed every movie regardless of hash')
+
+    def handle(self, *args, **options):
+        try:
+            backend = get_backend(options['backend'])
+        except EmbeddingError as exc:
+            raise CommandError(str(exc))
+
+        started = time.perf_counter()
+
+        def progress(done):
+            self.stdout.write(f'  {done} movies embedded')
+
+        try:
+            count = build_embeddings(
+                backend,
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                force=options['force'],
+                limit=options['limit'],
+                progress=progress if options['verbosity'] > 1 else None,
+            )
+        except EmbeddingError as exc:
+            raise CommandError(f'Embedding failed: {exc}')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Embedded {count} movies with {backend.name} in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,37 @@
+"""
+Rebuild MovieSimilarity from catalog metadata.
+
+Usage: python manage.py build_movie_similarity [--top-k 30] [--block-size 256]
+
+Edits to a movie's genres, director, cast or year refresh its list
+incrementally; run this after bulk imports or nightly to trim lists.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from recommendations.related import compute_movie_similarities
+
+
+class Command(BaseCommand):
+    help = 'Precompute metadata-based similar movies for the whole catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, help='Similar movies kept per movie')
+        parser.add_argument('--block-size', type=int, help='Movies scored per sparse product block')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write(f'  {done}/{total} movies')
+
+        pairs = compute_movie_similarities(
+            k=options['top_k'],
+            block_size=options['block_size'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {pairs} similar-movie pairs in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,38 @@
+"""
+Recompute UserSimilarity (top-k neighbours per user) from watches and ratings.
+
+Usage: python manage.py compute_user_similarity [--top-k 50] [--block-size 512]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from recommendations.collaborative import compute_user_similarities
+
+
+class Command(BaseCommand):
+    help = 'Compute top-k user neighbours for collaborative filtering'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, help='Neighbours kept per user (default: USER_SIMILARITY_TOP_K)')
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            help='Users per similarity block; lower it to reduce peak memory (default: USER_SIMILARITY_BLOCK_SIZE)'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write(f'  {done}/{total} users')
+
+        stored = compute_user_similarities(
+            k=options['top_k'],
+            block_size=options['block_size'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {stored} neighbour pairs in {time.perf_counter() - started:.1f}s'
+        ))
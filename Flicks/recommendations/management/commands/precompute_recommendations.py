@@ -0,0 +1,121 @@
+"""
+Fill RecommendationSet/RecommendationItem for users whose sets are missing
+or expired.
+
+Usage: python manage.py precompute_recommendations [--algorithm hybrid] [--workers 4]
+
+Users are split into chunks that a process pool scores in parallel; the
+parent writes each finished chunk in its own transaction, which keeps
+writers from contending for locks (SQLite allows only one at a time).
+Because only users without an unexpired set are selected, re-running after
+a crash picks up where the previous run stopped.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from recommendations.engine import (
+    ALGORITHMS, popularity_scores, recommend_for_users, save_recommendations
+)
+from recommendations.models import RecommendationSet
+
+
+def _init_worker():
+    # Forked children must not reuse the parent's database sockets; spawned
+    # children (Windows/macOS) start without Django configured at all
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+
+def _score_chunk(user_ids, algorithm, popular):
+    return recommend_for_users(user_ids, algorithm=algorithm, popular=popular)
+
+
+class Command(BaseCommand):
+    help = 'Precompute recommendation sets for users whose sets are missing or expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--algorithm',
+            choices=ALGORITHMS + ['all'],
+            default='hybrid',
+            help='Which algorithm to precompute (default: hybrid)'
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes (0 = run inline)')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Users per chunk/transaction')
+        parser.add_argument('--limit', type=int, help='Only process this many users')
+        parser.add_argument('--force', action='store_true', help='Recompute even unexpired sets')
+
+    def handle(self, *args, **options):
+        algorithms = ALGORITHMS if options['algorithm'] == 'all' else [options['algorithm']]
+        for algorithm in algorithms:
+            self._precompute(algorithm, options)
+
+    def _pending_user_ids(self, algorithm, force):
+        users = User.objects.filter(is_active=True)
+        if not force:
+            fresh_set = RecommendationSet.objects.filter(
+                user=OuterRef('pk'),
+                algorithm_used=algorithm,
+                expires_at__gt=timezone.now(),
+            )
+            users = users.filter(~Exists(fresh_set))
+        return list(users.order_by('id').values_list('id', flat=True))
+
+    def _precompute(self, algorithm, options):
+        user_ids = self._pending_user_ids(algorithm, options['force'])
+        if options['limit']:
+            user_ids = user_ids[:options['limit']]
+        if not user_ids:
+            self.stdout.write(f'{algorithm}: all recommendation sets are fresh')
+            return
+
+        chunk_size = max(1, options['chunk_size'])
+        chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+        # Popularity doesn't depend on the user; compute it once and ship it
+        popular = popularity_scores()
+
+        self.stdout.write(
+            f'{algorithm}: {len(user_ids)} users in {len(chunks)} chunks, '
+            f'{options["workers"] or "no"} workers'
+        )
+        started = time.perf_counter()
+        processed = saved = 0
+
+        if options['workers'] <= 0:
+            for chunk in chunks:
+                results = _score_chunk(chunk, algorithm, popular)
+                saved += save_recommendations(results, algorithm)
+                processed += len(chunk)
+                self._report(algorithm, processed, len(user_ids), started)
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+                futures = {
+                    pool.submit(_score_chunk, chunk, algorithm, popular): len(chunk)
+                    for chunk in chunks
+                }
+                for future in as_completed(futures):
+                    saved += save_recommendations(future.result(), algorithm)
+                    processed += futures[future]
+                    self._report(algorithm, processed, len(user_ids), started)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{algorithm}: saved {saved} sets for {processed} users in {elapsed:.1f}s '
+            f'({processed / max(elapsed, 1e-9) * 60:.0f} users/min)'
+        ))
+
+    def _report(self, algorithm, processed, total, started):
+        elapsed = time.perf_counter() - started
+        rate = processed / max(elapsed, 1e-9) * 60
+        self.stdout.write(f'  {algorithm}: {processed}/{total} users ({rate:.0f} users/min)')
@@ -0,0 +1,36 @@
+"""
+Full rebuild of taste vectors and UserSimilarity.
+
+Usage: python manage.py rebuild_user_profiles
+
+Ratings and completed watches update profiles incrementally as they
+happen; run this nightly as a consistency backstop.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from recommendations.profiles import rebuild_user_profiles
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every user taste vector and neighbour list from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Users per taste-vector batch')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write(f'  taste vectors: {done}/{total} users')
+
+        users, pairs = rebuild_user_profiles(
+            chunk_size=options['chunk_size'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {users} user profiles and {pairs} neighbour pairs '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
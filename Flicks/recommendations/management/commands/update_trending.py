@@ -0,0 +1,34 @@
+"""
+Fold new watch sessions into the trending tables.
+
+Usage: python manage.py update_trending [--window 24h] [--full]
+
+Each run only reads sessions added since the previous run plus the ones
+that slid out of the window, so it is cheap enough to run every few
+minutes from cron. Use --full occasionally to recompute from scratch.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from recommendations.trending import WINDOWS, update_trending
+
+
+class Command(BaseCommand):
+    help = 'Update time-decayed trending scores for each window'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window', choices=list(WINDOWS), action='append',
+            help='Window to update (repeatable, default: all)'
+        )
+        parser.add_argument('--full', action='store_true', help='Recompute from every session in the window')
+
+    def handle(self, *args, **options):
+        for window in options['window'] or WINDOWS:
+            started = time.perf_counter()
+            touched = update_trending(window, full=options['full'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Trending {window}: {touched} movies updated in {time.perf_counter() - started:.2f}s'
+            ))
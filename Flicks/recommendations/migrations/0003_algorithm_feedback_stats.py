@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_feedback_stats(apps, schema_editor):
+    RecommendationFeedback = apps.get_model("recommendations", "RecommendationFeedback")
+    AlgorithmFeedbackStats = apps.get_model("recommendations", "AlgorithmFeedbackStats")
+    AlgorithmFeedbackStats.objects.bulk_create(
+        [
+            AlgorithmFeedbackStats(
+                algorithm=row["recommendation_algorithm"],
+                feedback_type=row["feedback_type"],
+                count=row["count"],
+            )
+            for row in RecommendationFeedback.objects.values(
+                "recommendation_algorithm", "feedback_type"
+            ).annotate(count=Count("id"))
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommendations", "0002_user_taste_vector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AlgorithmFeedbackStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("algorithm", models.CharField(max_length=50)),
+                (
+                    "feedback_type",
+                    models.CharField(
+                        choices=[
+                            ("liked", "Liked Recommendation"),
+                            ("disliked", "Disliked Recommendation"),
+                            ("not_interested", "Not Interested"),
+                            ("watched", "Watched Based on Recommendation"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "ordering": ["algorithm", "feedback_type"],
+                "unique_together": {("algorithm", "feedback_type")},
+            },
+        ),
+        migrations.RunPython(backfill_feedback_stats, migrations.RunPython.noop),
+    ]
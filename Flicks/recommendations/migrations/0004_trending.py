@@ -0,0 +1,87 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0001_initial"),
+        ("recommendations", "0003_algorithm_feedback_stats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "window",
+                    models.CharField(
+                        choices=[
+                            ("24h", "Last 24 Hours"),
+                            ("7d", "Last 7 Days"),
+                            ("30d", "Last 30 Days"),
+                        ],
+                        max_length=5,
+                        unique=True,
+                    ),
+                ),
+                ("last_event_id", models.BigIntegerField(default=0)),
+                ("computed_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TrendingMovie",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "window",
+                    models.CharField(
+                        choices=[
+                            ("24h", "Last 24 Hours"),
+                            ("7d", "Last 7 Days"),
+                            ("30d", "Last 30 Days"),
+                        ],
+                        max_length=5,
+                    ),
+                ),
+                ("score", models.FloatField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trending_scores",
+                        to="movies.movie",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["window", "-score"],
+                        name="recommendat_window_c80a68_idx",
+                    )
+                ],
+                "unique_together": {("window", "movie")},
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0001_initial"),
+        ("recommendations", "0004_trending"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MovieSimilarityState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("signature", models.CharField(max_length=40)),
+                ("computed_at", models.DateTimeField(auto_now=True)),
+                (
+                    "movie",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="similarity_state",
+                        to="movies.movie",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="MovieSimilarity",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="similar_entries",
+                        to="movies.movie",
+                    ),
+                ),
+                (
+                    "similar_movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="movies.movie",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["movie", "-score"],
+                        name="recommendat_movie_i_2800f5_idx",
+                    )
+                ],
+                "unique_together": {("movie", "similar_movie")},
+            },
+        ),
+    ]
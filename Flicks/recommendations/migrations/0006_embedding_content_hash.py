@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommendations", "0005_movie_similarity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movieembedding",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="movieembedding",
+            name="model_name",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
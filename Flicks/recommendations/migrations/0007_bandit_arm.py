@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:12
+
+from django.db import migrations, models
+
+
+def backfill_bandit_arms(apps, schema_editor):
+    AlgorithmFeedbackStats = apps.get_model("recommendations", "AlgorithmFeedbackStats")
+    BanditArm = apps.get_model("recommendations", "BanditArm")
+    arms = {}
+    for row in AlgorithmFeedbackStats.objects.all():
+        arm = arms.setdefault(row.algorithm, BanditArm(arm=row.algorithm))
+        if row.feedback_type in ("liked", "watched"):
+            arm.successes += row.count
+        else:
+            arm.failures += row.count
+    BanditArm.objects.bulk_create(arms.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommendations", "0006_embedding_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BanditArm",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("arm", models.CharField(max_length=50, unique=True)),
+                ("successes", models.FloatField(default=0)),
+                ("failures", models.FloatField(default=0)),
+                ("pulls", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["arm"],
+            },
+        ),
+        migrations.RunPython(backfill_bandit_arms, migrations.RunPython.noop),
+    ]
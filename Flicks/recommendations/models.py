@@ -13,6 +13,8 @@ class MovieEmbedding(models.Model):
     """Store OpenAI embeddings for movies for similarity calculations"""
     movie = models.OneToOneField(Movie, on_delete=models.CASCADE, related_name='embedding')
     embedding_vector = models.JSONField()  # Store the embedding as JSON array
+    content_hash = models.CharField(max_length=64, blank=True)  # Hash of the text that was embedded
+    model_name = models.CharField(max_length=100, blank=True)  # Backend/model that produced the vector
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -20,6 +22,16 @@ class MovieEmbedding(models.Model):
         return f"Embedding for {self.movie.title}"
 
 
+class UserTasteVector(models.Model):
+    """User profile in embedding space, kept current as they rate and watch"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='taste_vector')
+    vector = models.JSONField()  # Rating-weighted mean of liked movie embeddings
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Taste vector for {self.user.username}"
+
+
 class RecommendationSet(models.Model):
     """Store pre-computed recommendations for users"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendation_sets')
@@ -108,3 +120,96 @@ class RecommendationFeedback(models.Model):
     
     def __str__(self):
         return f"{self.user.username} {self.feedback_type} {self.movie.title}"
+
+
+class AlgorithmFeedbackStats(models.Model):
+    """Running feedback counts per recommendation algorithm, for cheap comparison"""
+    algorithm = models.CharField(max_length=50)
+    feedback_type = models.CharField(
+        max_length=20,
+        choices=RecommendationFeedback._meta.get_field('feedback_type').choices
+    )
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('algorithm', 'feedback_type')
+        ordering = ['algorithm', 'feedback_type']
+    
+    def __str__(self):
+        return f"{self.algorithm} {self.feedback_type}: {self.count}"
+
+
+TRENDING_WINDOWS = [
+    ('24h', 'Last 24 Hours'),
+    ('7d', 'Last 7 Days'),
+    ('30d', 'Last 30 Days'),
+]
+
+
+class TrendingMovie(models.Model):
+    """Time-decayed watch score of a movie within a sliding window"""
+    window = models.CharField(max_length=5, choices=TRENDING_WINDOWS)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='trending_scores')
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('window', 'movie')
+        indexes = [
+            models.Index(fields=['window', '-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.movie.title} ({self.window}: {self.score:.2f})"
+
+
+class TrendingState(models.Model):
+    """How far each trending window has folded in WatchHistory"""
+    window = models.CharField(max_length=5, choices=TRENDING_WINDOWS, unique=True)
+    last_event_id = models.BigIntegerField(default=0)  # Highest WatchHistory id counted
+    computed_at = models.DateTimeField()  # Time the stored scores are decayed to
+    
+    def __str__(self):
+        return f"Trending {self.window} @ {self.computed_at}"
+
+
+class MovieSimilarity(models.Model):
+    """Precomputed metadata similarity: genres, director, cast and year"""
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='similar_entries')
+    similar_movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('movie', 'similar_movie')
+        indexes = [
+            models.Index(fields=['movie', '-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.movie.title} ~ {self.similar_movie.title}: {self.score:.3f}"
+
+
+class MovieSimilarityState(models.Model):
+    """Metadata signature each movie's similar list was computed from"""
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, related_name='similarity_state')
+    signature = models.CharField(max_length=40)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.movie.title} ({self.signature[:8]})"
+
+
+class BanditArm(models.Model):
+    """Persisted Beta posterior of one arm of the algorithm-selection bandit"""
+    arm = models.CharField(max_length=50, unique=True)  # A RecommendationSet algorithm
+    successes = models.FloatField(default=0)  # Liked / watched feedback
+    failures = models.FloatField(default=0)  # Disliked / not interested feedback
+    pulls = models.BigIntegerField(default=0)  # Times this arm was chosen for a user
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['arm']
+    
+    def __str__(self):
+        return f"{self.arm}: {self.successes:g}/{self.successes + self.failures:g}"
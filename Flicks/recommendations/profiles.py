@@ -0,0 +1,162 @@
+"""
+Cynara User Profiles
+
+Keeps UserTasteVector and UserSimilarity current as users rate and finish
+movies. Saves are debounced per user and processed in batches, and only the
+affected users (plus the neighbours whose lists they may enter) are touched.
+`rebuild_user_profiles` remains the periodic full rebuild.
+"""
+
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from movies.models import Rating, WatchHistory
+from .collaborative import UserItemMatrix, compute_user_similarities, save_neighbours, top_k_neighbours
+from .engine import UserSignals
+from .models import RecommendationSet, UserSimilarity, UserTasteVector
+from .serving import invalidate_user_recommendations
+from .similarity import get_similarity_index
+from .tasks import batcher
+
+
+def update_taste_vectors(user_ids):
+    """Recompute and store taste vectors for a batch of users"""
+    signals = UserSignals(user_ids, neighbours=0)
+    index = get_similarity_index()
+
+    vectors = {}
+    for user_id in signals.user_ids:
+        vector = signals.taste_vector(user_id, index)
+        if vector is not None:
+            norm = np.linalg.norm(vector)
+            vectors[user_id] = [round(float(v), 6) for v in vector / norm]
+
+    with transaction.atomic():
+        UserTasteVector.objects.filter(user_id__in=signals.user_ids).exclude(
+            user_id__in=list(vectors)
+        ).delete()
+        if vectors:
+            UserTasteVector.objects.bulk_create(
+                [UserTasteVector(user_id=user_id, vector=vector) for user_id, vector in vectors.items()],
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['vector', 'updated_at'],
+            )
+    return len(vectors)
+
+
+def update_neighbours(user_ids, k=None):
+    """
+    Refresh the neighbour lists of the given users.
+
+    Only users who share at least one movie with them can have a non-zero
+    cosine, so the matrix is built from those co-watchers alone. Reverse
+    pairs are upserted when the changed user now beats the neighbour's
+    weakest entry; the full rebuild trims lists back to k.
+    """
+    k = k or settings.CYNARA_SETTINGS.get('USER_SIMILARITY_TOP_K', 50)
+    user_ids = list(user_ids)
+
+    # Subqueries keep the parameter count flat however much they've watched
+    rated = Rating.objects.filter(user_id__in=user_ids).values('movie_id')
+    completed = WatchHistory.objects.filter(user_id__in=user_ids, completed=True).values('movie_id')
+    overlap = Counter()
+    limit = settings.CYNARA_SETTINGS.get('PROFILE_NEIGHBOUR_CANDIDATES', 5000)
+    for queryset in (
+        Rating.objects.filter(movie_id__in=rated.union(completed)),
+        WatchHistory.objects.filter(movie_id__in=rated.union(completed), completed=True),
+    ):
+        # The users sharing the most movies are the only plausible top-k
+        for entry in queryset.values('user_id').annotate(shared=Count('id')).order_by('-shared')[:limit]:
+            overlap[entry['user_id']] += entry['shared']
+    co_watchers = {user_id for user_id, _ in overlap.most_common(limit)}
+    co_watchers.update(user_ids)
+
+    user_matrix = UserItemMatrix.build(user_ids=co_watchers)
+    rows = [row for row in map(user_matrix.row_for, user_ids) if row is not None]
+
+    calculated_at = timezone.now()
+    results = top_k_neighbours(user_matrix.matrix, np.array(rows, dtype=np.int64), k) if rows else []
+    save_neighbours(user_matrix, results)
+    UserSimilarity.objects.filter(user1_id__in=user_ids, last_calculated__lt=calculated_at).delete()
+
+    reverse = {}
+    for row, neighbours, scores in results:
+        for neighbour, score in zip(neighbours, scores):
+            reverse[(int(user_matrix.user_ids[neighbour]), int(user_matrix.user_ids[row]))] = float(score)
+    if not reverse:
+        return
+
+    weakest = {
+        entry['user1']: (entry['weakest'], entry['count'])
+        for entry in UserSimilarity.objects.filter(
+            user1_id__in={user1 for user1, _ in reverse}
+        ).values('user1').annotate(weakest=Min('similarity_score'), count=Count('id'))
+    }
+    existing = set(
+        UserSimilarity.objects.filter(
+            user1_id__in={user1 for user1, _ in reverse},
+            user2_id__in=user_ids,
+        ).values_list('user1_id', 'user2_id')
+    )
+    updates = [
+        UserSimilarity(user1_id=user1, user2_id=user2, similarity_score=round(score, 6))
+        for (user1, user2), score in reverse.items()
+        if (user1, user2) in existing
+        or weakest.get(user1, (0.0, 0))[1] < k
+        or score > weakest[user1][0]
+    ]
+    if updates:
+        UserSimilarity.objects.bulk_create(
+            updates,
+            update_conflicts=True,
+            unique_fields=['user1', 'user2'],
+            update_fields=['similarity_score', 'last_calculated'],
+        )
+
+
+@batcher(
+    delay=settings.CYNARA_SETTINGS.get('PROFILE_UPDATE_DELAY', 2.0),
+    max_delay=settings.CYNARA_SETTINGS.get('PROFILE_UPDATE_MAX_DELAY', 10.0),
+)
+def profile_updates(user_ids):
+    update_taste_vectors(user_ids)
+    update_neighbours(user_ids)
+    # Their precomputed lists no longer reflect what they just told us
+    RecommendationSet.objects.filter(
+        user_id__in=user_ids, expires_at__gt=timezone.now()
+    ).update(expires_at=timezone.now())
+    invalidate_user_recommendations(user_ids)
+
+
+def rebuild_user_profiles(chunk_size=500, progress=None):
+    """Full rebuild of every taste vector and neighbour list"""
+    started = timezone.now()
+    user_ids = sorted(
+        set(Rating.objects.values_list('user_id', flat=True).distinct())
+        | set(WatchHistory.objects.filter(completed=True).values_list('user_id', flat=True).distinct())
+    )
+    for start in range(0, len(user_ids), chunk_size):
+        update_taste_vectors(user_ids[start:start + chunk_size])
+        if progress is not None:
+            progress(min(start + chunk_size, len(user_ids)), len(user_ids))
+    UserTasteVector.objects.filter(updated_at__lt=started).delete()
+    return len(user_ids), compute_user_similarities()
+
+
+@receiver(post_save, sender=Rating)
+def _rating_saved(sender, instance, **kwargs):
+    profile_updates.add(instance.user_id)
+
+
+@receiver(post_save, sender=WatchHistory)
+def _watch_saved(sender, instance, **kwargs):
+    if instance.completed:
+        profile_updates.add(instance.user_id)
@@ -0,0 +1,282 @@
+"""
+Cynara Hybrid Ranker
+
+Final ranking stage for the hybrid algorithm. A candidate pool (ANN
+neighbours of the user's taste, movies their neighbours liked, popular and
+recent movies) is scored by four signals held as NumPy arrays aligned to
+the candidate ids:
+
+    content        cosine between the candidate and the user's taste vector
+    collaborative  neighbour-similarity-weighted ratings of the candidate
+    popularity     log view count
+    recency        exponential decay on how long the movie has been in the catalog
+
+Each signal is min-max normalized over the pool and blended with the
+HYBRID_WEIGHTS of the deployment. The top of the blend is re-ordered with
+maximal marginal relevance over embeddings so the list isn't ten near
+copies of one movie, and each pick gets a reason from the signal that
+contributed most to it.
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from movies.models import Movie
+from .ann import search_candidates
+from .similarity import get_similarity_index
+
+SIGNALS = ('content', 'collaborative', 'popularity', 'recency')
+
+DEFAULT_WEIGHTS = {
+    'content': 0.45,
+    'collaborative': 0.3,
+    'popularity': 0.15,
+    'recency': 0.1,
+}
+
+REASONS = {
+    'content': 'Similar to movies you enjoyed',
+    'collaborative': 'Viewers with similar taste enjoyed this',
+    'popularity': 'Popular on Cynara',
+    'recency': 'New on Cynara',
+}
+
+
+def lookup(sorted_ids, movie_ids):
+    """(rows, found) aligning movie_ids to positions in a sorted id array"""
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    if not len(sorted_ids):
+        return np.zeros(len(movie_ids), dtype=np.int64), np.zeros(len(movie_ids), dtype=bool)
+    rows = np.minimum(np.searchsorted(sorted_ids, movie_ids), len(sorted_ids) - 1)
+    return rows, sorted_ids[rows] == movie_ids
+
+
+class CatalogFeatures:
+    """Per-movie arrays (sorted by id) for the non-personal signals"""
+
+    def __init__(self, movie_ids, popularity, recency, available, titles):
+        self.movie_ids = movie_ids
+        self.popularity = popularity
+        self.recency = recency
+        self.available = available
+        self.titles = titles
+        # Newest available movies, for the candidate pool
+        self.recent_ids = movie_ids[available][np.argsort(-recency[available], kind='stable')]
+
+    @classmethod
+    def build(cls):
+        rows = list(
+            Movie.objects.order_by('id').values_list('id', 'view_count', 'date_added', 'is_available', 'title')
+            .iterator(chunk_size=5000)
+        )
+        now = timezone.now().timestamp()
+        half_life = settings.CYNARA_SETTINGS.get('HYBRID_RECENCY_HALF_LIFE_DAYS', 30) * 86400
+        movie_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        views = np.fromiter((row[1] or 0 for row in rows), dtype=np.float32, count=len(rows))
+        added = np.fromiter(
+            (row[2].timestamp() if row[2] else 0.0 for row in rows), dtype=np.float64, count=len(rows)
+        )
+        available = np.fromiter((row[3] for row in rows), dtype=bool, count=len(rows))
+        return cls(
+            movie_ids,
+            np.log1p(views),
+            np.exp(-math.log(2) * np.maximum(now - added, 0.0) / half_life).astype(np.float32),
+            available,
+            [row[4] for row in rows],
+        )
+
+
+_catalog = None
+_catalog_built_at = 0.0
+_catalog_lock = threading.Lock()
+
+
+def get_catalog_features():
+    """Process-wide CatalogFeatures, rebuilt after SIMILARITY_INDEX_TTL"""
+    global _catalog, _catalog_built_at
+    ttl = settings.CYNARA_SETTINGS.get('SIMILARITY_INDEX_TTL', 300)
+    if _catalog is None or time.monotonic() - _catalog_built_at >= ttl:
+        with _catalog_lock:
+            if _catalog is None or time.monotonic() - _catalog_built_at >= ttl:
+                _catalog = CatalogFeatures.build()
+                _catalog_built_at = time.monotonic()
+    return _catalog
+
+
+def invalidate_catalog_features():
+    global _catalog_built_at
+    _catalog_built_at = 0.0
+
+
+def get_hybrid_weights():
+    """HYBRID_WEIGHTS from settings over the defaults, as an array in SIGNALS order"""
+    weights = dict(DEFAULT_WEIGHTS, **settings.CYNARA_SETTINGS.get('HYBRID_WEIGHTS', {}))
+    return np.array([float(weights[name]) for name in SIGNALS], dtype=np.float32)
+
+
+def normalize_signals(matrix):
+    """Min-max each row to [0, 1]; constant rows become zeros"""
+    low = matrix.min(axis=1, keepdims=True)
+    span = matrix.max(axis=1, keepdims=True) - low
+    return np.where(span > 0, (matrix - low) / np.where(span > 0, span, 1.0), 0.0).astype(np.float32)
+
+
+class HybridRanker:
+    """Blend, diversify and explain a candidate pool for one user"""
+
+    def __init__(self, weights=None, diversity=None, catalog=None, index=None):
+        self.weights = get_hybrid_weights() if weights is None else np.asarray(weights, dtype=np.float32)
+        self.diversity = (
+            settings.CYNARA_SETTINGS.get('HYBRID_DIVERSITY', 0.3) if diversity is None else diversity
+        )
+        self.catalog = catalog if catalog is not None else get_catalog_features()
+        self.index = index if index is not None else get_similarity_index()
+
+    def candidates(self, taste_vector=None, collaborative_ids=(), popular_ids=(), pool=500, exclude=()):
+        """Union of the per-signal candidate sources, as a sorted id array"""
+        sources = [
+            np.asarray(collaborative_ids, dtype=np.int64),
+            np.asarray(popular_ids, dtype=np.int64)[:pool],
+            self.catalog.recent_ids[:pool // 5],
+        ]
+        if taste_vector is not None:
+            nearest = search_candidates(taste_vector, k=pool, exclude=exclude)
+            sources.append(np.fromiter((movie_id for movie_id, _ in nearest), dtype=np.int64, count=len(nearest)))
+        return np.unique(np.concatenate(sources))
+
+    def signals(self, candidate_ids, taste_vector=None, collaborative=None):
+        """
+        (len(SIGNALS) x n) raw signal matrix.
+
+        `collaborative` is a pair of arrays (movie_ids, scores); ids missing
+        from it score zero.
+        """
+        n = len(candidate_ids)
+        matrix = np.zeros((len(SIGNALS), n), dtype=np.float32)
+
+        if taste_vector is not None and self.index.dimensions:
+            rows, embedded = lookup(self.index.movie_ids, candidate_ids)
+            query = taste_vector / (np.linalg.norm(taste_vector) or 1.0)
+            matrix[0, embedded] = self.index.matrix[rows[embedded]] @ query
+
+        if collaborative is not None and len(collaborative[0]):
+            order = np.argsort(collaborative[0])
+            rows, found = lookup(collaborative[0][order], candidate_ids)
+            matrix[1] = np.where(found, collaborative[1][order][rows], 0.0)
+
+        catalog_rows, known = lookup(self.catalog.movie_ids, candidate_ids)
+        matrix[2] = np.where(known, self.catalog.popularity[catalog_rows], 0.0)
+        matrix[3] = np.where(known, self.catalog.recency[catalog_rows], 0.0)
+        return matrix
+
+    def rank(self, candidate_ids, count, taste_vector=None, collaborative=None, exclude=None, liked_ids=None):
+        """
+        Return [(movie_id, score, reason), ...], best first.
+
+        `exclude` (seen or dismissed movies) and unavailable movies are
+        dropped up front; `liked_ids` lets content reasons name the movie a
+        pick resembles.
+        """
+        candidate_ids = np.unique(np.asarray(candidate_ids, dtype=np.int64))
+        catalog_rows, known = lookup(self.catalog.movie_ids, candidate_ids)
+        keep = known & self.catalog.available[catalog_rows]
+        if exclude is not None and len(exclude):
+            keep &= ~np.isin(candidate_ids, np.asarray(exclude, dtype=np.int64))
+        candidate_ids = candidate_ids[keep]
+        if not len(candidate_ids) or count <= 0:
+            return []
+
+        contributions = self.weights[:, None] * normalize_signals(
+            self.signals(candidate_ids, taste_vector, collaborative)
+        )
+        relevance = contributions.sum(axis=0)
+
+        picks, embeddings = self._diversify(candidate_ids, relevance, count)
+        reasons = self._reasons(contributions[:, picks], embeddings, liked_ids)
+        return [
+            (int(movie_id), float(score), reason)
+            for movie_id, score, reason in zip(candidate_ids[picks], relevance[picks], reasons)
+        ]
+
+    def embeddings_for(self, movie_ids):
+        """Normalized embedding rows for movie_ids; zeros where a movie has none"""
+        rows, found = lookup(self.index.movie_ids, movie_ids)
+        vectors = np.zeros((len(rows), self.index.dimensions), dtype=np.float32)
+        vectors[found] = self.index.matrix[rows[found]]
+        return vectors
+
+    def _diversify(self, candidate_ids, relevance, count):
+        """
+        Greedy MMR over the best few multiples of count; one vector op per pick.
+
+        Returns the picked candidate positions and their embeddings.
+        """
+        pool_size = min(len(relevance), count * settings.CYNARA_SETTINGS.get('HYBRID_MMR_POOL', 5))
+        pool = np.argpartition(-relevance, pool_size - 1)[:pool_size]
+        pool = pool[np.argsort(-relevance[pool], kind='stable')]
+        vectors = self.embeddings_for(candidate_ids[pool])
+        if not self.diversity or not vectors.shape[1]:
+            return pool[:count], vectors[:count]
+
+        gains = relevance[pool]
+        closest = np.zeros(len(pool), dtype=np.float32)
+        taken = np.zeros(len(pool), dtype=bool)
+        order = []
+        for _ in range(min(count, len(pool))):
+            mmr = np.where(taken, -np.inf, (1 - self.diversity) * gains - self.diversity * closest)
+            pick = int(np.argmax(mmr))
+            order.append(pick)
+            taken[pick] = True
+            np.maximum(closest, vectors @ vectors[pick], out=closest)
+        return pool[order], vectors[order]
+
+    def _reasons(self, contributions, embeddings, liked_ids):
+        """Name each pick's strongest signal; content picks cite the liked movie they resemble"""
+        strongest = np.argmax(contributions, axis=0)
+        reasons = [REASONS[SIGNALS[signal]] for signal in strongest]
+
+        content = np.flatnonzero(strongest == 0)
+        if not len(content) or liked_ids is None or not len(liked_ids) or not embeddings.shape[1]:
+            return reasons
+        rows, found = lookup(self.index.movie_ids, liked_ids)
+        liked = np.asarray(liked_ids, dtype=np.int64)[found]
+        if not len(liked):
+            return reasons
+        nearest = liked[np.argmax(embeddings[content] @ self.index.matrix[rows[found]].T, axis=1)]
+        title_rows, titled = lookup(self.catalog.movie_ids, nearest)
+        for position, row, has_title in zip(content, title_rows, titled):
+            if has_title:
+                reasons[position] = f'Because you enjoyed {self.catalog.titles[row]}'
+        return reasons
+
+
+def collaborative_arrays(neighbours, neighbour_preferences, seen=()):
+    """
+    Neighbour-weighted scores as (movie_ids, scores) arrays.
+
+    One concatenation per neighbour; the per-movie sums are a bincount.
+    """
+    movie_parts = []
+    score_parts = []
+    weight_sum = 0.0
+    for other_id, similarity in neighbours:
+        weight_sum += abs(similarity)
+        preferences = neighbour_preferences.get(other_id)
+        if preferences:
+            movie_parts.append(np.fromiter(preferences.keys(), dtype=np.int64, count=len(preferences)))
+            ratings = np.fromiter(preferences.values(), dtype=np.float32, count=len(preferences))
+            score_parts.append(similarity * (ratings - 3) / 2)
+    if not movie_parts or not weight_sum:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    movie_ids, inverse = np.unique(np.concatenate(movie_parts), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32) / weight_sum
+    keep = scores > 0
+    if len(seen):
+        keep &= ~np.isin(movie_ids, np.fromiter(seen, dtype=np.int64, count=len(seen)))
+    return movie_ids[keep], scores[keep]
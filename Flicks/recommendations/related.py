@@ -0,0 +1,455 @@
+"""
+Cynara Related Movies
+
+Movie -> movie similarity from catalog metadata, for movies that have no
+embedding yet. Genres and cast are compared with IDF-weighted Jaccard (a
+shared niche genre or a rarely credited actor counts for more than
+"Drama"), a shared director adds a fixed bonus, and year proximity breaks
+ties between related movies. Scores are computed a block of movies at a
+time with sparse matrix products and stored as top-k lists in
+MovieSimilarity, so a similar-movies query is one indexed lookup.
+
+Each process keeps the catalog's feature matrices and document
+frequencies in memory. A metadata edit patches the edited movies' rows
+and moves the frequencies by their genre and cast changes, so a refresh
+costs queries for the changed movies only. Edits made by other processes
+show up when the cache is rebuilt after MOVIE_FEATURES_TTL, and the full
+rebuild reconciles everything.
+"""
+
+import hashlib
+import re
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from scipy import sparse
+
+from movies.models import Movie
+from .models import MovieSimilarity, MovieSimilarityState
+from .tasks import batcher
+
+WEIGHTS = {
+    'genres': 0.45,
+    'director': 0.2,
+    'cast': 0.25,
+    'year': 0.1,
+}
+
+# Years apart at which year proximity has dropped to 1/e
+YEAR_SCALE = 10.0
+
+METADATA_FIELDS = {'director', 'cast', 'year', 'genres'}
+
+_SPLIT = re.compile(r'[,;|\n]')
+
+
+def _names(text):
+    return sorted({part.strip().lower() for part in _SPLIT.split(text or '') if part.strip()})
+
+
+def metadata_signature(director, cast, year, genre_ids):
+    """Hash of everything the similarity score depends on"""
+    payload = '|'.join([
+        (director or '').strip().lower(),
+        ','.join(_names(cast)),
+        str(year or ''),
+        ','.join(map(str, sorted(genre_ids))),
+    ])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _incidence(rows, keys, n_rows, vocabulary):
+    """Binary CSR matrix with one column per distinct key; `vocabulary` maps keys to columns"""
+    cols = np.fromiter((vocabulary.setdefault(key, len(vocabulary)) for key in keys), dtype=np.int64)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.float32), (np.asarray(rows, dtype=np.int64), cols)),
+        shape=(n_rows, max(len(vocabulary), 1)),
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return matrix
+
+
+class MovieFeatures:
+    """Sparse genre, director and cast incidence matrices for the catalog"""
+
+    def __init__(self, movie_ids, genres, directors, cast, years, signatures, vocabularies):
+        self.movie_ids = movie_ids
+        self.genres = genres
+        self.directors = directors
+        self.cast = cast
+        self.years = years
+        self.signatures = signatures
+        self.vocabularies = vocabularies  # {'genres': {genre_id: column}, 'directors': ..., 'cast': ...}
+
+        # Movies per column, kept current by update() instead of recounted
+        self.genre_df = np.bincount(genres.indices, minlength=genres.shape[1])
+        self.cast_df = np.bincount(cast.indices, minlength=cast.shape[1])
+        self._weigh()
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def _weigh(self):
+        # Column IDF weights; a weighted set size is the sum over its members
+        self.genre_weights = self._idf(self.genre_df, len(self))
+        self.cast_weights = self._idf(self.cast_df, len(self))
+        self.genre_sizes = np.asarray(self.genres @ self.genre_weights).ravel()
+        self.cast_sizes = np.asarray(self.cast @ self.cast_weights).ravel()
+
+    @staticmethod
+    def _idf(df, n):
+        return np.log((1 + n) / (1 + df)).astype(np.float32) + 1.0
+
+    @classmethod
+    def build(cls):
+        movies = list(Movie.objects.order_by('id').values_list('id', 'director', 'cast', 'year').iterator())
+        movie_ids = np.array([movie[0] for movie in movies], dtype=np.int64)
+        n = len(movie_ids)
+
+        genre_pairs = np.fromiter(
+            (value for pair in Movie.genres.through.objects.values_list('movie_id', 'genre_id').iterator()
+             for value in pair),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        vocabularies = {'genres': {}, 'directors': {}, 'cast': {}}
+        genre_rows = np.searchsorted(movie_ids, genre_pairs[:, 0]) if n else np.empty(0, dtype=np.int64)
+        genres = _incidence(genre_rows, genre_pairs[:, 1].tolist(), n, vocabularies['genres'])
+
+        directed = [(row, movie[1].strip().lower()) for row, movie in enumerate(movies) if (movie[1] or '').strip()]
+        directors = _incidence(
+            [row for row, _ in directed], [name for _, name in directed], n, vocabularies['directors']
+        )
+
+        credits = [(row, name) for row, movie in enumerate(movies) for name in _names(movie[2])]
+        cast = _incidence([row for row, _ in credits], [name for _, name in credits], n, vocabularies['cast'])
+
+        years = np.array([movie[3] or 0 for movie in movies], dtype=np.float32)
+
+        genre_ids = {}
+        for movie_id, genre_id in genre_pairs.tolist():
+            genre_ids.setdefault(movie_id, []).append(genre_id)
+        signatures = {
+            movie_id: metadata_signature(director, cast_text, year, genre_ids.get(movie_id, ()))
+            for movie_id, director, cast_text, year in movies
+        }
+        return cls(movie_ids, genres, directors, cast, years, signatures, vocabularies)
+
+    def update(self, movies):
+        """
+        Patch the rows of {movie_id: (director, cast, year, genre_ids)} in
+        place, adding rows for movies not seen yet. Document frequencies
+        move by each row's genre and cast changes, so the weights are the
+        ones a fresh build would compute.
+        """
+        movie_ids = np.array(sorted(movies), dtype=np.int64)
+        new_ids = np.setdiff1d(movie_ids, self.movie_ids)
+        if len(new_ids):
+            self._add_rows(new_ids)
+        rows = self.rows_for(movie_ids)
+
+        self.genres, removed, added = self._replace_rows(
+            self.genres, rows, [set(movies[movie_id][3]) for movie_id in movie_ids], 'genres'
+        )
+        self.genre_df = self._move_counts(self.genre_df, self.genres.shape[1], removed, added)
+        self.directors, _, _ = self._replace_rows(
+            self.directors, rows,
+            [[(movies[movie_id][0] or '').strip().lower()] if (movies[movie_id][0] or '').strip() else []
+             for movie_id in movie_ids],
+            'directors',
+        )
+        self.cast, removed, added = self._replace_rows(
+            self.cast, rows, [_names(movies[movie_id][1]) for movie_id in movie_ids], 'cast'
+        )
+        self.cast_df = self._move_counts(self.cast_df, self.cast.shape[1], removed, added)
+
+        self.years[rows] = [movies[movie_id][2] or 0 for movie_id in movie_ids]
+        for movie_id in movie_ids.tolist():
+            self.signatures[movie_id] = metadata_signature(*movies[movie_id])
+        self._weigh()
+
+    def _add_rows(self, new_ids):
+        """Empty rows for new movies, keeping movie_ids sorted"""
+        movie_ids = np.concatenate([self.movie_ids, new_ids])
+        order = np.argsort(movie_ids, kind='stable')
+
+        def grow(matrix):
+            empty = sparse.csr_matrix((len(new_ids), matrix.shape[1]), dtype=matrix.dtype)
+            return sparse.vstack([matrix, empty], format='csr')[order]
+
+        self.movie_ids = movie_ids[order]
+        self.genres, self.directors, self.cast = grow(self.genres), grow(self.directors), grow(self.cast)
+        self.years = np.concatenate([self.years, np.zeros(len(new_ids), dtype=self.years.dtype)])[order]
+
+    def _replace_rows(self, matrix, rows, keys, kind):
+        """(matrix with `rows` set to `keys`, columns removed, columns added)"""
+        vocabulary = self.vocabularies[kind]
+        columns = [[vocabulary.setdefault(key, len(vocabulary)) for key in row_keys] for row_keys in keys]
+        width = max(matrix.shape[1], len(vocabulary))
+        removed = matrix[rows].indices
+        added = np.fromiter((column for row_columns in columns for column in row_columns), dtype=np.int64)
+
+        keep = np.ones(matrix.shape[0], dtype=matrix.dtype)
+        keep[rows] = 0
+        widened = sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], width))
+        patch = sparse.csr_matrix(
+            (
+                np.ones(len(added), dtype=matrix.dtype),
+                (np.repeat(rows, [len(row_columns) for row_columns in columns]), added),
+            ),
+            shape=(matrix.shape[0], width),
+        )
+        patched = (sparse.diags(keep) @ widened + patch).tocsr()
+        patched.eliminate_zeros()
+        return patched, removed, added
+
+    @staticmethod
+    def _move_counts(df, width, removed, added):
+        df = np.concatenate([df, np.zeros(width - len(df), dtype=df.dtype)])
+        np.subtract.at(df, removed, 1)
+        np.add.at(df, added, 1)
+        return df
+
+    def rows_for(self, movie_ids):
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        if not len(self.movie_ids):
+            return np.empty(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.movie_ids, movie_ids), len(self.movie_ids) - 1)
+        return rows[self.movie_ids[rows] == movie_ids]
+
+    def scores(self, rows):
+        """CSR (len(rows) x catalog) of combined scores; only related pairs are non-zero"""
+        total = (
+            WEIGHTS['genres'] * self._jaccard(self.genres, self.genre_weights, self.genre_sizes, rows)
+            + WEIGHTS['director'] * (self.directors[rows] @ self.directors.T)
+            + WEIGHTS['cast'] * self._jaccard(self.cast, self.cast_weights, self.cast_sizes, rows)
+        ).tocoo()
+
+        # Year proximity only separates movies already related by metadata
+        both = (self.years[rows][total.row] > 0) & (self.years[total.col] > 0)
+        gap = np.abs(self.years[rows][total.row] - self.years[total.col])
+        data = total.data + WEIGHTS['year'] * np.where(both, np.exp(-gap / YEAR_SCALE), 0.0)
+
+        keep = total.col != rows[total.row]
+        return sparse.csr_matrix(
+            (data[keep], (total.row[keep], total.col[keep])), shape=total.shape
+        )
+
+    @staticmethod
+    def _jaccard(matrix, weights, sizes, rows):
+        intersection = (matrix[rows].multiply(weights) @ matrix.T).tocoo()
+        union = sizes[rows][intersection.row] + sizes[intersection.col] - intersection.data
+        return sparse.csr_matrix(
+            (intersection.data / np.maximum(union, 1e-6), (intersection.row, intersection.col)),
+            shape=intersection.shape,
+        )
+
+
+def top_k(scores, k):
+    """[(row, columns, values)] with each row's k best columns, best first"""
+    results = []
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        columns = scores.indices[start:end]
+        values = scores.data[start:end]
+        if len(values) > k:
+            best = np.argpartition(-values, k - 1)[:k]
+            columns, values = columns[best], values[best]
+        order = np.argsort(-values, kind='stable')
+        results.append((row, columns[order], values[order]))
+    return results
+
+
+def save_similar(features, rows, results):
+    """Upsert the similar lists of one block of movies"""
+    objects = [
+        MovieSimilarity(
+            movie_id=int(features.movie_ids[rows[row]]),
+            similar_movie_id=int(features.movie_ids[column]),
+            score=round(float(score), 6),
+        )
+        for row, columns, values in results
+        for column, score in zip(columns, values)
+    ]
+    states = [
+        MovieSimilarityState(movie_id=int(movie_id), signature=features.signatures[int(movie_id)])
+        for movie_id in features.movie_ids[rows]
+    ]
+    with transaction.atomic():
+        if objects:
+            MovieSimilarity.objects.bulk_create(
+                objects,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['movie', 'similar_movie'],
+                update_fields=['score', 'updated_at'],
+            )
+        MovieSimilarityState.objects.bulk_create(
+            states,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['movie'],
+            update_fields=['signature', 'computed_at'],
+        )
+    return len(objects)
+
+
+def get_top_k():
+    return settings.CYNARA_SETTINGS.get('MOVIE_SIMILARITY_TOP_K', 30)
+
+
+_features = None
+_features_built_at = 0.0
+_features_lock = threading.RLock()
+
+
+def get_movie_features():
+    """Process-wide MovieFeatures, rebuilt from the catalog after MOVIE_FEATURES_TTL"""
+    global _features, _features_built_at
+    ttl = settings.CYNARA_SETTINGS.get('MOVIE_FEATURES_TTL', 3600)
+    with _features_lock:
+        if _features is None or time.monotonic() - _features_built_at >= ttl:
+            _set_movie_features(MovieFeatures.build())
+        return _features
+
+
+def _set_movie_features(features):
+    global _features, _features_built_at
+    with _features_lock:
+        _features = features
+        _features_built_at = time.monotonic()
+
+
+def compute_movie_similarities(k=None, block_size=None, progress=None):
+    """
+    Rebuild MovieSimilarity for the whole catalog.
+
+    `progress`, if given, is called with (movies_done, movies_total) after
+    each block is written. Returns the number of pairs stored.
+    """
+    k = k or get_top_k()
+    block_size = block_size or settings.CYNARA_SETTINGS.get('MOVIE_SIMILARITY_BLOCK_SIZE', 256)
+    started = timezone.now()
+    features = MovieFeatures.build()
+    _set_movie_features(features)
+
+    stored = 0
+    for start in range(0, len(features), block_size):
+        rows = np.arange(start, min(start + block_size, len(features)))
+        stored += save_similar(features, rows, top_k(features.scores(rows), k))
+        if progress is not None:
+            progress(rows[-1] + 1, len(features))
+
+    MovieSimilarity.objects.filter(updated_at__lt=started).delete()
+    return stored
+
+
+def update_movie_similarities(movie_ids, k=None):
+    """
+    Recompute the lists of movies whose metadata changed.
+
+    Movies whose signature still matches are skipped, so saves that only
+    touch counters cost one query. Reverse entries are patched like
+    UserSimilarity's: updated if present, inserted when the movie now beats
+    the other list's weakest entry, removed when no longer related. The
+    full rebuild trims lists back to k.
+
+    The changed movies' rows of the cached MovieFeatures are patched from
+    the metadata read here, so a batch queries only the movies it holds.
+    """
+    k = k or get_top_k()
+    stored = dict(
+        MovieSimilarityState.objects.filter(movie_id__in=movie_ids).values_list('movie_id', 'signature')
+    )
+    current = {}
+    for movie_id, director, cast, year in Movie.objects.filter(id__in=movie_ids).values_list(
+        'id', 'director', 'cast', 'year'
+    ):
+        current[movie_id] = [director, cast, year, []]
+    for movie_id, genre_id in Movie.genres.through.objects.filter(movie_id__in=movie_ids).values_list(
+        'movie_id', 'genre_id'
+    ):
+        current[movie_id][3].append(genre_id)
+    changed = sorted(
+        movie_id for movie_id, values in current.items()
+        if stored.get(movie_id) != metadata_signature(*values)
+    )
+    if not changed:
+        return 0
+
+    started = timezone.now()
+    with _features_lock:
+        features = get_movie_features()
+        features.update({movie_id: current[movie_id] for movie_id in changed})
+        rows = features.rows_for(changed)
+        scores = features.scores(rows)
+        movie_ids = features.movie_ids
+        save_similar(features, rows, top_k(scores, k))
+    MovieSimilarity.objects.filter(movie_id__in=changed, updated_at__lt=started).delete()
+
+    # Scores are symmetric, so each changed row is also every other list's column
+    reverse = {}
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        for column, score in zip(scores.indices[start:end], scores.data[start:end]):
+            reverse[(int(movie_ids[column]), int(movie_ids[rows[row]]))] = float(score)
+
+    existing = set(
+        MovieSimilarity.objects.filter(similar_movie_id__in=changed).values_list('movie_id', 'similar_movie_id')
+    )
+    weakest = {
+        entry['movie']: (entry['weakest'], entry['count'])
+        for entry in MovieSimilarity.objects.filter(
+            movie_id__in={movie_id for movie_id, _ in reverse}
+        ).values('movie').annotate(weakest=Min('score'), count=Count('id'))
+    }
+    updates = [
+        MovieSimilarity(movie_id=movie_id, similar_movie_id=similar_id, score=round(score, 6))
+        for (movie_id, similar_id), score in reverse.items()
+        if (movie_id, similar_id) in existing
+        or weakest.get(movie_id, (0.0, 0))[1] < k
+        or score > weakest[movie_id][0]
+    ]
+    with transaction.atomic():
+        if updates:
+            MovieSimilarity.objects.bulk_create(
+                updates,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['movie', 'similar_movie'],
+                update_fields=['score', 'updated_at'],
+            )
+        MovieSimilarity.objects.filter(similar_movie_id__in=changed, updated_at__lt=started).delete()
+    return len(changed)
+
+
+@batcher(delay=2.0, max_delay=10.0)
+def movie_similarity_updates(movie_ids):
+    update_movie_similarities(list(movie_ids))
+
+
+@receiver(post_save, sender=Movie)
+def _movie_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    # Counter updates (view_count, user_rating) can't change the score
+    if update_fields is not None and not METADATA_FIELDS.intersection(update_fields):
+        return
+    movie_similarity_updates.add(instance.id)
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def _movie_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        movie_similarity_updates.add(instance.pk)
+    elif pk_set:
+        movie_similarity_updates.add_many(pk_set)
@@ -0,0 +1,169 @@
+"""
+Cynara Recommendation Serving
+
+Answers recommendation requests from precomputed RecommendationSets
+instead of querying and ordering Movie on every hit. Results are cached per
+user; an expired set is still served (stale-while-revalidate) while a
+background refresh recomputes it, so request latency never depends on the
+size of the catalog.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from movies.models import Movie
+from .bandit import algorithm_bandit, bandit_enabled
+from .engine import (
+    ALGORITHMS, REASONS, get_recommendation_count, recommend_for_users, save_recommendations
+)
+from .feedback import negative_filters
+from .models import RecommendationItem, RecommendationSet
+from .tasks import batcher
+
+POPULAR_CACHE_KEY = 'cynara:recs:popular'
+
+
+def _cache_key(user_id, algorithm):
+    return f'cynara:recs:{user_id}:{algorithm}'
+
+
+def get_default_algorithm():
+    return settings.CYNARA_SETTINGS.get('DEFAULT_RECOMMENDATION_ALGORITHM', 'hybrid')
+
+
+def get_algorithm_for(user_id, record_pull=True):
+    """The bandit's current pick for this user, or the default when it is off"""
+    if bandit_enabled():
+        return algorithm_bandit.choose(user_id, record_pull=record_pull)
+    return get_default_algorithm()
+
+
+class ServedRecommendations:
+    """What a view renders: movies with score and reason, plus freshness"""
+
+    def __init__(self, items, algorithm, expires_at=None, stale=False):
+        self.items = items  # [(movie, score, reason), ...]
+        self.algorithm = algorithm
+        self.expires_at = expires_at
+        self.stale = stale
+
+    @property
+    def movies(self):
+        return [movie for movie, _, _ in self.items]
+
+    def __len__(self):
+        return len(self.items)
+
+
+def popular_movies(limit=24):
+    """Most viewed available movies, shared by every process-local request"""
+    movies = cache.get(POPULAR_CACHE_KEY)
+    if movies is None or len(movies) < limit:
+        movies = list(Movie.objects.filter(is_available=True).order_by('-view_count')[:max(limit, 24)])
+        cache.set(POPULAR_CACHE_KEY, movies, settings.CYNARA_SETTINGS.get('POPULAR_CACHE_SECONDS', 300))
+    return movies[:limit]
+
+
+def _load_latest_set(user_id, algorithm):
+    """Latest set for the user (expired or not) with its items and movies: two queries"""
+    items = RecommendationItem.objects.filter(
+        movie__is_available=True
+    ).select_related('movie').order_by('position')
+    return RecommendationSet.objects.filter(
+        user_id=user_id, algorithm_used=algorithm
+    ).order_by('-created_at').prefetch_related(
+        Prefetch('recommendationitem_set', queryset=items, to_attr='served_items')
+    ).first()
+
+
+def get_user_recommendations(user, algorithm=None, limit=None):
+    """
+    Recommendations for a user, from cache or their latest precomputed set.
+
+    Never computes recommendations inline: a missing or expired set queues a
+    refresh and the caller gets the stale set or popular movies meanwhile.
+    Without an explicit algorithm the bandit picks one for the user.
+    """
+    algorithm = algorithm or get_algorithm_for(user.id)
+    limit = limit or get_recommendation_count()
+    now = timezone.now()
+    key = _cache_key(user.id, algorithm)
+
+    served = cache.get(key)
+    if served is None:
+        recommendation_set = _load_latest_set(user.id, algorithm)
+        if recommendation_set is None:
+            served = ServedRecommendations([], algorithm, stale=True)
+        else:
+            served = ServedRecommendations(
+                [(item.movie, item.score, item.reason) for item in recommendation_set.served_items],
+                algorithm,
+                expires_at=recommendation_set.expires_at,
+            )
+        timeout = settings.CYNARA_SETTINGS.get('RECOMMENDATIONS_CACHE_SECONDS', 300)
+        if served.expires_at is not None:
+            timeout = max(1, min(timeout, int((served.expires_at - now).total_seconds()) or 1))
+        cache.set(key, served, timeout)
+
+    if served.expires_at is None or served.expires_at <= now:
+        served.stale = True
+        recommendation_refreshes.add((user.id, algorithm))
+
+    # Feedback given since the set was computed applies immediately
+    dismissed = negative_filters.get(user.id)
+    if len(dismissed) and served.items:
+        kept = set(negative_filters.exclude(user.id, [movie.id for movie in served.movies]).tolist())
+        served = ServedRecommendations(
+            [item for item in served.items if item[0].id in kept],
+            algorithm,
+            expires_at=served.expires_at,
+            stale=served.stale,
+        )
+
+    if len(served) < limit:
+        # Top up with popular movies so a new user never sees an empty page
+        chosen = {movie.id for movie in served.movies}
+        chosen.update(dismissed.tolist())
+        extra = [
+            (movie, 0.0, REASONS['popularity'])
+            for movie in popular_movies(limit * 2)
+            if movie.id not in chosen
+        ]
+        served = ServedRecommendations(
+            served.items + extra[:limit - len(served)],
+            algorithm,
+            expires_at=served.expires_at,
+            stale=served.stale,
+        )
+    elif len(served) > limit:
+        served = ServedRecommendations(served.items[:limit], algorithm, served.expires_at, served.stale)
+    return served
+
+
+def invalidate_user_recommendations(user_ids, algorithms=None):
+    """Drop cached entries so the next request reads the new set"""
+    cache.delete_many([
+        _cache_key(user_id, algorithm)
+        for user_id in user_ids
+        for algorithm in (algorithms or ALGORITHMS)
+    ])
+
+
+def refresh_user_recommendations(user_ids, algorithm=None):
+    """Recompute and store sets for some users right now"""
+    algorithm = algorithm or get_default_algorithm()
+    results = recommend_for_users(list(user_ids), algorithm=algorithm)
+    saved = save_recommendations(results, algorithm)
+    invalidate_user_recommendations(user_ids, [algorithm])
+    return saved
+
+
+@batcher(delay=0.5, max_delay=5.0)
+def recommendation_refreshes(keys):
+    by_algorithm = {}
+    for user_id, algorithm in keys:
+        by_algorithm.setdefault(algorithm, set()).add(user_id)
+    for algorithm, user_ids in by_algorithm.items():
+        refresh_user_recommendations(user_ids, algorithm)
@@ -0,0 +1,210 @@
+"""
+Cynara Similarity Index
+
+Packs every MovieEmbedding into one contiguous, L2-normalized float32 matrix
+so that "movies like this one" is a single matrix-vector product instead of
+parsing a JSON list per movie on every request.
+"""
+
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import snapshot
+from .models import MovieEmbedding
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row in place; all-zero rows are left as zeros"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+class SimilarityIndex:
+    """Normalized embedding matrix with a movie id <-> row mapping"""
+
+    def __init__(self, movie_ids, matrix, normalized=False, version=None):
+        order = np.argsort(movie_ids, kind='stable')
+        if not np.all(order == np.arange(len(order))):
+            movie_ids = np.asarray(movie_ids)[order]
+            matrix = np.asarray(matrix)[order]
+        # Rows are kept sorted by movie id so lookups are a binary search
+        # rather than a per-process dict that grows with the catalog
+        self.movie_ids = np.ascontiguousarray(movie_ids, dtype=np.int64)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if not normalized:
+            self.matrix = normalize_rows(self.matrix.copy())
+        self.version = version
+
+    @classmethod
+    def from_queryset(cls, queryset=None):
+        """Build the index from MovieEmbedding rows of available movies"""
+        if queryset is None:
+            queryset = MovieEmbedding.objects.filter(movie__is_available=True)
+        queryset = queryset.order_by('movie_id')
+
+        movie_ids = []
+        vectors = []
+        dimensions = None
+        for movie_id, vector in queryset.values_list('movie_id', 'embedding_vector').iterator(chunk_size=2000):
+            if not vector:
+                continue
+            if dimensions is None:
+                dimensions = len(vector)
+            elif len(vector) != dimensions:
+                # Embeddings from a different model can't share the matrix
+                continue
+            movie_ids.append(movie_id)
+            vectors.append(vector)
+
+        if not vectors:
+            return cls(np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32))
+        return cls(movie_ids, np.array(vectors, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def __contains__(self, movie_id):
+        return self.row_for(movie_id) is not None
+
+    @property
+    def dimensions(self):
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def row_for(self, movie_id):
+        """Matrix row holding movie_id, or None if it isn't indexed"""
+        row = int(np.searchsorted(self.movie_ids, movie_id))
+        if row < len(self.movie_ids) and self.movie_ids[row] == movie_id:
+            return row
+        return None
+
+    def rows_for(self, movie_ids):
+        """Vectorized row_for; ids that aren't indexed are dropped"""
+        movie_ids = np.fromiter(movie_ids, dtype=np.int64)
+        if not len(movie_ids) or not len(self.movie_ids):
+            return np.empty(0, dtype=np.int64)
+        rows = np.searchsorted(self.movie_ids, movie_ids)
+        rows = np.minimum(rows, len(self.movie_ids) - 1)
+        return rows[self.movie_ids[rows] == movie_ids]
+
+    def vector_for(self, movie_id):
+        """Return the normalized vector for a movie, or None if it isn't indexed"""
+        row = self.row_for(movie_id)
+        return None if row is None else self.matrix[row]
+
+    def top_k(self, vector, k=12, exclude=()):
+        """Return [(movie_id, score), ...] of the k rows closest to vector"""
+        if not len(self) or k <= 0:
+            return []
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        scores = self.matrix @ (query / norm)
+
+        excluded_rows = self.rows_for(exclude)
+        if len(excluded_rows):
+            scores[excluded_rows] = -np.inf
+
+        return self._select(scores, k)
+
+    def top_k_batch(self, vectors, k=12):
+        """Answer several queries with one matrix-matrix product"""
+        if not len(self) or k <= 0:
+            return [[] for _ in vectors]
+
+        queries = normalize_rows(np.array(vectors, dtype=np.float32, ndmin=2))
+        scores = queries @ self.matrix.T
+        return [self._select(row, k) for row in scores]
+
+    def similar_to(self, movie_id, k=12):
+        """Movies closest to movie_id, excluding the movie itself"""
+        vector = self.vector_for(movie_id)
+        if vector is None:
+            return []
+        return self.top_k(vector, k=k, exclude=(movie_id,))
+
+    def _select(self, scores, k):
+        k = min(k, len(scores))
+        # argpartition is O(n); only the k winners get fully sorted
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [
+            (int(self.movie_ids[row]), float(scores[row]))
+            for row in candidates
+            if np.isfinite(scores[row])
+        ]
+
+
+_index = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+_snapshot_checked_at = 0.0
+
+
+def _load_snapshot_index(path, current):
+    """Map the shared snapshot if it is newer than the index we hold"""
+    try:
+        version = snapshot.read_snapshot_version(path)
+        if current is not None and current.version is not None and version <= current.version:
+            return current
+        version, movie_ids, matrix = snapshot.read_snapshot(path)
+    except (OSError, snapshot.SnapshotError):
+        return None
+    return SimilarityIndex(movie_ids, matrix, normalized=True, version=version)
+
+
+def get_similarity_index():
+    """
+    Return the process-wide index.
+
+    When a snapshot file exists every worker maps it and swaps to a newer
+    version as soon as one is written; otherwise the index is built from the
+    database and rebuilt once it is older than the TTL.
+    """
+    global _index, _index_built_at, _snapshot_checked_at
+
+    now = time.monotonic()
+    path = snapshot.get_snapshot_path()
+    interval = settings.CYNARA_SETTINGS.get('EMBEDDING_SNAPSHOT_CHECK_INTERVAL', 10)
+    if path is not None and (_index is None or now - _snapshot_checked_at >= interval):
+        with _index_lock:
+            _snapshot_checked_at = now
+            loaded = _load_snapshot_index(path, _index)
+            if loaded is not None:
+                # A single reference assignment, so readers see either the
+                # old mapping or the new one, never a mix
+                _index = loaded
+
+    if _index is not None and _index.version is not None:
+        return _index
+
+    ttl = settings.CYNARA_SETTINGS.get('SIMILARITY_INDEX_TTL', 300)
+    if _index is not None and now - _index_built_at < ttl:
+        return _index
+
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_built_at >= ttl:
+            _index = SimilarityIndex.from_queryset()
+            _index_built_at = time.monotonic()
+    return _index
+
+
+def invalidate_similarity_index():
+    """Force the next get_similarity_index() call to rebuild or re-check"""
+    global _index_built_at, _snapshot_checked_at
+    _index_built_at = 0.0
+    _snapshot_checked_at = 0.0
+
+
+@receiver(post_save, sender=MovieEmbedding)
+@receiver(post_delete, sender=MovieEmbedding)
+def _embedding_changed(sender, **kwargs):
+    invalidate_similarity_index()
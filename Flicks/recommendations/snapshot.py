@@ -0,0 +1,137 @@
+"""
+Cynara Embedding Snapshots
+
+A versioned binary file holding every MovieEmbedding as a normalized float32
+matrix plus its movie id table. Workers mmap it read-only, so all gunicorn
+workers on a host share the same physical pages and boot without touching
+the database.
+
+Layout (little-endian):
+    header   64 bytes  magic, format, version, rows, dimensions
+    matrix   rows * dimensions float32, row-major, rows sorted by movie id
+    ids      rows int64
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+MAGIC = b'CYNEMB\x00\x00'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIQQI')
+HEADER_SIZE = 64
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, truncated or of another format"""
+
+
+def get_snapshot_path():
+    """Location of the shared snapshot, from CYNARA_SETTINGS"""
+    path = settings.CYNARA_SETTINGS.get('EMBEDDING_SNAPSHOT_PATH')
+    return Path(path) if path else None
+
+
+def _parse_header(data, path):
+    if len(data) < HEADER_SIZE:
+        raise SnapshotError(f"{path} is truncated")
+    magic, file_format, _, version, rows, dimensions = HEADER.unpack_from(data)
+    if magic != MAGIC or file_format != FORMAT_VERSION:
+        raise SnapshotError(f"{path} is not a format {FORMAT_VERSION} embedding snapshot")
+    return version, rows, dimensions
+
+
+def read_snapshot_version(path):
+    """Read only the header; cheap enough to call on every staleness check"""
+    with open(path, 'rb') as snapshot:
+        return _parse_header(snapshot.read(HEADER_SIZE), path)[0]
+
+
+def read_snapshot(path):
+    """
+    Map a snapshot read-only and return (version, movie_ids, matrix).
+
+    The arrays are views over the mapping, not copies; the mapping stays
+    alive for as long as either array is referenced.
+    """
+    with open(path, 'rb') as snapshot:
+        size = os.fstat(snapshot.fileno()).st_size
+        if size < HEADER_SIZE:
+            raise SnapshotError(f"{path} is truncated")
+        mapping = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+
+    version, rows, dimensions = _parse_header(mapping, path)
+    matrix_bytes = rows * dimensions * 4
+    if size != HEADER_SIZE + matrix_bytes + rows * 8:
+        raise SnapshotError(f"{path} is truncated")
+
+    matrix = np.frombuffer(mapping, dtype='<f4', count=rows * dimensions, offset=HEADER_SIZE)
+    movie_ids = np.frombuffer(mapping, dtype='<i8', count=rows, offset=HEADER_SIZE + matrix_bytes)
+    return version, movie_ids, matrix.reshape(rows, dimensions)
+
+
+def write_snapshot(path, rows, chunk_size=2000):
+    """
+    Write (movie_id, vector) pairs, already ordered by movie id, to path.
+
+    Vectors are normalized and streamed to a temporary file in chunks, which
+    then atomically replaces the old snapshot so readers never see a partial
+    file. Returns (version, row_count, dimensions).
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        version = read_snapshot_version(path) + 1
+    except (OSError, SnapshotError):
+        version = 1
+
+    movie_ids = []
+    dimensions = None
+    chunk = []
+
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as snapshot:
+            snapshot.write(b'\x00' * HEADER_SIZE)
+
+            def flush():
+                matrix = np.array(chunk, dtype='<f4')
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                snapshot.write((matrix / norms).astype('<f4').tobytes())
+                chunk.clear()
+
+            for movie_id, vector in rows:
+                if not vector:
+                    continue
+                if dimensions is None:
+                    dimensions = len(vector)
+                elif len(vector) != dimensions:
+                    continue
+                movie_ids.append(movie_id)
+                chunk.append(vector)
+                if len(chunk) >= chunk_size:
+                    flush()
+            if chunk:
+                flush()
+
+            snapshot.write(np.array(movie_ids, dtype='<i8').tobytes())
+            snapshot.seek(0)
+            snapshot.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, version, len(movie_ids), dimensions or 0))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    return version, len(movie_ids), dimensions or 0
@@ -0,0 +1,145 @@
+"""
+Cynara Background Batching
+
+A tiny in-process work queue for the recommendation subsystems. Events are
+collected per key and handed to a handler in batches once they stop
+arriving, so a burst of ratings turns into a single update. Each gunicorn
+worker runs its own batcher thread; nothing here needs Celery or Redis.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class DebouncedBatcher:
+    """
+    Collect keys and call handler(keys) in a background thread.
+
+    A batch is flushed `delay` seconds after the last key was added, but no
+    later than `max_delay` seconds after the first, so a steady stream of
+    events can't postpone an update forever.
+    """
+
+    def __init__(self, handler, delay=2.0, max_delay=10.0, name=None):
+        self.handler = handler
+        self.delay = delay
+        self.max_delay = max_delay
+        self.name = name or handler.__name__
+        self._pending = set()
+        self._first_at = None
+        self._last_at = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, key):
+        """Queue a key once the surrounding transaction commits"""
+        transaction.on_commit(lambda: self._add(key))
+
+    def add_many(self, keys):
+        keys = list(keys)
+        transaction.on_commit(lambda: self._add(*keys))
+
+    def _add(self, *keys):
+        if not settings.CYNARA_SETTINGS.get('BACKGROUND_TASKS', True):
+            # Synchronous mode for tests and management shells
+            self._run(set(keys))
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self._pending.update(keys)
+            self._first_at = self._first_at or now
+            self._last_at = now
+            self._ensure_thread()
+        self._wakeup.set()
+
+    def _ensure_thread(self):
+        # Threads don't survive a fork, so gunicorn workers start their own
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name=f'cynara-{self.name}', daemon=True)
+            self._thread.start()
+
+    def _due(self, now):
+        if not self._pending:
+            return False
+        return now - self._last_at >= self.delay or now - self._first_at >= self.max_delay
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending, set()
+            self._first_at = self._last_at = None
+        return batch
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(timeout=self.delay)
+            self._wakeup.clear()
+            if self._due(time.monotonic()):
+                self._run(self._take())
+
+    def _run(self, batch):
+        if not batch:
+            return
+        close_old_connections()
+        try:
+            self.handler(batch)
+        except Exception:
+            logger.exception('Background batch %s failed for %d keys', self.name, len(batch))
+        finally:
+            if threading.current_thread() is self._thread:
+                connection.close()
+
+    def retry(self, keys):
+        """Queue keys from a failed batch again; they go with the next batch, never inline"""
+        now = time.monotonic()
+        with self._lock:
+            self._pending.update(keys)
+            self._first_at = self._first_at or now
+            self._last_at = now
+            if settings.CYNARA_SETTINGS.get('BACKGROUND_TASKS', True):
+                self._ensure_thread()
+        self._wakeup.set()
+
+    def flush(self):
+        """Run whatever is pending right now, in the calling thread"""
+        self._run(self._take())
+
+    def hurry(self):
+        """Make pending keys due now; the worker thread runs them without waiting out the delay"""
+        with self._lock:
+            if not self._pending:
+                return
+            self._first_at = time.monotonic() - self.max_delay
+        self._wakeup.set()
+
+
+_batchers = []
+
+
+def batcher(delay=2.0, max_delay=10.0):
+    """Decorator turning handler(keys) into a DebouncedBatcher"""
+    def decorate(handler):
+        instance = DebouncedBatcher(handler, delay=delay, max_delay=max_delay)
+        _batchers.append(instance)
+        return instance
+    return decorate
+
+
+@atexit.register
+def _flush_on_exit():
+    for instance in _batchers:
+        try:
+            instance.flush()
+        except Exception:
+            logger.exception('Flushing %s on exit failed', instance.name)
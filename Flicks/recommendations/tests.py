@@ -1,3 +1,223 @@
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from movies.models import Genre, Movie, WatchHistory
+from . import feedback
+from .bandit import AlgorithmBandit
+from .feedback import feedback_flushes, write_feedback
+from .models import AlgorithmFeedbackStats, RecommendationFeedback, TrendingMovie
+from .related import MovieFeatures
+from .trending import update_trending
+
+
+class WriteFeedbackTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(f'viewer{index}') for index in range(2)]
+        self.movies = [
+            Movie.objects.create(title=f'Movie {index}', slug=f'movie-{index}', file_path=f'{index}.mp4')
+            for index in range(2)
+        ]
+        # Bandit credits are process-wide state; keep them out of these tests
+        bandit = mock.patch.object(feedback, 'algorithm_bandit')
+        self.bandit = bandit.start()
+        self.addCleanup(bandit.stop)
+
+    def stats(self):
+        return {
+            (algorithm, feedback_type): count
+            for algorithm, feedback_type, count in AlgorithmFeedbackStats.objects.values_list(
+                'algorithm', 'feedback_type', 'count'
+            )
+        }
+
+    def stored(self):
+        return {
+            (user_id, movie_id): (feedback_type, algorithm)
+            for user_id, movie_id, feedback_type, algorithm in RecommendationFeedback.objects.values_list(
+                'user_id', 'movie_id', 'feedback_type', 'recommendation_algorithm'
+            )
+        }
+
+    def test_new_feedback_is_stored_and_counted(self):
+        events = {
+            (self.users[0].id, self.movies[0].id): ('liked', 'hybrid'),
+            (self.users[0].id, self.movies[1].id): ('liked', 'hybrid'),
+            (self.users[1].id, self.movies[0].id): ('disliked', 'collaborative'),
+        }
+        self.assertEqual(write_feedback(events), 3)
+        self.assertEqual(self.stored(), events)
+        self.assertEqual(self.stats(), {('hybrid', 'liked'): 2, ('collaborative', 'disliked'): 1})
+        self.bandit.record.assert_has_calls(
+            [mock.call('hybrid', 'liked', 2), mock.call('collaborative', 'disliked', 1)], any_order=True
+        )
+
+    def test_changed_feedback_moves_the_counts(self):
+        key = (self.users[0].id, self.movies[0].id)
+        write_feedback({key: ('liked', 'hybrid')})
+        write_feedback({key: ('not_interested', 'hybrid')})
+
+        self.assertEqual(self.stored(), {key: ('not_interested', 'hybrid')})
+        self.assertEqual(self.stats(), {('hybrid', 'liked'): 0, ('hybrid', 'not_interested'): 1})
+
+    def test_repeated_feedback_changes_nothing(self):
+        key = (self.users[0].id, self.movies[0].id)
+        write_feedback({key: ('liked', 'hybrid')})
+        self.bandit.reset_mock()
+
+        write_feedback({key: ('liked', 'hybrid')})
+
+        self.assertEqual(self.stored(), {key: ('liked', 'hybrid')})
+        self.assertEqual(self.stats(), {('hybrid', 'liked'): 1})
+        # Only changed outcomes are credited to the bandit
+        self.bandit.record.assert_not_called()
+
+    def test_existing_rollup_rows_are_incremented(self):
+        AlgorithmFeedbackStats.objects.create(algorithm='hybrid', feedback_type='liked', count=7)
+        write_feedback({(self.users[0].id, self.movies[0].id): ('liked', 'hybrid')})
+        self.assertEqual(self.stats(), {('hybrid', 'liked'): 8})
+
+    def test_unknown_movies_are_dropped(self):
+        self.assertEqual(write_feedback({(self.users[0].id, 999999): ('liked', 'hybrid')}), 0)
+        self.assertEqual(RecommendationFeedback.objects.count(), 0)
+        self.assertEqual(self.stats(), {})
+
+
+class FeedbackFlushTests(TestCase):
+    def setUp(self):
+        self.addCleanup(feedback._latest.clear)
+
+    def test_failed_flush_keeps_the_events(self):
+        older, newer = (1, 10), (1, 11)
+        feedback._latest.update({older: ('liked', 'hybrid'), newer: ('liked', 'hybrid')})
+
+        def fail(events):
+            # A newer click for one pair arrives while the batch is being written
+            feedback._latest[newer] = ('disliked', 'hybrid')
+            raise RuntimeError('database is down')
+
+        with mock.patch.object(feedback, 'write_feedback', side_effect=fail), \
+                mock.patch.object(feedback_flushes, 'retry') as retry:
+            with self.assertRaises(RuntimeError):
+                feedback_flushes.handler({older, newer})
+
+        self.assertEqual(feedback._latest, {older: ('liked', 'hybrid'), newer: ('disliked', 'hybrid')})
+        self.assertEqual(set(retry.call_args.args[0]), {older, newer})
+
+
+class AlgorithmBanditTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bandit = AlgorithmBandit(arms=['hybrid', 'popularity'])
+
+    def test_one_pull_per_assignment(self):
+        for _ in range(5):
+            arm = self.bandit.choose(user_id=1)
+        self.bandit.choose(user_id=2, record_pull=False)
+
+        _, _, pulls = self.bandit.statistics()
+        self.assertEqual(pulls.sum(), 1)
+        self.assertEqual(pulls[self.bandit.arms.index(arm)], 1)
+
+    def test_record_counts(self):
+        self.bandit.record('hybrid', 'liked', 3)
+        self.bandit.record('hybrid', 'disliked')
+        self.bandit.record('unknown', 'liked')
+
+        successes, failures, _ = self.bandit.statistics()
+        self.assertEqual((successes[0], failures[0]), (3, 1))
+        self.assertEqual((successes[1], failures[1]), (0, 0))
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('viewer')
+        self.movies = [
+            Movie.objects.create(title=f'Movie {index}', slug=f'movie-{index}', file_path=f'{index}.mp4')
+            for index in range(4)
+        ]
+        self.start = timezone.now() - timedelta(days=3)
+
+    def at(self, hours):
+        return self.start + timedelta(hours=hours)
+
+    def watch(self, movie_index, hours):
+        row = WatchHistory.objects.create(user=self.user, movie=self.movies[movie_index])
+        # watched_at is auto_now; move the session start afterwards
+        WatchHistory.objects.filter(id=row.id).update(watched_at=self.at(hours))
+
+    def scores(self):
+        return dict(TrendingMovie.objects.filter(window='24h').values_list('movie_id', 'score'))
+
+    def test_incremental_updates_match_a_full_recompute(self):
+        for movie_index, hours in [(0, 0), (1, 2), (0, 5), (2, 6)]:
+            self.watch(movie_index, hours)
+        update_trending('24h', now=self.at(8))
+
+        # New sessions arrive between runs while the earliest ones slide out of the window
+        for movie_index, hours in [(1, 12), (3, 20), (0, 26)]:
+            self.watch(movie_index, hours)
+        update_trending('24h', now=self.at(27))
+        for movie_index, hours in [(2, 28), (3, 29)]:
+            self.watch(movie_index, hours)
+        update_trending('24h', now=self.at(31))
+        incremental = self.scores()
+
+        update_trending('24h', full=True, now=self.at(31))
+        full = self.scores()
+
+        self.assertEqual(set(incremental), set(full))
+        for movie_id, score in full.items():
+            self.assertAlmostEqual(incremental[movie_id], score, places=6)
+        # Only sessions inside the window count: movie 1's at 2h slid out, the one at 12h stays
+        self.assertEqual(set(full), {movie.id for movie in self.movies})
+
+
+class MovieFeaturesUpdateTests(TestCase):
+    def setUp(self):
+        self.genres = [Genre.objects.create(name=name, slug=name.lower()) for name in ('Drama', 'Noir', 'Comedy')]
+        self.movies = []
+        for index, (director, cast, genres) in enumerate([
+            ('Ann Lee', 'Bo Chan, Cy Dunn', [0, 1]),
+            ('Ann Lee', 'Cy Dunn', [0]),
+            ('Di Fox', 'Bo Chan, Ed Gray', [0, 2]),
+            ('Di Fox', 'Ed Gray', [2]),
+        ]):
+            movie = Movie.objects.create(
+                title=f'Movie {index}', slug=f'movie-{index}', file_path=f'{index}.mp4',
+                director=director, cast=cast, year=1990 + index,
+            )
+            movie.genres.set([self.genres[genre] for genre in genres])
+            self.movies.append(movie)
+
+    def metadata(self, movies):
+        return {
+            movie.id: [movie.director, movie.cast, movie.year, [genre.id for genre in movie.genres.all()]]
+            for movie in movies
+        }
+
+    def test_patched_rows_score_like_a_fresh_build(self):
+        features = MovieFeatures.build()
+
+        self.movies[1].director = 'Di Fox'
+        self.movies[1].cast = 'Ed Gray, Flo Hart'
+        self.movies[1].save()
+        self.movies[2].genres.set([self.genres[1]])
+        added = Movie.objects.create(
+            title='New', slug='new', file_path='new.mp4', director='Ann Lee', cast='Flo Hart', year=2001,
+        )
+        added.genres.set(self.genres)
+        features.update(self.metadata([self.movies[1], self.movies[2], added]))
 
-# Create your tests here.
+        fresh = MovieFeatures.build()
+        np.testing.assert_array_equal(features.movie_ids, fresh.movie_ids)
+        self.assertEqual(features.signatures, fresh.signatures)
+        rows = np.arange(len(fresh))
+        np.testing.assert_allclose(
+            features.scores(rows).toarray(), fresh.scores(rows).toarray(), rtol=1e-5, atol=1e-6
+        )
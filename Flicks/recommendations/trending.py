@@ -0,0 +1,159 @@
+"""
+Cynara Trending
+
+Exponentially time-decayed watch scores over sliding windows, materialized
+in TrendingMovie. A movie's score is the sum of exp(-rate * age) over the
+watch sessions inside the window. Each update folds in only what changed
+since the previous run:
+
+    score_now = score_then * exp(-rate * elapsed)
+                + contributions of sessions started since then
+                - contributions of sessions that slid out of the window
+
+so the cost depends on recent activity, not on the size of WatchHistory.
+"""
+
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from movies.models import Movie, WatchHistory
+from .models import TrendingMovie, TrendingState
+
+WINDOWS = {
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+
+# Scores below this are indistinguishable from "not trending"
+MIN_SCORE = 1e-3
+
+
+def decay_rate(window):
+    """Per-second decay; the half-life is a fraction of the window length"""
+    half_life = WINDOWS[window].total_seconds() * settings.CYNARA_SETTINGS.get('TRENDING_HALF_LIFE', 0.25)
+    return math.log(2) / half_life
+
+
+def _contributions(events, now, rate):
+    scores = defaultdict(float)
+    for movie_id, watched_at in events:
+        scores[movie_id] += math.exp(-rate * max((now - watched_at).total_seconds(), 0.0))
+    return scores
+
+
+def update_trending(window, full=False, now=None):
+    """
+    Bring one window's scores up to `now`.
+
+    A full run recomputes from every session in the window (use it to wipe
+    out accumulated rounding or after bulk edits to WatchHistory).
+    Returns the number of movies whose score was touched.
+    """
+    now = now or timezone.now()
+    length = WINDOWS[window]
+    rate = decay_rate(window)
+
+    with transaction.atomic():
+        state = TrendingState.objects.select_for_update().filter(window=window).first()
+        sessions = WatchHistory.objects.values_list('movie_id', 'watched_at')
+
+        if state is None or full:
+            last_event_id = WatchHistory.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            scores = _contributions(
+                sessions.filter(watched_at__gt=now - length, id__lte=last_event_id).iterator(),
+                now, rate,
+            )
+            TrendingMovie.objects.filter(window=window).delete()
+            touched = scores
+        else:
+            last_event_id = WatchHistory.objects.filter(
+                id__gt=state.last_event_id
+            ).order_by('-id').values_list('id', flat=True).first() or state.last_event_id
+
+            added = _contributions(
+                sessions.filter(
+                    id__gt=state.last_event_id, id__lte=last_event_id, watched_at__gt=now - length
+                ).iterator(),
+                now, rate,
+            )
+            expired = _contributions(
+                sessions.filter(
+                    id__lte=state.last_event_id,
+                    watched_at__gt=state.computed_at - length,
+                    watched_at__lte=now - length,
+                ).iterator(),
+                now, rate,
+            )
+
+            # Decay every stored score in one statement; relative order of
+            # untouched movies doesn't change, so no re-sort is needed
+            factor = math.exp(-rate * max((now - state.computed_at).total_seconds(), 0.0))
+            TrendingMovie.objects.filter(window=window).update(score=F('score') * factor)
+
+            touched_ids = set(added) | set(expired)
+            current = dict(
+                TrendingMovie.objects.filter(window=window, movie_id__in=touched_ids)
+                .values_list('movie_id', 'score')
+            )
+            touched = {
+                movie_id: current.get(movie_id, 0.0) + added.get(movie_id, 0.0) - expired.get(movie_id, 0.0)
+                for movie_id in touched_ids
+            }
+
+        keep = {movie_id: score for movie_id, score in touched.items() if score >= MIN_SCORE}
+        if keep:
+            TrendingMovie.objects.bulk_create(
+                [TrendingMovie(window=window, movie_id=movie_id, score=score) for movie_id, score in keep.items()],
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['window', 'movie'],
+                update_fields=['score', 'updated_at'],
+            )
+        TrendingMovie.objects.filter(window=window, score__lt=MIN_SCORE).delete()
+        TrendingMovie.objects.filter(
+            window=window, movie_id__in=[movie_id for movie_id in touched if movie_id not in keep]
+        ).delete()
+
+        TrendingState.objects.update_or_create(
+            window=window,
+            defaults={'last_event_id': last_event_id, 'computed_at': now},
+        )
+
+    cache.delete(_cache_key(window))
+    return len(touched)
+
+
+def _cache_key(window):
+    return f'cynara:trending:{window}'
+
+
+def trending_movies(window='7d', limit=24):
+    """
+    Top-N slice of the materialized table, cached briefly per process.
+
+    Falls back to the all-time view counter until the first update has run.
+    """
+    if window not in WINDOWS:
+        window = '7d'
+    movies = cache.get(_cache_key(window))
+    if movies is None or len(movies) < limit:
+        movie_ids = list(
+            TrendingMovie.objects.filter(window=window, movie__is_available=True)
+            .order_by('-score')
+            .values_list('movie_id', flat=True)[:max(limit, 24)]
+        )
+        if movie_ids:
+            by_id = Movie.objects.in_bulk(movie_ids)
+            movies = [by_id[movie_id] for movie_id in movie_ids if movie_id in by_id]
+        else:
+            movies = list(Movie.objects.filter(is_available=True).order_by('-view_count')[:max(limit, 24)])
+        cache.set(_cache_key(window), movies, settings.CYNARA_SETTINGS.get('TRENDING_CACHE_SECONDS', 60))
+    return movies[:limit]
@@ -23,6 +23,9 @@ urlpatterns = [
     
     # API endpoints
     path('api/generate/', views.generate_recommendations, name='generate'),
+    path('api/similar/<slug:movie_slug>/', views.similar_movies, name='similar_api'),
     path('api/feedback/<int:movie_id>/', views.submit_feedback, name='submit_feedback'),
+    path('api/feedback/stats/', views.feedback_stats, name='feedback_stats'),
+    path('api/bandit/', views.bandit_stats, name='bandit_stats'),
     path('api/refresh/', views.refresh_recommendations, name='refresh'),
 ]
\ No newline at end of file
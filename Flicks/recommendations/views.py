@@ -4,12 +4,51 @@ Cynara Recommendations Views
 AI-powered movie recommendations using OpenAI and user behavior.
 """
 
+import json
+
 from django.shortcuts import render
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from movies.models import Movie
+from streaming.files import poster_url
+from .feedback import FEEDBACK_TYPES, algorithm_feedback_summary, record_feedback
+from .models import MovieSimilarity
+from .bandit import algorithm_bandit
+from .engine import ALGORITHMS
+from .serving import (
+    get_algorithm_for, get_user_recommendations, popular_movies, recommendation_refreshes
+)
+from .similarity import get_similarity_index
+from .trending import WINDOWS as TRENDING_WINDOWS, trending_movies
+
+
+def _serialize_movie(movie):
+    """JSON payload shared by the recommendation API endpoints"""
+    return {
+        'id': movie.id,
+        'title': movie.title,
+        'slug': movie.slug,
+        'poster_url': poster_url(movie),
+        'year': movie.year,
+        'rating': movie.user_rating or 0
+    }
+
+
+def get_similar_movies(movie, limit=12):
+    """Return [(movie, score), ...] ranked by embedding or metadata similarity"""
+    index = get_similarity_index()
+    if movie.id in index:
+        ranked = index.similar_to(movie.id, k=limit)
+        movies = Movie.objects.in_bulk([movie_id for movie_id, _ in ranked])
+        return [(movies[movie_id], score) for movie_id, score in ranked if movie_id in movies]
+
+    # No embedding yet: precomputed genre/director/cast similarity
+    entries = MovieSimilarity.objects.filter(
+        movie=movie, similar_movie__is_available=True
+    ).select_related('similar_movie').order_by('-score')[:limit]
+    return [(entry.similar_movie, entry.score) for entry in entries]
 
 
 class RecommendationsView(TemplateView):
@@ -19,10 +58,12 @@ class RecommendationsView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # For now, show popular movies as recommendations
-        context['recommended_movies'] = Movie.objects.filter(
-            is_available=True
-        ).order_by('-view_count')[:12]
+        if self.request.user.is_authenticated:
+            context['recommended_movies'] = get_user_recommendations(
+                self.request.user, limit=12
+            ).movies
+        else:
+            context['recommended_movies'] = popular_movies(12)
         
         return context
 
@@ -34,10 +75,10 @@ class PersonalizedRecommendationsView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # For now, show recent movies as personalized recommendations
-        context['recommended_movies'] = Movie.objects.filter(
-            is_available=True
-        ).order_by('-date_added')[:12]
+        served = get_user_recommendations(self.request.user, limit=12)
+        context['recommended_movies'] = served.movies
+        context['recommendations'] = served.items
+        context['recommendations_stale'] = served.stale
         
         return context
 
@@ -49,9 +90,10 @@ class TrendingMoviesView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        context['trending_movies'] = Movie.objects.filter(
-            is_available=True
-        ).order_by('-view_count')[:24]
+        window = self.request.GET.get('window', '7d')
+        context['trending_movies'] = trending_movies(window, limit=24)
+        context['trending_window'] = window if window in TRENDING_WINDOWS else '7d'
+        context['trending_windows'] = list(TRENDING_WINDOWS)
         
         return context
 
@@ -63,15 +105,13 @@ class SimilarMoviesView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # For now, show movies from the same genres
         movie_slug = kwargs.get('movie_slug')
         try:
             movie = Movie.objects.get(slug=movie_slug, is_available=True)
             context['movie'] = movie
-            context['similar_movies'] = Movie.objects.filter(
-                genres__in=movie.genres.all(),
-                is_available=True
-            ).exclude(id=movie.id).distinct()[:12]
+            context['similar_movies'] = [
+                similar for similar, _ in get_similar_movies(movie, limit=12)
+            ]
         except Movie.DoesNotExist:
             context['movie'] = None
             context['similar_movies'] = []
@@ -87,21 +127,38 @@ class RecommendationFeedbackView(LoginRequiredMixin, TemplateView):
 # API Views
 @login_required
 def generate_recommendations(request):
-    """Generate new recommendations for a user"""
-    # Placeholder implementation
-    recommendations = Movie.objects.filter(is_available=True)[:6]
+    """Recommendations for the current user from their precomputed set"""
+    served = get_user_recommendations(request.user)
     
     data = {
         'recommendations': [
-            {
-                'id': movie.id,
-                'title': movie.title,
-                'slug': movie.slug,
-                'poster_url': movie.get_poster_url(),
-                'year': movie.year,
-                'rating': movie.user_rating or 0
-            }
-            for movie in recommendations
+            dict(_serialize_movie(movie), score=score, reason=reason)
+            for movie, score, reason in served.items
+        ],
+        'algorithm': served.algorithm,
+        'stale': served.stale,
+    }
+    
+    return JsonResponse(data)
+
+
+def similar_movies(request, movie_slug):
+    """Movies most similar to the given one, as JSON"""
+    try:
+        movie = Movie.objects.get(slug=movie_slug, is_available=True)
+    except Movie.DoesNotExist:
+        return JsonResponse({'success': False, 'message': 'Movie not found'}, status=404)
+    
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 12)), 50))
+    except ValueError:
+        limit = 12
+    
+    data = {
+        'movie': _serialize_movie(movie),
+        'similar': [
+            dict(_serialize_movie(similar), score=score)
+            for similar, score in get_similar_movies(movie, limit=limit)
         ]
     }
     
@@ -114,18 +171,57 @@ def submit_feedback(request, movie_id):
     if request.method != 'POST':
         return JsonResponse({'success': False, 'message': 'Invalid method'})
     
-    # Placeholder implementation
+    payload = request.POST
+    if request.content_type == 'application/json':
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'Invalid JSON'}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({'success': False, 'message': 'Invalid JSON'}, status=400)
+    
+    feedback_type = payload.get('feedback_type')
+    if feedback_type not in FEEDBACK_TYPES:
+        return JsonResponse({'success': False, 'message': 'Invalid feedback type'}, status=400)
+    # Only a known algorithm can be credited; anything else goes to the user's assignment
+    algorithm = payload.get('algorithm')
+    if algorithm not in ALGORITHMS:
+        algorithm = get_algorithm_for(request.user.id, record_pull=False)
+    if not Movie.objects.filter(id=movie_id).exists():
+        return JsonResponse({'success': False, 'message': 'Movie not found'}, status=404)
+    
+    # Buffered: the write happens in the next batch, not in this request
+    record_feedback(request.user.id, movie_id, feedback_type, algorithm)
     return JsonResponse({
         'success': True,
         'message': 'Feedback submitted successfully'
     })
 
 
+@login_required
+def feedback_stats(request):
+    """Feedback counts per recommendation algorithm (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'message': 'Forbidden'}, status=403)
+    return JsonResponse({'algorithms': algorithm_feedback_summary()})
+
+
+@login_required
+def bandit_stats(request):
+    """Current per-algorithm bandit statistics (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'message': 'Forbidden'}, status=403)
+    return JsonResponse({'arms': algorithm_bandit.summary()})
+
+
 @login_required
 def refresh_recommendations(request):
-    """Refresh user's recommendations"""
-    # Placeholder implementation
+    """Queue a background refresh of the user's recommendations"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid method'})
+    
+    recommendation_refreshes.add((request.user.id, get_algorithm_for(request.user.id, record_pull=False)))
     return JsonResponse({
         'success': True,
-        'message': 'Recommendations refreshed'
+        'message': 'Recommendations refresh queued'
     })
@@ -3,6 +3,12 @@
  * Custom HTML5 video player with controls and streaming features
  */
 
+// Seeks this close after a keyframe land on it, so playback resumes without decoding up to the target
+const KEYFRAME_SNAP_SECONDS = 2;
+
+// Position is reported this often while playing, and on pause, seek, end and leaving the page
+const PROGRESS_REPORT_SECONDS = 15;
+
 class VideoPlayer {
   constructor() {
     this.video = document.getElementById('videoElement');
@@ -31,6 +37,13 @@ class VideoPlayer {
     this.isDragging = false;
     this.hideControlsTimeout = null;
     this.lastActivity = Date.now();
+    this.keyframes = [];
+    this.knownDuration = null;
+    this.thumbnails = [];
+    this.preview = null;
+    this.lastReportAt = 0;
+    this.lastPlaybackTime = null;
+    this.watchedSinceReport = 0;
     
     // Movie data
     this.movieSlug = document.getElementById('movie-slug')?.textContent;
@@ -45,6 +58,139 @@ class VideoPlayer {
     this.setupEventListeners();
     this.hideLoadingSpinner();
     this.startActivityTimer();
+    this.loadMediaInfo();
+  }
+
+  // Keyframe times and duration recorded by `manage.py analyze_media`
+  async loadMediaInfo() {
+    if (!this.movieSlug) return;
+    
+    try {
+      const response = await fetch(`/stream/info/${this.movieSlug}/`);
+      if (!response.ok) return;
+      const info = await response.json();
+      this.keyframes = info.keyframes || [];
+      this.knownDuration = info.duration;
+      if (info.hls) this.useAdaptiveStream(info.hls);
+      if (info.thumbnails) this.loadThumbnails(info.thumbnails);
+    } catch (error) {
+      console.error('Error loading media info:', error);
+    }
+  }
+
+  // Renditions exist: play the HLS ladder picked for the user's quality preference
+  useAdaptiveStream(url) {
+    const resumeAt = this.video.currentTime;
+    if (this.video.canPlayType('application/vnd.apple.mpegurl')) {
+      this.video.src = url;
+    } else if (window.Hls && window.Hls.isSupported()) {
+      this.hls = new window.Hls();
+      this.hls.loadSource(url);
+      this.hls.attachMedia(this.video);
+    } else {
+      return;
+    }
+    
+    // Keyframe offsets describe the original file, not the renditions
+    this.keyframes = [];
+    if (resumeAt) {
+      this.video.addEventListener('loadedmetadata', () => {
+        this.video.currentTime = resumeAt;
+      }, { once: true });
+    }
+  }
+
+  // Seek-bar previews from `manage.py generate_trickplay`: a WebVTT index into sprite sheets
+  async loadThumbnails(url) {
+    try {
+      const response = await fetch(url);
+      if (!response.ok) return;
+      const base = new URL(url, window.location.href);
+      this.thumbnails = this.parseThumbnails(await response.text(), base);
+    } catch (error) {
+      console.error('Error loading thumbnails:', error);
+      return;
+    }
+    if (!this.thumbnails.length) return;
+    
+    this.preview = document.createElement('div');
+    this.preview.className = 'trickplay-preview';
+    this.previewImage = document.createElement('div');
+    this.previewImage.className = 'trickplay-image';
+    this.previewTime = document.createElement('div');
+    this.previewTime.className = 'trickplay-time';
+    this.preview.append(this.previewImage, this.previewTime);
+    if (getComputedStyle(this.progressContainer).position === 'static') {
+      this.progressContainer.style.position = 'relative';
+    }
+    this.progressContainer.appendChild(this.preview);
+    
+    // Fetch the first sheet now so the first hover is instant
+    new Image().src = this.thumbnails[0].url;
+    this.progressContainer.addEventListener('mousemove', (e) => this.showPreview(e));
+    this.progressContainer.addEventListener('mouseleave', () => {
+      if (!this.isDragging) this.hidePreview();
+    });
+  }
+
+  parseThumbnails(text, base) {
+    const cues = [];
+    const blocks = text.replace(/\r/g, '').split('\n\n');
+    for (const block of blocks) {
+      const lines = block.trim().split('\n');
+      const timing = lines.findIndex(line => line.includes('-->'));
+      if (timing < 0 || !lines[timing + 1]) continue;
+      
+      const [start, end] = lines[timing].split('-->').map(part => this.parseTimestamp(part.trim()));
+      const target = new URL(lines[timing + 1].trim(), base);
+      const [x, y, width, height] = (target.hash.match(/xywh=([\d,]+)/)?.[1] || '0,0,0,0').split(',').map(Number);
+      target.hash = '';
+      cues.push({ start, end, url: target.href, x, y, width, height });
+    }
+    return cues;
+  }
+
+  parseTimestamp(value) {
+    return value.split(':').reduce((total, part) => total * 60 + parseFloat(part), 0);
+  }
+
+  thumbnailAt(time) {
+    let low = 0;
+    let high = this.thumbnails.length - 1;
+    while (low < high) {
+      const middle = (low + high + 1) >> 1;
+      if (this.thumbnails[middle].start <= time) {
+        low = middle;
+      } else {
+        high = middle - 1;
+      }
+    }
+    return this.thumbnails[low];
+  }
+
+  showPreview(e) {
+    if (!this.preview) return;
+    
+    const rect = this.progressContainer.getBoundingClientRect();
+    const percent = Math.max(0, Math.min(1, (e.clientX - rect.left) / rect.width));
+    const time = percent * this.getDuration();
+    const cue = this.thumbnailAt(time);
+    
+    this.previewImage.style.width = `${cue.width}px`;
+    this.previewImage.style.height = `${cue.height}px`;
+    this.previewImage.style.backgroundImage = `url("${cue.url}")`;
+    this.previewImage.style.backgroundPosition = `-${cue.x}px -${cue.y}px`;
+    this.previewTime.textContent = this.formatTime(time);
+    
+    // Keep the whole preview over the bar
+    const half = cue.width / 2;
+    const left = Math.max(half, Math.min(rect.width - half, percent * rect.width));
+    this.preview.style.left = `${left}px`;
+    this.preview.classList.add('visible');
+  }
+
+  hidePreview() {
+    if (this.preview) this.preview.classList.remove('visible');
   }
 
   setupEventListeners() {
@@ -60,6 +206,7 @@ class VideoPlayer {
     this.video.addEventListener('timeupdate', () => this.onTimeUpdate());
     this.video.addEventListener('progress', () => this.onProgress());
     this.video.addEventListener('ended', () => this.onEnded());
+    this.video.addEventListener('seeked', () => this.onSeeked());
     this.video.addEventListener('error', (e) => this.onError(e));
     this.video.addEventListener('volumechange', () => this.onVolumeChange());
     
@@ -87,6 +234,12 @@ class VideoPlayer {
     
     // Fullscreen events
     document.addEventListener('fullscreenchange', () => this.onFullscreenChange());
+    
+    // Last progress report when the tab is hidden or closed
+    document.addEventListener('visibilitychange', () => {
+      if (document.visibilityState === 'hidden') this.sendProgressBeacon();
+    });
+    window.addEventListener('pagehide', () => this.sendProgressBeacon());
   }
 
   // Playback controls
@@ -110,17 +263,36 @@ class VideoPlayer {
     this.playIcon.style.display = 'block';
     this.pauseIcon.style.display = 'none';
     this.showControls();
+    this.updateWatchProgress();
   }
 
   // Progress and time handling
   onTimeUpdate() {
+    this.countWatchedTime();
     if (this.isDragging) return;
     
     const progress = (this.video.currentTime / this.video.duration) * 100;
     this.progressBar.style.width = `${progress}%`;
     
     this.updateTimeDisplay();
-    this.updateWatchProgress();
+    if (Date.now() - this.lastReportAt >= PROGRESS_REPORT_SECONDS * 1000) {
+      this.updateWatchProgress();
+    }
+  }
+
+  // Seconds actually played, not counting jumps
+  countWatchedTime() {
+    const time = this.video.currentTime;
+    if (this.isPlaying && this.lastPlaybackTime !== null) {
+      const delta = time - this.lastPlaybackTime;
+      if (delta > 0 && delta < 2) this.watchedSinceReport += delta;
+    }
+    this.lastPlaybackTime = time;
+  }
+
+  onSeeked() {
+    this.lastPlaybackTime = this.video.currentTime;
+    if (!this.isDragging) this.updateWatchProgress();
   }
 
   onProgress() {
@@ -133,8 +305,34 @@ class VideoPlayer {
   seekToPosition(e) {
     const rect = this.progressContainer.getBoundingClientRect();
     const percent = (e.clientX - rect.left) / rect.width;
-    const seekTime = percent * this.video.duration;
-    this.video.currentTime = seekTime;
+    const seekTime = percent * this.getDuration();
+    this.seekTo(seekTime);
+  }
+
+  getDuration() {
+    return this.video.duration || this.knownDuration || 0;
+  }
+
+  keyframeBefore(time) {
+    let low = 0;
+    let high = this.keyframes.length - 1;
+    let found = null;
+    while (low <= high) {
+      const middle = (low + high) >> 1;
+      if (this.keyframes[middle] <= time) {
+        found = this.keyframes[middle];
+        low = middle + 1;
+      } else {
+        high = middle - 1;
+      }
+    }
+    return found;
+  }
+
+  seekTo(time) {
+    const keyframe = this.keyframeBefore(time);
+    const snap = keyframe !== null && time - keyframe <= KEYFRAME_SNAP_SECONDS;
+    this.video.currentTime = snap ? keyframe : time;
   }
 
   startDragging(e) {
@@ -148,14 +346,16 @@ class VideoPlayer {
     const rect = this.progressContainer.getBoundingClientRect();
     const percent = Math.max(0, Math.min(1, (e.clientX - rect.left) / rect.width));
     this.progressBar.style.width = `${percent * 100}%`;
+    this.showPreview(e);
   }
 
   stopDragging() {
     if (!this.isDragging) return;
     
     this.isDragging = false;
+    this.hidePreview();
     const percent = parseFloat(this.progressBar.style.width) / 100;
-    this.video.currentTime = percent * this.video.duration;
+    this.seekTo(percent * this.getDuration());
   }
 
   // Volume controls
@@ -315,30 +515,49 @@ class VideoPlayer {
     this.timeDisplay.textContent = `${current} / ${duration}`;
   }
 
-  // Watch progress tracking
+  // Watch progress tracking; the server buffers reports and writes them in bulk
+  progressReport(completed) {
+    const report = {
+      progress: completed ? 100 : (this.video.currentTime / this.video.duration) * 100,
+      completed: completed,
+      current_time: this.video.currentTime,
+      duration: this.video.duration,
+      watched: this.watchedSinceReport,
+    };
+    this.watchedSinceReport = 0;
+    this.lastReportAt = Date.now();
+    return report;
+  }
+
   async updateWatchProgress(completed = false) {
     if (!this.movieSlug || !this.csrfToken) return;
     
-    const progress = completed ? 100 : (this.video.currentTime / this.video.duration) * 100;
-    
     try {
-      await fetch(`/api/movie/${this.movieSlug}/progress/`, {
+      await fetch(`/stream/progress/${this.movieSlug}/`, {
         method: 'POST',
         headers: {
           'X-CSRFToken': this.csrfToken,
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({
-          progress: progress,
-          completed: completed,
-          current_time: this.video.currentTime,
-          duration: this.video.duration
-        })
+        body: JSON.stringify(this.progressReport(completed))
       });
     } catch (error) {
       console.error('Error updating watch progress:', error);
     }
   }
+
+  // Survives the page unloading; beacons can't set headers, so the CSRF token goes in the form
+  sendProgressBeacon() {
+    if (!this.movieSlug || !this.csrfToken || !navigator.sendBeacon) return;
+    if (!this.video.currentTime || this.video.ended) return;
+    
+    const form = new FormData();
+    form.append('csrfmiddlewaretoken', this.csrfToken);
+    for (const [name, value] of Object.entries(this.progressReport(false))) {
+      form.append(name, value);
+    }
+    navigator.sendBeacon(`/stream/progress/${this.movieSlug}/`, form);
+  }
 }
 
 // Initialize video player when DOM is loaded
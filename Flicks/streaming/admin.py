@@ -0,0 +1,44 @@
+"""
+Cynara Streaming Admin Configuration
+"""
+
+from django.contrib import admin
+from .models import LibraryFile, MediaInfo, ProgressReport, Rendition, Trickplay
+
+
+@admin.register(MediaInfo)
+class MediaInfoAdmin(admin.ModelAdmin):
+    list_display = ('movie', 'container', 'duration', 'video_codec', 'width', 'height', 'is_faststart', 'analyzed_at')
+    list_filter = ('container', 'is_faststart', 'video_codec')
+    search_fields = ('movie__title',)
+    readonly_fields = ('keyframes', 'analyzed_at')
+
+
+@admin.register(Rendition)
+class RenditionAdmin(admin.ModelAdmin):
+    list_display = ('movie', 'quality', 'status', 'segments_done', 'segment_count', 'updated_at')
+    list_filter = ('status', 'quality')
+    search_fields = ('movie__title',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(Trickplay)
+class TrickplayAdmin(admin.ModelAdmin):
+    list_display = ('movie', 'tile_count', 'sheet_count', 'image_format', 'interval', 'generated_at')
+    list_filter = ('image_format',)
+    search_fields = ('movie__title',)
+    readonly_fields = ('version', 'generated_at')
+
+
+@admin.register(LibraryFile)
+class LibraryFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'movie', 'size', 'is_missing', 'duplicate_of', 'scanned_at')
+    list_filter = ('is_missing', ('duplicate_of', admin.EmptyFieldListFilter))
+    search_fields = ('path', 'movie__title', 'fingerprint')
+    raw_id_fields = ('movie', 'duplicate_of')
+
+
+@admin.register(ProgressReport)
+class ProgressReportAdmin(admin.ModelAdmin):
+    list_display = ('session', 'reported_at')
+    raw_id_fields = ('session',)
@@ -0,0 +1,168 @@
+"""
+Cynara Async Streaming
+
+Byte-range file serving for ASGI deployments. A playback connection costs
+a coroutine and at most two chunks of memory instead of a worker, so one
+process can hold hundreds of long-lived streams.
+
+Files are read in fixed-size chunks with os.pread on a small shared thread
+pool (the event loop never blocks on disk). One chunk is read ahead while
+the previous one is being sent, and nothing more: the ASGI server's send()
+only returns once the client is taking data, which is the backpressure.
+When the client seeks or disconnects, Django cancels the response and the
+reader's cleanup closes the file once any in-flight read has finished.
+Validators are the same as on the WSGI path; a cache miss stats the file
+on the pool too.
+
+Under WSGI these responses would be buffered whole, so the async view
+answers 404 to requests that didn't come in over ASGI.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+
+from .files import (
+    content_type_for, multipart_layout, offload_response, requested_ranges, unsatisfiable_response
+)
+from .ranges import RangeNotSatisfiable
+from .validators import (
+    apply_validators, cached_validators, file_validators, if_range_matches, not_modified_response
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_read_executor():
+    """Process-wide pool for blocking file reads"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.CYNARA_SETTINGS.get('STREAM_ASYNC_READ_THREADS', 8),
+                    thread_name_prefix='stream-read',
+                )
+    return _executor
+
+
+class AsyncFileReader:
+    """Chunked async reads from one open file descriptor"""
+
+    def __init__(self, descriptor, chunk_size=None):
+        self.descriptor = descriptor
+        self.chunk_size = chunk_size or settings.CYNARA_SETTINGS.get('STREAM_ASYNC_CHUNK_SIZE', 64 * 1024)
+        self.executor = get_read_executor()
+        self._pending = None
+
+    @classmethod
+    async def open(cls, path, chunk_size=None):
+        """(reader, file size); raises FileNotFoundError like open()"""
+        loop = asyncio.get_running_loop()
+        descriptor = await loop.run_in_executor(get_read_executor(), os.open, path, os.O_RDONLY)
+        try:
+            size = os.fstat(descriptor).st_size
+        except OSError:
+            os.close(descriptor)
+            raise
+        return cls(descriptor, chunk_size), size
+
+    def _read(self, position, end):
+        self._pending = self.executor.submit(
+            os.pread, self.descriptor, min(self.chunk_size, end - position + 1), position
+        )
+        return asyncio.wrap_future(self._pending)
+
+    async def chunks(self, start, end):
+        """Yield the bytes of [start, end] with one chunk read ahead"""
+        position = start
+        next_read = self._read(position, end) if position <= end else None
+        while next_read is not None:
+            data = await next_read
+            if not data:
+                return
+            position += len(data)
+            next_read = self._read(position, end) if position <= end else None
+            yield data
+
+    def close(self):
+        """Close the descriptor, after the read in flight if there is one"""
+        pending, self._pending = self._pending, None
+        if pending is None or pending.done():
+            os.close(self.descriptor)
+        else:
+            pending.add_done_callback(lambda _: os.close(self.descriptor))
+
+
+async def _range_body(reader, ranges, heads=None, tail=None):
+    try:
+        for position, (start, end) in enumerate(ranges):
+            if heads:
+                yield heads[position]
+            async for chunk in reader.chunks(start, end):
+                yield chunk
+        if tail:
+            yield tail
+    finally:
+        reader.close()
+
+
+async def aserve_file(request, path, content_type=None, cache_control=None):
+    """Async counterpart of files.serve_file; open-ended ranges aren't capped"""
+    content_type = content_type or content_type_for(path)
+    offloaded = offload_response(path, content_type)
+    if offloaded is not None:
+        return offloaded
+
+    validators = cached_validators(path)
+    if validators is None:
+        try:
+            validators = await asyncio.get_running_loop().run_in_executor(
+                get_read_executor(), file_validators, path
+            )
+        except (FileNotFoundError, NotADirectoryError):
+            raise Http404('Movie file not found')
+    unchanged = not_modified_response(request, validators)
+    if unchanged is not None:
+        return apply_validators(unchanged, validators, cache_control)
+
+    try:
+        reader, size = await AsyncFileReader.open(path)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        raise Http404('Movie file not found')
+    validators = file_validators(path, os.fstat(reader.descriptor))
+
+    try:
+        ranges = requested_ranges(request, size) if if_range_matches(request, validators) else None
+    except RangeNotSatisfiable:
+        reader.close()
+        return unsatisfiable_response(size)
+
+    if request.method == 'HEAD':
+        reader.close()
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(size)
+    elif not ranges or len(ranges) == 1:
+        start, end = ranges[0] if ranges else (0, size - 1)
+        response = StreamingHttpResponse(
+            _range_body(reader, [(start, end)]), content_type=content_type, status=206 if ranges else 200
+        )
+        response['Content-Length'] = str(end - start + 1)
+        if ranges:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        boundary, heads, tail, length = multipart_layout(ranges, size, content_type)
+        response = StreamingHttpResponse(
+            _range_body(reader, ranges, heads, tail),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response['Content-Length'] = str(length)
+
+    response['Accept-Ranges'] = 'bytes'
+    return apply_validators(response, validators, cache_control)
@@ -0,0 +1,162 @@
+"""
+Cynara Media Analysis
+
+Fills MediaInfo, and Movie.duration, from the movie files. Only files
+whose size or mtime changed since the last pass are opened, and the
+parsers (mp4, mkv) read container headers only, so a re-run over an
+unchanged library costs one stat() per movie. Files are parsed in a pool
+of ANALYSIS_WORKERS processes and the results written a chunk at a time.
+Optionally rewrites MP4s whose index sits at the end (faststart), so
+players can start and seek without first fetching the tail of the file.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from movies.models import Movie
+from . import mkv, mp4
+from .files import movie_file_path
+from .models import MediaInfo
+
+PARSERS = {
+    '.mp4': mp4.read_file,
+    '.m4v': mp4.read_file,
+    '.mov': mp4.read_file,
+    '.mkv': mkv.read_file,
+    '.webm': mkv.read_file,
+}
+
+FIELDS = [
+    'container', 'duration', 'video_codec', 'audio_codec', 'width', 'height',
+    'is_faststart', 'moov_offset', 'moov_size', 'keyframes', 'audio_tracks',
+]
+
+ERRORS = (mp4.MP4Error, mkv.MKVError, OSError, ValueError)
+
+
+def analyze_file(path, faststart=False):
+    """
+    (metadata dict, rewritten) for one file, or (None, False) when there's
+    no parser for its container.
+    """
+    parser = PARSERS.get(os.path.splitext(str(path))[1].lower())
+    if parser is None:
+        return None, False
+    metadata = parser(path)
+    if faststart and parser is mp4.read_file and not metadata['is_faststart']:
+        mp4.faststart(path)
+        return parser(path), True
+    return metadata, False
+
+
+def _analyze_job(path, faststart):
+    """analyze_file() in a pool process: (metadata, rewritten, error message)"""
+    try:
+        metadata, rewritten = analyze_file(path, faststart=faststart)
+    except ERRORS as exc:
+        return None, False, str(exc) or type(exc).__name__
+    return metadata, rewritten, ''
+
+
+def analyze_movies(movie_ids=None, force=False, faststart=False, chunk_size=500, progress=None, workers=None):
+    """
+    Analyze new and changed movie files; returns counts by outcome.
+
+    Results are written one chunk of movies at a time with bulk_create and
+    bulk_update. `progress`, if given, is called with the counts after
+    each chunk.
+    """
+    workers = workers or settings.CYNARA_SETTINGS.get('ANALYSIS_WORKERS') or os.cpu_count() or 1
+    counts = {'analyzed': 0, 'unchanged': 0, 'missing': 0, 'unsupported': 0, 'failed': 0, 'rewritten': 0}
+    queryset = Movie.objects.order_by('id').only('id', 'file_path', 'duration')
+    if movie_ids is not None:
+        queryset = queryset.filter(id__in=movie_ids)
+
+    executor = None
+    last_id = 0
+    try:
+        while True:
+            movies = list(queryset.filter(id__gt=last_id)[:chunk_size])
+            if not movies:
+                return counts
+            last_id = movies[-1].id
+            existing = MediaInfo.objects.in_bulk([movie.id for movie in movies], field_name='movie_id')
+
+            jobs = []
+            for movie in movies:
+                path = movie_file_path(movie)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    counts['missing'] += 1
+                    continue
+                info = existing.get(movie.id)
+                if not force and info is not None and info.file_size == stat.st_size \
+                        and info.file_mtime == stat.st_mtime:
+                    counts['unchanged'] += 1
+                    continue
+                jobs.append((movie, info, path, stat))
+
+            paths = [str(path) for _, _, path, _ in jobs]
+            if len(jobs) > 1 and workers > 1:
+                if executor is None:
+                    # Later chunks reuse the pool, so size it for a full chunk, not this one
+                    executor = ProcessPoolExecutor(max_workers=min(workers, chunk_size))
+                results = executor.map(
+                    _analyze_job, paths, repeat(faststart), chunksize=max(len(jobs) // (workers * 4), 1)
+                )
+            else:
+                results = map(_analyze_job, paths, repeat(faststart))
+
+            created = []
+            updated = []
+            durations = []
+            now = timezone.now()
+            for (movie, info, path, stat), (metadata, rewritten, error) in zip(jobs, results):
+                if info is None:
+                    info = MediaInfo(movie_id=movie.id)
+                    created.append(info)
+                else:
+                    updated.append(info)
+                if error:
+                    info.error = error[:255]
+                    counts['failed'] += 1
+                elif metadata is None:
+                    info.error = 'Unsupported container'
+                    counts['unsupported'] += 1
+                else:
+                    for field in FIELDS:
+                        setattr(info, field, metadata[field])
+                    info.error = ''
+                    counts['analyzed'] += 1
+                    # Movie.duration is whole seconds, like WatchHistory.watch_duration
+                    duration = round(metadata['duration']) if metadata['duration'] else None
+                    if duration and duration != movie.duration:
+                        movie.duration = duration
+                        durations.append(movie)
+                if rewritten:
+                    stat = os.stat(path)
+                    counts['rewritten'] += 1
+                info.file_size = stat.st_size
+                info.file_mtime = stat.st_mtime
+                info.analyzed_at = now
+
+            with transaction.atomic():
+                if created:
+                    MediaInfo.objects.bulk_create(created, batch_size=500)
+                if updated:
+                    MediaInfo.objects.bulk_update(
+                        updated, FIELDS + ['file_size', 'file_mtime', 'error', 'analyzed_at'], batch_size=500
+                    )
+                if durations:
+                    Movie.objects.bulk_update(durations, ['duration'], batch_size=500)
+            if progress is not None:
+                progress(counts)
+    finally:
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,257 @@
+"""
+Cynara Media Files
+
+Serves movie files with byte-range support without copying them through
+Python where the deployment allows it:
+
+- A single range is a FileResponse over a bounded view of the open file.
+  Under gunicorn, `wsgi.file_wrapper` hands that file descriptor to
+  os.sendfile, so the kernel copies the bytes straight from the page cache
+  to the socket; other servers read it in blocks that stop at the range end.
+- Several ranges are a multipart/byteranges body read with os.pread.
+- With STREAM_OFFLOAD set to 'x-accel-redirect' (nginx) or 'x-sendfile'
+  (Apache, lighttpd), Django only authorizes the request and names the
+  file; the front-end server sends the bytes and handles Range itself.
+
+Responses carry the validators from validators.py: conditional requests
+are answered with 304 before the file is opened, and a Range whose
+If-Range no longer matches gets the whole file.
+"""
+
+import mimetypes
+import os
+import secrets
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+
+from .ranges import RangeNotSatisfiable, parse_range_header
+from .validators import apply_validators, file_validators, if_range_matches, not_modified_response
+
+CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m4v': 'video/mp4',
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm',
+    '.avi': 'video/x-msvideo',
+    '.mov': 'video/quicktime',
+    '.vtt': 'text/vtt',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.mpd': 'application/dash+xml',
+    '.m4s': 'video/iso.segment',
+    '.ts': 'video/mp2t',
+}
+
+READ_SIZE = 256 * 1024
+
+
+def movie_file_path(movie):
+    """Absolute path of a movie's file; relative file_path values live under MOVIES_ROOT"""
+    path = Path(movie.file_path)
+    if not path.is_absolute():
+        path = Path(settings.MOVIES_ROOT) / path
+    return path
+
+
+def poster_file_path(movie):
+    """Path of a movie's uploaded poster, or None when there's none on local storage"""
+    if not movie.poster:
+        return None
+    try:
+        return Path(movie.poster.path)
+    except NotImplementedError:
+        # Remote storage; get_poster_url() already points at it
+        return None
+
+
+def poster_url(movie):
+    """Poster URL that changes whenever the file does, or get_poster_url()'s fallback"""
+    path = poster_file_path(movie)
+    if path is not None:
+        try:
+            version = file_validators(path).version
+        except OSError:
+            pass
+        else:
+            return reverse('streaming:poster', args=[movie.slug]) + f'?v={version}'
+    return movie.get_poster_url()
+
+
+def content_type_for(path):
+    path = Path(path)
+    return CONTENT_TYPES.get(path.suffix.lower()) or mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+
+
+class RangeFile:
+    """
+    Read-only view of `length` bytes of an open file from `start`.
+
+    The descriptor is left positioned at `start` and fileno() is exposed,
+    which is what gunicorn's sendfile path needs (it sends Content-Length
+    bytes from the current offset). read() never runs past the range, so
+    servers without sendfile stream exactly the same bytes.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class RangeFileResponse(FileResponse):
+    """FileResponse whose Content-Length comes from the range, not the file"""
+    block_size = READ_SIZE
+
+    def __init__(self, file, start, length, **kwargs):
+        super().__init__(RangeFile(file, start, length), **kwargs)
+        self.headers['Content-Length'] = str(length)
+
+
+def multipart_layout(ranges, size, content_type):
+    """
+    Framing for a multipart/byteranges body: (boundary, part headers, closing
+    delimiter, total length). Callers interleave the headers with the bytes.
+    """
+    boundary = secrets.token_hex(16)
+    heads = [
+        (
+            f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode('ascii')
+        for start, end in ranges
+    ]
+    tail = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    length = sum(len(head) for head in heads) + sum(end - start + 1 for start, end in ranges) + len(tail)
+    return boundary, heads, tail, length
+
+
+def _multipart_body(path, ranges, heads, tail):
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        for head, (start, end) in zip(heads, ranges):
+            yield head
+            position = start
+            while position <= end:
+                data = os.pread(descriptor, min(READ_SIZE, end - position + 1), position)
+                if not data:
+                    return
+                position += len(data)
+                yield data
+        yield tail
+    finally:
+        os.close(descriptor)
+
+
+def requested_ranges(request, size, open_end_limit=None):
+    """parse_range_header() with this deployment's limits"""
+    return parse_range_header(
+        request.headers.get('Range'),
+        size,
+        max_ranges=settings.CYNARA_SETTINGS.get('STREAM_MAX_RANGES', 16),
+        open_end_limit=open_end_limit,
+    )
+
+
+def unsatisfiable_response(size):
+    response = HttpResponse(status=416)
+    response['Content-Range'] = f'bytes */{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def offload_response(path, content_type):
+    """
+    Hand the file to the front-end server, or None when offloading is off
+    or the file isn't under MOVIES_ROOT (so no internal location maps it).
+    """
+    mode = settings.CYNARA_SETTINGS.get('STREAM_OFFLOAD')
+    if not mode:
+        return None
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-sendfile':
+        response['X-Sendfile'] = str(path)
+        return response
+    if mode == 'x-accel-redirect':
+        try:
+            relative = Path(path).resolve().relative_to(Path(settings.MOVIES_ROOT).resolve())
+        except ValueError:
+            return None
+        prefix = settings.CYNARA_SETTINGS.get('STREAM_OFFLOAD_PREFIX', '/protected-movies/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative.as_posix())
+        return response
+    raise ValueError(f'Unknown STREAM_OFFLOAD mode: {mode}')
+
+
+def serve_file(request, path, content_type=None, cache_control=None):
+    """
+    Full, partial (206), multipart, 304 or 416 response for a file on disk.
+    `cache_control` is a dict of patch_cache_control() directives.
+    """
+    content_type = content_type or content_type_for(path)
+    offloaded = offload_response(path, content_type)
+    if offloaded is not None:
+        return offloaded
+
+    try:
+        validators = file_validators(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Movie file not found')
+    unchanged = not_modified_response(request, validators)
+    if unchanged is not None:
+        return apply_validators(unchanged, validators, cache_control)
+
+    try:
+        file = open(path, 'rb')
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        raise Http404('Movie file not found')
+    validators = file_validators(path, os.fstat(file.fileno()))
+    size = validators.size
+
+    try:
+        ranges = requested_ranges(
+            request, size, open_end_limit=settings.CYNARA_SETTINGS.get('STREAM_MAX_RANGE_BYTES')
+        ) if if_range_matches(request, validators) else None
+    except RangeNotSatisfiable:
+        file.close()
+        return unsatisfiable_response(size)
+
+    if request.method == 'HEAD':
+        file.close()
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(size)
+    elif not ranges:
+        response = RangeFileResponse(file, 0, size, content_type=content_type)
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = RangeFileResponse(file, start, end - start + 1, content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        file.close()
+        boundary, heads, tail, length = multipart_layout(ranges, size, content_type)
+        response = StreamingHttpResponse(
+            _multipart_body(path, ranges, heads, tail),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response['Content-Length'] = str(length)
+
+    response['Accept-Ranges'] = 'bytes'
+    return apply_validators(response, validators, cache_control)
@@ -0,0 +1,373 @@
+"""
+Cynara Header Benchmark
+
+Measures how many files per second analyze_media's header readers get
+through, on a synthetic library. Every generated file is a full-length
+movie as far as its container says: MP4s carry a complete moov with
+sample tables for every frame (at the front or after the media data), and
+Matroska/WebM files a SeekHead, Info, Tracks and a Cue per keyframe (also
+before or after the media). The media data itself is a hole in a sparse
+file, so a generated movie takes only its index on disk, about 1.5 MB for
+100 minutes.
+
+Files are parsed by the same pool job analyze_movies uses, once with a
+single process and once with `workers`, after one untimed pass so the
+headers are in the page cache (warm-cache numbers: the cost of parsing,
+not of the disk). With ffprobe on PATH, a sample is also probed with it
+for comparison.
+"""
+
+import os
+import re
+import shutil
+import struct
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from . import mkv
+from .analysis import _analyze_job
+
+FPS = 24
+KEYFRAME_SECONDS = 2
+AUDIO_RATE = 48000
+AAC_FRAME = 1024
+
+# Container layouts, cycled through in this order
+LAYOUTS = ('mp4-faststart', 'mp4-moov-last', 'mkv-cues-last', 'webm-cues-first')
+
+SYNTHETIC_NAME = re.compile(r'^movie_\d{5,}\.(mp4|mkv|webm)$')
+
+AVC_CONFIG = bytes([1, 0x64, 0x00, 0x28, 0xFF, 0xE1, 0x00, 0x00, 0x01, 0x00, 0x00])  # High@4.0, no parameter sets
+AAC_CONFIG = bytes([0x11, 0x90])  # AAC LC, 48 kHz, stereo
+
+MATRIX = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+# --- MP4 --------------------------------------------------------------------
+
+def _box(kind, *parts):
+    payload = b''.join(parts)
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def _full_box(kind, version, flags, *parts):
+    return _box(kind, struct.pack('>I', (version << 24) | flags), *parts)
+
+
+def _language_code(language):
+    return sum((ord(letter) - 0x60) << shift for letter, shift in zip(language, (10, 5, 0)))
+
+
+def _sample_table(entry, deltas, sizes, per_chunk, offsets, sync=None):
+    count = len(sizes)
+    boxes = [
+        _full_box(b'stsd', 0, 0, struct.pack('>I', 1), entry),
+        _full_box(b'stts', 0, 0, struct.pack('>III', 1, count, deltas)),
+        _full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, per_chunk, 1)),
+        _full_box(b'stsz', 0, 0, struct.pack('>II', 0, count), sizes.astype('>u4').tobytes()),
+        _full_box(b'co64', 0, 0, struct.pack('>I', len(offsets)), offsets.astype('>u8').tobytes()),
+    ]
+    if sync is not None:
+        boxes.append(_full_box(b'stss', 0, 0, struct.pack('>I', len(sync)), (sync + 1).astype('>u4').tobytes()))
+    return _box(b'stbl', *boxes)
+
+
+def _track(track_id, handler, timescale, duration, language, header, stbl):
+    tkhd = _full_box(
+        b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, track_id, 0, duration * 1000 // timescale),
+        bytes(8), struct.pack('>hhhH', 0, 0, 0x100 if handler == b'soun' else 0, 0), MATRIX, header,
+    )
+    mdhd = _full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale, duration, _language_code(language), 0))
+    hdlr = _full_box(b'hdlr', 0, 0, struct.pack('>I4s', 0, handler), bytes(12), b'Cynara\0')
+    return _box(b'trak', tkhd, _box(b'mdia', mdhd, hdlr, _box(b'minf', stbl)))
+
+
+def mp4_moov(seconds, width, height, video_sizes, audio_sizes, video_offsets, audio_offsets, languages):
+    """A moov box for an AVC track and one AAC track per language, one chunk per second each"""
+    keyframes = np.arange(0, len(video_sizes), FPS * KEYFRAME_SECONDS)
+    avc1 = _box(
+        b'avc1', bytes(6), struct.pack('>H', 1), bytes(16),
+        struct.pack('>HHIIIH', width, height, 0x480000, 0x480000, 0, 1), bytes(32), struct.pack('>Hh', 0x18, -1),
+        _box(b'avcC', AVC_CONFIG),
+    )
+    esds = _full_box(
+        b'esds', 0, 0,
+        bytes([0x03, 25]), struct.pack('>HB', 0, 0),
+        bytes([0x04, 17, 0x40, 0x15]), bytes(3), struct.pack('>II', 192000, 192000),
+        bytes([0x05, 2]), AAC_CONFIG,
+        bytes([0x06, 1, 0x02]),
+    )
+    mp4a = _box(
+        b'mp4a', bytes(6), struct.pack('>H', 1), bytes(8), struct.pack('>HHHHI', 2, 16, 0, 0, AUDIO_RATE << 16), esds,
+    )
+    tracks = [_track(
+        1, b'vide', FPS, len(video_sizes), 'und', struct.pack('>II', width << 16, height << 16),
+        _sample_table(avc1, 1, video_sizes, FPS, video_offsets, sync=keyframes),
+    )]
+    per_chunk = -(-AUDIO_RATE // AAC_FRAME)
+    for index, (language, offsets) in enumerate(zip(languages, audio_offsets)):
+        tracks.append(_track(
+            index + 2, b'soun', AUDIO_RATE, len(audio_sizes) * AAC_FRAME, language, bytes(8),
+            _sample_table(mp4a, AAC_FRAME, audio_sizes, per_chunk, offsets),
+        ))
+    mvhd = _full_box(
+        b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, 1000, int(seconds * 1000)), struct.pack('>IH', 0x10000, 0x100),
+        bytes(10), MATRIX, bytes(24), struct.pack('>I', len(tracks) + 1),
+    )
+    return _box(b'moov', mvhd, *tracks)
+
+
+def write_mp4(path, seconds, width, height, bitrate, languages, faststart, rng):
+    """A sparse MP4 whose moov describes `seconds` of interleaved video and audio"""
+    chunks = int(seconds)
+    audio_per_chunk = -(-AUDIO_RATE // AAC_FRAME)
+    video_sizes = rng.integers(1, 2 * bitrate // 8 // FPS, chunks * FPS, dtype=np.int64)
+    video_sizes[::FPS * KEYFRAME_SECONDS] *= 4
+    audio_sizes = rng.integers(300, 500, chunks * audio_per_chunk, dtype=np.int64)
+
+    # One chunk per second and track, laid out video, audio, audio, ... second by second
+    interleaved = np.column_stack(
+        [video_sizes.reshape(chunks, FPS).sum(axis=1)]
+        + [audio_sizes.reshape(chunks, audio_per_chunk).sum(axis=1)] * len(languages)
+    )
+    media_size = int(interleaved.sum())
+
+    def moov(media_start):
+        starts = (media_start + np.cumsum(interleaved) - interleaved.reshape(-1)).reshape(interleaved.shape)
+        return mp4_moov(chunks, width, height, video_sizes, audio_sizes, starts[:, 0],
+                        [starts[:, 1 + index] for index in range(len(languages))], languages)
+
+    ftyp = _box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isomiso2avc1mp41')
+    mdat_header = struct.pack('>I4sQ', 1, b'mdat', 16 + media_size)
+    media_start = len(ftyp) + (len(moov(0)) if faststart else 0) + len(mdat_header)
+
+    with open(path, 'wb') as file:
+        file.write(ftyp)
+        if faststart:
+            file.write(moov(media_start))
+        file.write(mdat_header)
+        file.seek(media_size, os.SEEK_CUR)
+        if not faststart:
+            file.write(moov(media_start))
+        file.truncate()
+
+
+# --- Matroska ---------------------------------------------------------------
+
+def _id(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+
+def _size(size):
+    return (size | (1 << 56)).to_bytes(8, 'big')
+
+
+def _element(element_id, *parts):
+    payload = b''.join(parts)
+    return _id(element_id) + _size(len(payload)) + payload
+
+
+def _uint(element_id, value):
+    return _element(element_id, value.to_bytes(8, 'big'))
+
+
+def _float(element_id, value):
+    return _element(element_id, struct.pack('>d', value))
+
+
+def _string(element_id, value):
+    return _element(element_id, value.encode())
+
+
+def mkv_cues(track, cluster_offsets):
+    """A Cues element with a CuePoint per keyframe, each in its own cluster"""
+    points = [
+        _element(mkv.CUE_POINT, _uint(mkv.CUE_TIME, index * KEYFRAME_SECONDS * 1000), _element(
+            mkv.CUE_TRACK_POSITIONS, _uint(mkv.CUE_TRACK, track), _uint(mkv.CUE_CLUSTER_POSITION, int(offset)),
+        ))
+        for index, offset in enumerate(cluster_offsets)
+    ]
+    return _element(mkv.CUES, *points)
+
+
+def write_mkv(path, seconds, width, height, bitrate, languages, cues_first, webm, rng):
+    """A sparse Matroska (or WebM) file with a Cluster every keyframe"""
+    # EBMLVersion, EBMLReadVersion, EBMLMaxIDLength, EBMLMaxSizeLength, DocType, DocTypeVersion, DocTypeReadVersion
+    ebml = _element(
+        mkv.EBML, _uint(0x4286, 1), _uint(0x42F7, 1), _uint(0x42F2, 4), _uint(0x42F3, 8),
+        _string(mkv.DOC_TYPE, 'webm' if webm else 'matroska'), _uint(0x4287, 4), _uint(0x4285, 2),
+    )
+    # 0x4D80 MuxingApp, 0x5741 WritingApp, 0x73C5 TrackUID
+    info = _element(
+        mkv.INFO, _uint(mkv.TIMESTAMP_SCALE, 1_000_000), _float(mkv.DURATION, seconds * 1000),
+        _string(0x4D80, 'Cynara'), _string(0x5741, 'Cynara'),
+    )
+    video = _element(
+        mkv.TRACK_ENTRY, _uint(mkv.TRACK_NUMBER, 1), _uint(0x73C5, 1), _uint(mkv.TRACK_TYPE, mkv.VIDEO_TRACK),
+        _string(mkv.CODEC_ID, 'V_VP9' if webm else 'V_MPEG4/ISO/AVC'),
+        b'' if webm else _element(mkv.CODEC_PRIVATE, AVC_CONFIG),
+        _element(mkv.VIDEO, _uint(mkv.PIXEL_WIDTH, width), _uint(mkv.PIXEL_HEIGHT, height)),
+    )
+    audio = [
+        _element(
+            mkv.TRACK_ENTRY, _uint(mkv.TRACK_NUMBER, index + 2), _uint(0x73C5, index + 2),
+            _uint(mkv.TRACK_TYPE, mkv.AUDIO_TRACK), _string(mkv.CODEC_ID, 'A_OPUS' if webm else 'A_AAC'),
+            _element(mkv.CODEC_PRIVATE, b'OpusHead' if webm else AAC_CONFIG), _string(mkv.LANGUAGE, language),
+            _element(mkv.AUDIO, _float(mkv.SAMPLING_FREQUENCY, AUDIO_RATE), _uint(mkv.CHANNELS, 2)),
+        )
+        for index, language in enumerate(languages)
+    ]
+    tracks = _element(mkv.TRACKS, video, *audio)
+
+    clusters = int(-(-seconds // KEYFRAME_SECONDS))
+    cluster_sizes = rng.integers(bitrate // 16, 3 * bitrate // 16, clusters, dtype=np.int64) * KEYFRAME_SECONDS
+    cluster_header = len(_id(mkv.CLUSTER)) + 8
+
+    def seek_head(offsets):
+        return _element(mkv.SEEK_HEAD, *(
+            _element(mkv.SEEK, _element(mkv.SEEK_ID, _id(element_id)), _uint(mkv.SEEK_POSITION, offset))
+            for element_id, offset in offsets.items()
+        ))
+
+    def layout(cues_size):
+        """Segment-relative offsets of the elements and of each Cluster"""
+        seek_head_size = len(seek_head({mkv.INFO: 0, mkv.TRACKS: 0, mkv.CUES: 0}))
+        offsets = {mkv.INFO: seek_head_size}
+        offsets[mkv.TRACKS] = offsets[mkv.INFO] + len(info)
+        media_start = offsets[mkv.TRACKS] + len(tracks)
+        if cues_first:
+            offsets[mkv.CUES] = media_start
+            media_start += cues_size
+        cluster_offsets = media_start + np.cumsum(cluster_sizes + cluster_header) - (cluster_sizes + cluster_header)
+        media_end = media_start + int((cluster_sizes + cluster_header).sum())
+        if not cues_first:
+            offsets[mkv.CUES] = media_end
+        return offsets, cluster_offsets, media_start, media_end
+
+    cues_size = len(mkv_cues(1, np.zeros(clusters, dtype=np.int64)))
+    offsets, cluster_offsets, media_start, media_end = layout(cues_size)
+    cues = mkv_cues(1, cluster_offsets)
+    segment_size = media_end + (0 if cues_first else len(cues))
+
+    with open(path, 'wb') as file:
+        file.write(ebml)
+        file.write(_id(mkv.SEGMENT) + _size(segment_size))
+        file.write(seek_head(offsets) + info + tracks)
+        if cues_first:
+            file.write(cues)
+        # The first Cluster's header; the rest of the media is a hole
+        file.write(_id(mkv.CLUSTER) + _size(int(cluster_sizes[0])))
+        file.seek(media_end - media_start - cluster_header, os.SEEK_CUR)
+        if not cues_first:
+            file.write(cues)
+        file.truncate()
+
+
+# --- Benchmark --------------------------------------------------------------
+
+def make_library(directory, files, minutes=100, seed=0, progress=None):
+    """Write `files` synthetic movies into `directory`, cycling through LAYOUTS; returns their paths"""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    resolutions = [(1920, 1080, 6_000_000), (1280, 720, 3_000_000), (3840, 2160, 16_000_000)]
+    languages = [('eng',), ('eng', 'fre'), ('eng', 'ger', 'spa')]
+    paths = []
+    for index in range(files):
+        layout = LAYOUTS[index % len(LAYOUTS)]
+        width, height, bitrate = resolutions[index % len(resolutions)]
+        seconds = float(minutes * 60 * rng.uniform(0.8, 1.2))
+        tracks = languages[index % len(languages)]
+        path = os.path.join(directory, f"movie_{index:05d}.{layout.split('-')[0]}")
+        if layout.startswith('mp4'):
+            write_mp4(path, seconds, width, height, bitrate, tracks, layout == 'mp4-faststart', rng)
+        else:
+            write_mkv(path, seconds, width, height, bitrate, tracks, layout.endswith('first'),
+                      layout.startswith('webm'), rng)
+        paths.append(path)
+        if progress is not None and (index + 1) % 100 == 0:
+            progress(f'{index + 1} files written')
+    return paths
+
+
+def _parse_all(paths, workers):
+    if workers == 1:
+        return list(map(_analyze_job, paths, repeat(False)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_analyze_job, paths, repeat(False), chunksize=max(len(paths) // (workers * 4), 1)))
+
+
+def _timed(paths, workers):
+    started = time.perf_counter()
+    results = _parse_all(paths, workers)
+    elapsed = time.perf_counter() - started
+    return {
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'files_per_second': round(len(paths) / elapsed, 1),
+        'failed': sum(1 for _, _, error in results if error),
+    }
+
+
+def _ffprobe(paths):
+    started = time.perf_counter()
+    for path in paths:
+        subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False,
+        )
+    elapsed = time.perf_counter() - started
+    return {'files': len(paths), 'seconds': round(elapsed, 3), 'files_per_second': round(len(paths) / elapsed, 1)}
+
+
+def synthetic_files(directory):
+    """Paths of a library make_library() wrote earlier into `directory`"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(entry.path for entry in os.scandir(directory) if SYNTHETIC_NAME.match(entry.name))
+
+
+def run_benchmark(directory, files=500, minutes=100, workers=None, ffprobe_sample=50, progress=None):
+    """
+    Time parsing the synthetic library in `directory`, writing it first when
+    the directory is empty; returns a report.
+    """
+    workers = workers or os.cpu_count() or 1
+    paths = synthetic_files(directory)
+    generated = not paths
+    if generated:
+        if os.path.isdir(directory) and os.listdir(directory):
+            raise ValueError(f'{directory} is neither empty nor a synthetic library')
+        if progress is not None:
+            progress(f'Writing {files} synthetic {minutes}-minute movies to {directory}')
+        paths = make_library(directory, files, minutes=minutes, progress=progress)
+
+    # Untimed pass: fills the page cache, and checks every file parses
+    sample = _parse_all(paths[:len(LAYOUTS)], 1)
+    failures = [error for _, _, error in _parse_all(paths, workers) if error]
+    report = {
+        'files': len(paths),
+        'generated': generated,
+        'disk_mb': round(sum(os.stat(path).st_blocks * 512 for path in paths) / 2 ** 20, 1),
+        'nominal_gb': round(sum(os.path.getsize(path) for path in paths) / 2 ** 30, 1),
+        'failed': len(failures),
+        'samples': {
+            os.path.basename(path): {key: metadata[key] for key in (
+                'container', 'duration', 'video_codec', 'width', 'height', 'is_faststart', 'audio_tracks'
+            )} | {'keyframes': len(metadata['keyframes'])}
+            for path, (metadata, _, _) in zip(paths, sample) if metadata
+        },
+        'runs': [],
+    }
+    for count in sorted({1, workers}):
+        if progress is not None:
+            progress(f'Parsing with {count} process{"es" if count > 1 else ""}')
+        report['runs'].append(_timed(paths, count))
+    if ffprobe_sample and shutil.which('ffprobe'):
+        if progress is not None:
+            progress(f'Probing {min(ffprobe_sample, len(paths))} files with ffprobe')
+        report['ffprobe'] = _ffprobe(paths[:ffprobe_sample])
+    return report
@@ -0,0 +1,380 @@
+"""
+Cynara Library Scanner
+
+Incremental import of a movie directory. The scanner keeps a manifest
+(LibraryFile) of every video file's path, size, mtime and inode, walks
+the tree with os.scandir on a thread pool (one task per directory, so
+slow or network disks are listed in parallel) and compares the two:
+
+- new files become Movies (or are linked to an existing Movie with the
+  same file_path),
+- new files with the fingerprint (streaming.fingerprint) of a file that
+  disappeared are that file moved or renamed: its manifest row and Movie
+  follow it, keeping the movie's history, ratings and analysis,
+- new files with the fingerprint of a file still present are linked to
+  the same Movie and flagged as duplicates,
+- changed files are re-analyzed,
+- files that disappeared are marked missing and their Movie unavailable
+  (unless a duplicate remains),
+- everything else costs one stat() and nothing more.
+
+Only new and changed files are fingerprinted (about 1 MB read each) and
+go through metadata extraction (analysis.analyze_movies), which skips a
+moved file whose size and mtime didn't change. Writes happen in transactions of
+LIBRARY_BATCH_SIZE rows with bulk_create/bulk_update, so re-importing an
+unchanged library is a walk plus one SELECT.
+"""
+
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from stat import S_ISREG
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.text import slugify
+
+from movies.models import Movie
+from .analysis import analyze_movies
+from .fingerprint import fingerprint_files
+from .models import LibraryFile
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.mkv', '.webm', '.avi', '.mov'}
+
+# "Title (1999)", "Title.1999.1080p", "Title [1999]"
+TITLE_YEAR = re.compile(r'^(?P<title>.+?)[\s.\-_]*[(\[]?(?P<year>(?:19|20)\d{2})[)\]]?(?:[\s.\-_].*)?$')
+
+MANIFEST_FIELDS = ('path', 'id', 'size', 'mtime', 'inode', 'movie_id', 'fingerprint', 'is_missing')
+
+
+def _setting(key, default):
+    return settings.CYNARA_SETTINGS.get(key, default)
+
+
+def _scan_directory(path):
+    """(video files as {path: (size, mtime, inode)}, subdirectories) of one directory"""
+    files = {}
+    directories = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in VIDEO_EXTENSIONS and entry.is_file():
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_size, stat.st_mtime, stat.st_ino)
+                except OSError:
+                    # Vanished or unreadable between listing and stat
+                    continue
+    except OSError as exc:
+        logger.warning('Cannot scan %s: %s', path, exc)
+    return files, directories
+
+
+def scan_tree(root, threads=None):
+    """Every video file under `root` as {absolute path: (size, mtime, inode)}"""
+    threads = threads or _setting('LIBRARY_SCAN_THREADS', 8)
+    found = {}
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='library-scan') as executor:
+        pending = {executor.submit(_scan_directory, os.fspath(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, directories = future.result()
+                found.update(files)
+                pending.update(executor.submit(_scan_directory, directory) for directory in directories)
+    return found
+
+
+def title_from_filename(path):
+    """(title, year or None) guessed from a file name"""
+    stem = Path(path).stem
+    match = TITLE_YEAR.match(stem)
+    title, year = (match['title'], int(match['year'])) if match else (stem, None)
+    title = re.sub(r'[._]+', ' ', title).strip(' -') or stem
+    return title, year
+
+
+def stored_file_path(path):
+    """What goes into Movie.file_path: relative to MOVIES_ROOT when under it, else absolute"""
+    try:
+        return Path(path).relative_to(settings.MOVIES_ROOT).as_posix()
+    except ValueError:
+        return str(path)
+
+
+class SlugAllocator:
+    """Unique Movie slugs, checked against the table once"""
+
+    def __init__(self):
+        self.taken = None
+
+    def __call__(self, title, year):
+        if self.taken is None:
+            self.taken = set(Movie.objects.values_list('slug', flat=True))
+        base = (slugify(f'{title} {year}' if year else title) or 'movie')[:200]
+        slug = base
+        suffix = 2
+        while slug in self.taken:
+            slug = f'{base}-{suffix}'
+            suffix += 1
+        self.taken.add(slug)
+        return slug
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def import_library(root=None, threads=None, analyze=True, progress=None):
+    """
+    Bring Movies and the manifest in line with the files under `root`
+    (MOVIES_ROOT by default); returns counts.
+    """
+    root = Path(root or settings.MOVIES_ROOT).resolve()
+    found = scan_tree(root, threads=threads)
+    if progress is not None:
+        progress(f'Found {len(found)} video files under {root}')
+
+    manifest = {
+        row['path']: row for row in LibraryFile.objects.filter(
+            path__startswith=os.path.join(str(root), '')
+        ).values(*MANIFEST_FIELDS)
+    }
+    return apply_changes(found, manifest, analyze=analyze, progress=progress)
+
+
+def sync_files(paths, analyze=True):
+    """
+    Bring the manifest in line with just these files, e.g. a batch of
+    watcher events; paths that no longer exist count as removed.
+    """
+    found = {}
+    for path in paths:
+        if os.path.splitext(path)[1].lower() not in VIDEO_EXTENSIONS:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if S_ISREG(stat.st_mode):
+            found[path] = (stat.st_size, stat.st_mtime, stat.st_ino)
+    manifest = {
+        row['path']: row for row in LibraryFile.objects.filter(path__in=list(paths)).values(*MANIFEST_FIELDS)
+    }
+    return apply_changes(found, manifest, analyze=analyze)
+
+
+def _stat_of(row):
+    return row['size'], row['mtime'], row['inode']
+
+
+def _relink(moves, found, batch_size):
+    """Point missing manifest rows (and their movies) at the paths their files moved to"""
+    entries = []
+    movies = []
+    for path, entry in moves:
+        entry.path = path
+        entry.size, entry.mtime, entry.inode = found[path]
+        entry.is_missing = False
+        entries.append(entry)
+        if entry.movie_id:
+            movies.append(Movie(
+                id=entry.movie_id, file_path=stored_file_path(path), file_size=entry.size, is_available=True
+            ))
+    with transaction.atomic():
+        LibraryFile.objects.bulk_update(entries, ['path', 'size', 'mtime', 'inode', 'is_missing'], batch_size=batch_size)
+        Movie.objects.bulk_update(movies, ['file_path', 'file_size', 'is_available'], batch_size=batch_size)
+    return [movie.id for movie in movies]
+
+
+def _find_moves(new, removed, manifest, fingerprints, batch_size):
+    """
+    (new path, LibraryFile) pairs for new files whose content was last seen
+    under a path that is gone: removed in this run, or missing from earlier.
+    """
+    gone = {}
+    for path in removed:
+        if manifest[path]['fingerprint']:
+            gone.setdefault(manifest[path]['fingerprint'], []).append(manifest[path])
+    wanted = {fingerprints[path] for path in new if path in fingerprints} - set(gone)
+    earlier = {}
+    for chunk in _chunks(wanted, batch_size):
+        for entry in LibraryFile.objects.filter(fingerprint__in=chunk, is_missing=True).order_by('-id'):
+            earlier.setdefault(entry.fingerprint, []).append(entry)
+
+    moves = []
+    for path in new:
+        fingerprint = fingerprints.get(path)
+        if gone.get(fingerprint):
+            row = gone[fingerprint].pop()
+            entry = LibraryFile(id=row['id'], fingerprint=fingerprint, movie_id=row['movie_id'])
+            entry.old_path = row['path']
+            moves.append((path, entry))
+        elif earlier.get(fingerprint):
+            entry = earlier[fingerprint].pop()
+            entry.old_path = entry.path
+            moves.append((path, entry))
+    return moves
+
+
+def apply_changes(found, manifest, analyze=True, progress=None):
+    """
+    Import `found` ({path: (size, mtime, inode)}) against `manifest` rows
+    for the same paths or tree; manifest paths missing from `found` are
+    marked missing. A new file with the fingerprint of a missing one is
+    the same file moved, and takes over its row and movie; one with the
+    fingerprint of a present file is linked to that file's movie as a
+    duplicate. Returns counts.
+    """
+    batch_size = _setting('LIBRARY_BATCH_SIZE', 500)
+    counts = {
+        'files': len(found), 'new': 0, 'moved': 0, 'duplicates': 0, 'changed': 0, 'removed': 0,
+        'unchanged': 0, 'analyzed': 0,
+    }
+    new = sorted(path for path in found if path not in manifest)
+    changed = [path for path, stat in found.items()
+               if path in manifest and (manifest[path]['is_missing'] or _stat_of(manifest[path]) != stat)]
+    removed = [path for path, row in manifest.items() if path not in found and not row['is_missing']]
+    # Unchanged files imported before fingerprints existed
+    backfill = [path for path in found if path in manifest and not manifest[path]['fingerprint']]
+    counts['unchanged'] = len(found) - len(new) - len(changed)
+
+    fingerprints = fingerprint_files(sorted(set(new) | set(changed) | set(backfill)))
+    touched_movies = []
+
+    moves = _find_moves(new, removed, manifest, fingerprints, batch_size)
+    for chunk in _chunks(moves, batch_size):
+        touched_movies.extend(_relink(chunk, found, batch_size))
+        counts['moved'] += len(chunk)
+        if progress is not None:
+            progress(f"{counts['moved']} moved files relinked")
+    moved_to = {path for path, _ in moves}
+    moved_from = {entry.old_path for _, entry in moves}
+    new = [path for path in new if path not in moved_to]
+    removed = [path for path in removed if path not in moved_from]
+
+    allocate_slug = SlugAllocator()
+    originals = {}  # fingerprint -> LibraryFile created in this run
+    for paths in _chunks(new, batch_size):
+        stored = {path: stored_file_path(path) for path in paths}
+        existing = dict(Movie.objects.filter(
+            file_path__in=set(stored.values()) | set(paths)
+        ).values_list('file_path', 'id'))
+        present = {}
+        for entry in LibraryFile.objects.filter(
+            fingerprint__in={fingerprints[path] for path in paths if path in fingerprints},
+            is_missing=False,
+            movie__isnull=False,
+        ).only('id', 'fingerprint', 'movie_id', 'duplicate_of_id'):
+            # Prefer the first copy over another duplicate of it
+            if entry.fingerprint not in present or present[entry.fingerprint].duplicate_of_id:
+                present[entry.fingerprint] = entry
+        movies = []
+        entries = []
+        duplicates = []
+        for path in paths:
+            size, mtime, inode = found[path]
+            fingerprint = fingerprints.get(path, '')
+            entry = LibraryFile(
+                path=path, size=size, mtime=mtime, inode=inode, fingerprint=fingerprint,
+                movie_id=existing.get(stored[path]) or existing.get(path),
+            )
+            original = (present.get(fingerprint) or originals.get(fingerprint)) if fingerprint else None
+            if original is not None:
+                # Another copy of a file already in the library: same movie, flagged as a duplicate
+                entry.duplicate_of = original
+                if entry.movie_id is None:
+                    if original.movie_id is None:
+                        entry.movie = original.movie  # Created in this chunk, saved below
+                    else:
+                        entry.movie_id = original.movie_id
+                duplicates.append(entry)
+                continue
+            if entry.movie_id is None:
+                title, year = title_from_filename(path)
+                entry.movie = Movie(
+                    title=title[:200],
+                    slug=allocate_slug(title, year),
+                    year=year,
+                    file_path=stored[path],
+                    file_size=size,
+                    is_available=True,
+                )
+                movies.append(entry.movie)
+            if fingerprint:
+                originals[fingerprint] = entry
+            entries.append(entry)
+        with transaction.atomic():
+            # bulk_create fills in movie_id / duplicate_of_id from the objects saved before it
+            Movie.objects.bulk_create(movies, batch_size=batch_size)
+            LibraryFile.objects.bulk_create(entries, batch_size=batch_size)
+            LibraryFile.objects.bulk_create(duplicates, batch_size=batch_size)
+            linked = [entry.movie_id for entry in entries + duplicates if entry.movie_id]
+            Movie.objects.filter(id__in=linked, is_available=False).update(is_available=True)
+        touched_movies.extend(entry.movie_id for entry in entries if entry.movie_id)
+        counts['new'] += len(paths)
+        counts['duplicates'] += len(duplicates)
+        if progress is not None:
+            progress(f"{counts['new']} new files imported")
+
+    for paths in _chunks(changed, batch_size):
+        entries = []
+        for path in paths:
+            size, mtime, inode = found[path]
+            row = manifest[path]
+            entries.append(LibraryFile(
+                id=row['id'], path=path, size=size, mtime=mtime, inode=inode, is_missing=False,
+                fingerprint=fingerprints.get(path, row['fingerprint']), movie_id=row['movie_id'],
+            ))
+        movies = [
+            Movie(id=entry.movie_id, file_size=entry.size, is_available=True)
+            for entry in entries if entry.movie_id
+        ]
+        with transaction.atomic():
+            LibraryFile.objects.bulk_update(
+                entries, ['size', 'mtime', 'inode', 'is_missing', 'fingerprint'], batch_size=batch_size
+            )
+            Movie.objects.bulk_update(movies, ['file_size', 'is_available'], batch_size=batch_size)
+        touched_movies.extend(movie.id for movie in movies)
+        counts['changed'] += len(paths)
+
+    changed = set(changed)
+    LibraryFile.objects.bulk_update([
+        LibraryFile(id=manifest[path]['id'], fingerprint=fingerprints[path])
+        for path in backfill if path in fingerprints and path not in changed
+    ], ['fingerprint'], batch_size=batch_size)
+
+    for paths in _chunks(removed, batch_size):
+        movie_ids = {manifest[path]['movie_id'] for path in paths if manifest[path]['movie_id']}
+        with transaction.atomic():
+            # Kept, so the movie is relinked if the file turns up elsewhere
+            LibraryFile.objects.filter(path__in=paths).update(is_missing=True)
+            # Movies with another copy stay available, playing that copy
+            copies = {}
+            for movie_id, path, duplicate_of_id in LibraryFile.objects.filter(
+                movie_id__in=movie_ids, is_missing=False
+            ).values_list('movie_id', 'path', 'duplicate_of_id'):
+                if movie_id not in copies or not duplicate_of_id:
+                    copies[movie_id] = path
+            Movie.objects.filter(id__in=movie_ids - set(copies)).update(is_available=False)
+            Movie.objects.bulk_update([
+                Movie(id=movie.id, file_path=stored_file_path(copies[movie.id]))
+                for movie in Movie.objects.filter(
+                    id__in=copies, file_path__in=[stored_file_path(path) for path in paths] + paths
+                ).only('id')
+            ], ['file_path'], batch_size=batch_size)
+        counts['removed'] += len(paths)
+
+    if analyze and touched_movies:
+        counts['analyzed'] = analyze_movies(movie_ids=touched_movies, chunk_size=batch_size)['analyzed']
+    return counts
@@ -0,0 +1,224 @@
+"""
+Cynara Streaming Load Test
+
+Starts the project under gunicorn twice, once as WSGI with sync workers
+(the /stream/<slug>/ view) and once as ASGI with uvicorn workers (the
+/stream/async/<slug>/ view). Each server is then hit by a growing number
+of simulated viewers. A viewer asks for `bytes=<position>-`, reads at a
+fixed playback bitrate and asks again from where it stopped whenever a
+response ends, the way a <video> element does.
+
+For every (server, concurrency) level the report holds how many viewers got
+bytes at all, time to first byte, how close each viewer came to its
+bitrate, and the server process tree's peak RSS and CPU use, sampled from
+/proc (Linux only; other platforms report None).
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+SERVERS = ('wsgi', 'asgi')
+
+READ_SIZE = 64 * 1024
+
+
+def server_command(kind, host, port, workers):
+    if kind == 'wsgi':
+        application, worker_class = 'Flicks.wsgi:application', 'sync'
+    else:
+        application, worker_class = 'Flicks.asgi:application', 'uvicorn.workers.UvicornWorker'
+    return [
+        sys.executable, '-m', 'gunicorn', application,
+        '--bind', f'{host}:{port}',
+        '--workers', str(workers),
+        '--worker-class', worker_class,
+        '--timeout', '120',
+        '--log-level', 'warning',
+    ]
+
+
+def wait_for_server(host, port, timeout=30.0):
+    """Block until a worker answers (gunicorn listens before its workers boot)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=5) as connection:
+                connection.sendall(f'HEAD / HTTP/1.0\r\nHost: {host}\r\n\r\n'.encode())
+                if connection.recv(1):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Server on {host}:{port} did not start within {timeout:.0f}s')
+
+
+def process_tree(pid):
+    """pid and all of its descendants, from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, ()))
+    return tree
+
+
+def sample_usage(pid):
+    """(resident bytes, CPU seconds) summed over the process tree, or (None, None)"""
+    if not os.path.isdir('/proc'):
+        return None, None
+    rss = 0
+    ticks = 0
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        ticks += int(fields[11]) + int(fields[12])  # utime, stime
+        rss += int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    return rss, ticks / os.sysconf('SC_CLK_TCK')
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+async def viewer(host, port, path, cookie, bitrate, deadline, stats):
+    """One simulated player: sequential open-ended range requests, read at `bitrate` bytes/s"""
+    position = 0
+    received = 0
+    started = time.monotonic()
+    first_byte = None
+    while time.monotonic() < deadline:
+        writer = None
+        try:
+            requested = time.monotonic()
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), deadline - requested)
+            writer.write((
+                f'GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n'
+                f'Range: bytes={position}-\r\nConnection: close\r\n\r\n'
+            ).encode())
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), max(deadline - time.monotonic(), 0.01))
+            status = int(head.split(b' ', 2)[1])
+            if status == 416:
+                position = 0
+                continue
+            if status not in (200, 206):
+                stats['errors'] += 1
+                break
+            if first_byte is None:
+                first_byte = time.monotonic() - requested
+                stats['ttfb'].append(first_byte)
+
+            body = 0
+            while time.monotonic() < deadline:
+                data = await asyncio.wait_for(reader.read(READ_SIZE), max(deadline - time.monotonic(), 0.01))
+                if not data:
+                    break
+                body += len(data)
+                received += len(data)
+                # Sleep off whatever we're ahead of the playback clock
+                ahead = received / bitrate - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(min(ahead, max(deadline - time.monotonic(), 0)))
+            position += body
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError):
+            if time.monotonic() < deadline:
+                stats['errors'] += 1
+        finally:
+            if writer is not None:
+                writer.close()
+
+    stats['received'].append(received)
+    if first_byte is None:
+        stats['stalled'] += 1
+
+
+async def run_level(host, port, path, cookie, server_pid, streams, duration, bitrate):
+    """Run `streams` viewers for `duration` seconds and sample the server meanwhile"""
+    stats = {'ttfb': [], 'received': [], 'errors': 0, 'stalled': 0}
+    deadline = time.monotonic() + duration
+    _, cpu_before = sample_usage(server_pid)
+    peak_rss = None
+    viewers = asyncio.gather(*(
+        viewer(host, port, path, cookie, bitrate, deadline, stats) for _ in range(streams)
+    ))
+    while not viewers.done():
+        rss, _ = sample_usage(server_pid)
+        if rss is not None:
+            peak_rss = max(peak_rss or 0, rss)
+        await asyncio.wait([viewers], timeout=0.5)
+    await viewers
+    _, cpu_after = sample_usage(server_pid)
+
+    target = bitrate * duration
+    ratios = [received / target for received in stats['received']]
+    return {
+        'streams': streams,
+        'served': streams - stats['stalled'],
+        'stalled': stats['stalled'],
+        'errors': stats['errors'],
+        'ttfb_p50_ms': round(_percentile(stats['ttfb'], 50) * 1000, 1) if stats['ttfb'] else None,
+        'ttfb_p95_ms': round(_percentile(stats['ttfb'], 95) * 1000, 1) if stats['ttfb'] else None,
+        'bitrate_met': round(sum(ratio >= 0.9 for ratio in ratios) / streams, 3),
+        'throughput_mb_s': round(sum(stats['received']) / duration / 2 ** 20, 2),
+        'peak_rss_mb': round(peak_rss / 2 ** 20, 1) if peak_rss is not None else None,
+        'cpu_percent': round((cpu_after - cpu_before) / duration * 100, 1) if cpu_before is not None else None,
+    }
+
+
+def run_load_test(slug, cookie, servers=SERVERS, levels=(25, 100, 300), duration=20.0, bitrate=625_000,
+                  wsgi_workers=4, asgi_workers=1, host='127.0.0.1', port=8765, progress=None):
+    """
+    Load-test each server kind at each concurrency level.
+
+    `cookie` must carry a logged-in session. The default bitrate of 625 kB/s
+    is a 5 Mbit/s 1080p stream.
+    """
+    results = {}
+    for kind in servers:
+        path = f'/stream/async/{slug}/' if kind == 'asgi' else f'/stream/{slug}/'
+        workers = asgi_workers if kind == 'asgi' else wsgi_workers
+        server = subprocess.Popen(
+            server_command(kind, host, port, workers), cwd=settings.BASE_DIR, env=dict(os.environ)
+        )
+        try:
+            wait_for_server(host, port)
+            levels_report = []
+            for streams in levels:
+                if progress is not None:
+                    progress(f'{kind}: {streams} streams for {duration:.0f}s')
+                levels_report.append(asyncio.run(
+                    run_level(host, port, path, cookie, server.pid, streams, duration, bitrate)
+                ))
+            results[kind] = {'workers': workers, 'path': path, 'levels': levels_report}
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+    return {
+        'duration_s': duration,
+        'bitrate_bytes_s': bitrate,
+        'max_range_bytes': settings.CYNARA_SETTINGS.get('STREAM_MAX_RANGE_BYTES'),
+        'servers': results,
+    }
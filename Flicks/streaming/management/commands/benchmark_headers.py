@@ -0,0 +1,60 @@
+"""
+Measure how fast container headers are read, in files per second.
+
+Usage: python manage.py benchmark_headers [--files 500] [--minutes 100] [--workers N] [--directory DIR] [--output report.json]
+
+Writes a synthetic library of sparse MP4, Matroska and WebM movies (full
+index, no media data) and parses it the way analyze_media does, with one
+process and with --workers. Without --directory the library goes in a
+temporary directory that is removed afterwards; with it, the library is
+written there once and reused by later runs.
+"""
+
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from streaming.headerbench import run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the MP4 and Matroska header readers on a synthetic library'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=500, help='Movies to generate')
+        parser.add_argument('--minutes', type=int, default=100, help='Average running time of a generated movie')
+        parser.add_argument('--workers', type=int, help='Processes for the parallel run (default: one per CPU)')
+        parser.add_argument('--directory', help='Keep the synthetic library here (written if empty)')
+        parser.add_argument('--ffprobe-sample', type=int, default=50, help='Files also probed with ffprobe, if found')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or tempfile.mkdtemp(prefix='cynara-headers-')
+
+        def progress(message):
+            self.stderr.write(f'  {message}...')
+
+        try:
+            report = run_benchmark(
+                directory,
+                files=options['files'],
+                minutes=options['minutes'],
+                workers=options['workers'],
+                ffprobe_sample=options['ffprobe_sample'],
+                progress=progress if options['verbosity'] > 0 else None,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if not options['directory']:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        payload = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(payload)
+            self.stdout.write(self.style.SUCCESS(f"Header benchmark report written to {options['output']}"))
+        else:
+            self.stdout.write(payload)
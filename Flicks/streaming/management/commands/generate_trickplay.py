@@ -0,0 +1,45 @@
+"""
+Build the seek-bar preview sprite sheets and WebVTT index of each movie.
+
+Usage: python manage.py generate_trickplay [--slug SLUG ...] [--workers N] [--force]
+
+Needs analyze_media first (duration and resolution). Movies whose file
+and tile settings (TRICKPLAY_*) are unchanged since their last run are
+skipped.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies.models import Movie
+from streaming.trickplay import run_trickplay
+
+
+class Command(BaseCommand):
+    help = 'Generate seek-bar preview thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slug', action='append', help='Only this movie; repeatable')
+        parser.add_argument('--workers', type=int, help='Processes generating previews')
+        parser.add_argument('--force', action='store_true', help='Regenerate unchanged movies too')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        movie_ids = None
+        if options['slug']:
+            movie_ids = list(Movie.objects.filter(slug__in=options['slug']).values_list('id', flat=True))
+
+        def progress(counts):
+            self.stdout.write(f"  {counts['generated']} movies, {counts['tiles']} tiles")
+
+        counts = run_trickplay(
+            movie_ids=movie_ids,
+            force=options['force'],
+            workers=options['workers'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated previews for {counts['generated']} movies ({counts['tiles']} tiles), "
+            f"{counts['failed']} failed in {time.perf_counter() - started:.1f}s"
+        ))
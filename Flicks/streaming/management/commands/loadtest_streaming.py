@@ -0,0 +1,82 @@
+"""
+Compare concurrent playback on the WSGI and ASGI streaming paths.
+
+Usage: python manage.py loadtest_streaming <movie-slug> [--streams 25 --streams 100] [--duration 20] [--output report.json]
+
+Starts gunicorn with sync workers and then with uvicorn workers on
+--port, plays the movie to simulated viewers at each concurrency level and
+reports time to first byte, how many viewers kept up with the bitrate, and
+the server's peak memory and CPU. A throwaway user and session are created
+for the run and deleted afterwards.
+"""
+
+import json
+import uuid
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.models import Movie
+from streaming.files import movie_file_path
+from streaming.loadtest import SERVERS, run_load_test
+
+
+class Command(BaseCommand):
+    help = 'Load-test concurrent streams against the WSGI and ASGI servers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', help='Movie to stream')
+        parser.add_argument('--server', choices=SERVERS, action='append', help='Repeatable (default: both)')
+        parser.add_argument('--streams', type=int, action='append', help='Concurrency level; repeatable')
+        parser.add_argument('--duration', type=float, default=20.0, help='Seconds per level')
+        parser.add_argument('--bitrate', type=int, default=625_000, help='Playback rate per viewer, bytes/s')
+        parser.add_argument('--wsgi-workers', type=int, default=4)
+        parser.add_argument('--asgi-workers', type=int, default=1)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            movie = Movie.objects.get(slug=options['slug'])
+        except Movie.DoesNotExist:
+            raise CommandError(f"No movie with slug {options['slug']!r}.")
+        if not movie_file_path(movie).is_file():
+            raise CommandError(f'Movie file not found: {movie_file_path(movie)}')
+
+        user = User.objects.create_user(f'loadtest-{uuid.uuid4().hex[:12]}')
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+
+        def progress(message):
+            self.stderr.write(f'  {message}...')
+
+        try:
+            report = run_load_test(
+                movie.slug,
+                f'{settings.SESSION_COOKIE_NAME}={session.session_key}',
+                servers=options['server'] or SERVERS,
+                levels=options['streams'] or (25, 100, 300),
+                duration=options['duration'],
+                bitrate=options['bitrate'],
+                wsgi_workers=options['wsgi_workers'],
+                asgi_workers=options['asgi_workers'],
+                port=options['port'],
+                progress=progress if options['verbosity'] > 0 else None,
+            )
+        finally:
+            session.delete()
+            user.delete()
+
+        payload = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(payload)
+            self.stdout.write(self.style.SUCCESS(f"Load test report written to {options['output']}"))
+        else:
+            self.stdout.write(payload)
@@ -0,0 +1,54 @@
+"""
+Transcode movies into the 1080p/720p/480p HLS ladder.
+
+Usage: python manage.py transcode_renditions [--slug SLUG ...] [--concurrency 1] [--limit N] [--retry-failed] [--schedule-only]
+
+Schedules missing renditions for analyzed movies (run analyze_media
+first), then encodes their segments. Interrupted runs pick up where they
+stopped; encoders run niced, throttled and paused while the host is busy
+(RENDITION_* settings).
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies.models import Movie
+from streaming.renditions import run_transcoding, schedule_renditions
+
+
+class Command(BaseCommand):
+    help = 'Schedule and encode adaptive-bitrate renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slug', action='append', help='Only this movie; repeatable')
+        parser.add_argument('--concurrency', type=int, help='Encoder processes at once')
+        parser.add_argument('--limit', type=int, help='Renditions to work on in this run')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry renditions that failed')
+        parser.add_argument('--schedule-only', action='store_true', help='Create pending renditions and stop')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        movie_ids = None
+        if options['slug']:
+            movie_ids = list(Movie.objects.filter(slug__in=options['slug']).values_list('id', flat=True))
+
+        scheduled = schedule_renditions(movie_ids)
+        self.stdout.write(f'Scheduled {scheduled} renditions')
+        if options['schedule_only']:
+            return
+
+        def progress(counts):
+            self.stdout.write(f"  {counts['segments']} segments, {counts['done']} renditions done")
+
+        counts = run_transcoding(
+            movie_ids=movie_ids,
+            limit=options['limit'],
+            concurrency=options['concurrency'],
+            retry_failed=options['retry_failed'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Encoded {counts['segments']} segments; {counts['done']} renditions done, "
+            f"{counts['failed']} failed in {time.perf_counter() - started:.1f}s"
+        ))
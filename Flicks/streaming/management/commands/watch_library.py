@@ -0,0 +1,37 @@
+"""
+Import movie files as they are added, moved or removed.
+
+Usage: python manage.py watch_library [PATH] [--poll] [--settle 5] [--batch 20]
+
+Runs until interrupted. Starts with one incremental import_library pass
+to catch up, then uses inotify on Linux and falls back to
+rescanning every LIBRARY_POLL_SECONDS elsewhere (or with --poll). New
+files are imported once their size stops changing; removed files mark
+their movie unavailable.
+"""
+
+from django.core.management.base import BaseCommand
+
+from streaming.watcher import watch_library
+
+
+class Command(BaseCommand):
+    help = 'Watch the movie library and import changes as they happen'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Library directory (default: MOVIES_ROOT)')
+        parser.add_argument('--poll', action='store_true', help='Rescan periodically instead of using inotify')
+        parser.add_argument('--settle', type=float, help='Seconds a file size must hold before import')
+        parser.add_argument('--batch', type=int, help='Files per import batch')
+
+    def handle(self, *args, **options):
+        try:
+            watch_library(
+                root=options['path'],
+                poll=options['poll'],
+                settle_seconds=options['settle'],
+                batch_size=options['batch'],
+                log=self.stdout.write,
+            )
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS('Stopped watching'))
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("movies", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MediaInfo",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("container", models.CharField(blank=True, max_length=20)),
+                ("duration", models.FloatField(blank=True, null=True)),
+                ("video_codec", models.CharField(blank=True, max_length=40)),
+                ("audio_codec", models.CharField(blank=True, max_length=40)),
+                ("width", models.PositiveIntegerField(blank=True, null=True)),
+                ("height", models.PositiveIntegerField(blank=True, null=True)),
+                ("is_faststart", models.BooleanField(default=False)),
+                ("moov_offset", models.BigIntegerField(blank=True, null=True)),
+                ("moov_size", models.BigIntegerField(blank=True, null=True)),
+                ("keyframes", models.JSONField(blank=True, default=list)),
+                ("file_size", models.BigIntegerField(default=0)),
+                ("file_mtime", models.FloatField(blank=True, null=True)),
+                ("error", models.CharField(blank=True, max_length=255)),
+                ("analyzed_at", models.DateTimeField(auto_now=True)),
+                (
+                    "movie",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="media_info",
+                        to="movies.movie",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Media info",
+            },
+        ),
+    ]
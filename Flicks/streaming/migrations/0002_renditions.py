@@ -0,0 +1,81 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0001_initial"),
+        ("streaming", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Rendition",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "quality",
+                    models.CharField(
+                        choices=[
+                            ("1080p", "1080p"),
+                            ("720p", "720p"),
+                            ("480p", "480p"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("width", models.PositiveIntegerField(blank=True, null=True)),
+                ("height", models.PositiveIntegerField()),
+                ("bandwidth", models.PositiveIntegerField()),
+                ("codecs", models.CharField(blank=True, max_length=100)),
+                ("segment_seconds", models.FloatField()),
+                ("segment_count", models.PositiveIntegerField(default=0)),
+                ("segments_done", models.PositiveIntegerField(default=0)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="renditions",
+                        to="movies.movie",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["movie", "-height"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "updated_at"],
+                        name="streaming_r_status_baa78c_idx",
+                    )
+                ],
+                "unique_together": {("movie", "quality")},
+            },
+        ),
+    ]
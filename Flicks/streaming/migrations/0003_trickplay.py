@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0001_initial"),
+        ("streaming", "0002_renditions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Trickplay",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("interval", models.FloatField()),
+                ("tile_width", models.PositiveSmallIntegerField()),
+                ("tile_height", models.PositiveSmallIntegerField()),
+                ("columns", models.PositiveSmallIntegerField()),
+                ("rows", models.PositiveSmallIntegerField()),
+                (
+                    "image_format",
+                    models.CharField(
+                        choices=[("jpeg", "JPEG"), ("webp", "WebP")], max_length=4
+                    ),
+                ),
+                ("tile_count", models.PositiveIntegerField(default=0)),
+                ("sheet_count", models.PositiveIntegerField(default=0)),
+                ("version", models.CharField(blank=True, max_length=16)),
+                ("file_size", models.BigIntegerField(default=0)),
+                ("file_mtime", models.FloatField(blank=True, null=True)),
+                ("error", models.TextField(blank=True)),
+                ("generated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "movie",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trickplay",
+                        to="movies.movie",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0001_initial"),
+        ("streaming", "0003_trickplay"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LibraryFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.CharField(max_length=1024, unique=True)),
+                ("size", models.BigIntegerField()),
+                ("mtime", models.FloatField()),
+                ("inode", models.BigIntegerField()),
+                ("scanned_at", models.DateTimeField(auto_now=True)),
+                (
+                    "movie",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="library_files",
+                        to="movies.movie",
+                    ),
+                ),
+            ],
+        ),
+    ]
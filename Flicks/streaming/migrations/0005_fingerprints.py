@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("streaming", "0004_library_files"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="libraryfile",
+            name="duplicate_of",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="duplicates",
+                to="streaming.libraryfile",
+            ),
+        ),
+        migrations.AddField(
+            model_name="libraryfile",
+            name="fingerprint",
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name="libraryfile",
+            name="is_missing",
+            field=models.BooleanField(default=False),
+        ),
+    ]
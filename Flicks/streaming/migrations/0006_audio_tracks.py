@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("streaming", "0005_fingerprints"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mediainfo",
+            name="audio_tracks",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0001_initial"),
+        ("streaming", "0006_audio_tracks"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProgressReport",
+            fields=[
+                (
+                    "session",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="progress_report",
+                        serialize=False,
+                        to="movies.watchhistory",
+                    ),
+                ),
+                ("reported_at", models.DateTimeField()),
+            ],
+        ),
+    ]
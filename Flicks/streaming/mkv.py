@@ -0,0 +1,368 @@
+"""
+Cynara Matroska Parser
+
+Pure-Python reader for Matroska and WebM files. Only EBML element headers
+are walked: the top level of the Segment is read up to the first Cluster,
+and the Info, Tracks and Cues elements found there (or through the
+SeekHead, when they come after the media) are read whole. Everything else
+is skipped with a seek, so a feature film costs a few small reads through
+a READ_BUFFER-sized buffer, plus the Cues.
+
+The result has the same keys as mp4.parse(). Keyframes come from the
+Cues of the video track: each cue is a keyframe's time and the byte
+offset of the Cluster holding it.
+"""
+
+import os
+import struct
+
+READ_BUFFER = 16 * 1024
+
+# Element IDs, marker bits included (Matroska / WebM specifications)
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63A2
+LANGUAGE = 0x22B59C
+LANGUAGE_BCP47 = 0x22B59D
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+CLUSTER = 0x1F43B675
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_TRACK = 0xF7
+CUE_CLUSTER_POSITION = 0xF1
+
+VIDEO_TRACK = 1
+AUDIO_TRACK = 2
+
+UNKNOWN_SIZE = -1
+
+# Matroska codec IDs as RFC 6381 / MP4 sample entry names, like mp4.parse() reports them
+CODECS = {
+    'V_MPEG4/ISO/AVC': 'avc1',
+    'V_MPEGH/ISO/HEVC': 'hvc1',
+    'V_AV1': 'av01',
+    'V_VP9': 'vp09',
+    'V_VP8': 'vp8',
+    'A_AAC': 'mp4a.40',
+    'A_OPUS': 'opus',
+    'A_VORBIS': 'vorbis',
+    'A_FLAC': 'flac',
+    'A_AC3': 'ac-3',
+    'A_EAC3': 'ec-3',
+    'A_MPEG/L3': 'mp4a.6b',
+    'A_DTS': 'dtsc',
+}
+
+
+class MKVError(Exception):
+    """The file isn't a well-formed Matroska file"""
+
+
+# Length of a variable-length integer from its first byte (0 = invalid)
+VINT_LENGTHS = bytes(9 - byte.bit_length() if byte else 0 for byte in range(256))
+
+
+def _vint(data, position, keep_marker):
+    """(value, length) of the variable-length integer at data[position]"""
+    if position >= len(data):
+        raise MKVError(f'Truncated element header at {position}')
+    first = data[position]
+    length = VINT_LENGTHS[first]
+    if not length or position + length > len(data):
+        raise MKVError(f'Bad variable-length integer at {position}')
+    value = first if keep_marker else first & (0xFF >> length)
+    if length > 1:
+        value = (value << (8 * (length - 1))) | int.from_bytes(data[position + 1:position + length], 'big')
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = UNKNOWN_SIZE
+    return value, length
+
+
+def element_header(data, position=0):
+    """(element ID, payload size or UNKNOWN_SIZE, header length) at data[position]"""
+    element_id, id_length = _vint(data, position, keep_marker=True)
+    size, size_length = _vint(data, position + id_length, keep_marker=False)
+    return element_id, size, id_length + size_length
+
+
+def iter_elements(data, start=0, end=None):
+    """
+    (ID, payload start, payload end) of the elements laid out back to back
+    in data[start:end]. element_header() inlined: Cues hold thousands of
+    elements.
+    """
+    end = len(data) if end is None else end
+    lengths = VINT_LENGTHS
+    elements = []
+    position = start
+    while position < end:
+        id_length = lengths[data[position]]
+        size_at = position + id_length
+        size_length = lengths[data[size_at]] if size_at < end else 0
+        if not id_length or not size_length or size_at + size_length > end:
+            raise MKVError(f'Bad element header at {position}')
+        mask = (1 << (7 * size_length)) - 1
+        size = int.from_bytes(data[size_at:size_at + size_length], 'big') & mask
+        payload = size_at + size_length
+        if size == mask or payload + size > end:
+            # Unknown size, or a master element running to the end of its parent
+            size = end - payload
+        elements.append((int.from_bytes(data[position:size_at], 'big'), payload, payload + size))
+        position = payload + size
+    return elements
+
+
+def _uint(data, start, end):
+    return int.from_bytes(data[start:end], 'big')
+
+
+def _float(data, start, end):
+    if end - start == 4:
+        return struct.unpack_from('>f', data, start)[0]
+    if end - start == 8:
+        return struct.unpack_from('>d', data, start)[0]
+    return 0.0
+
+
+def _string(data, start, end):
+    return bytes(data[start:end]).rstrip(b'\0').decode('utf-8', errors='replace')
+
+
+def _codec(codec_id, private):
+    """Codec string for a track, refined from CodecPrivate where it says more"""
+    codec = CODECS.get(codec_id) or CODECS.get(codec_id.split('/')[0]) or codec_id.lower()
+    if codec == 'avc1' and len(private) >= 4:
+        # AVCDecoderConfigurationRecord, as in an MP4 avcC box
+        codec = f'avc1.{private[1]:02x}{private[2]:02x}{private[3]:02x}'
+    elif codec == 'mp4a.40' and private:
+        # AudioSpecificConfig: the object type is the first five bits
+        codec = f'mp4a.40.{private[0] >> 3}'
+    return codec
+
+
+def parse_info(data):
+    """Duration in seconds and the timestamp scale (nanoseconds per tick) from an Info payload"""
+    scale = 1_000_000
+    duration = None
+    for element_id, start, end in iter_elements(data):
+        if element_id == TIMESTAMP_SCALE:
+            scale = _uint(data, start, end) or scale
+        elif element_id == DURATION:
+            duration = _float(data, start, end)
+    return (duration * scale / 1e9 if duration else None), scale
+
+
+def parse_tracks(data):
+    """A dict per TrackEntry in a Tracks payload"""
+    tracks = []
+    for element_id, start, end in iter_elements(data):
+        if element_id != TRACK_ENTRY:
+            continue
+        track = {'number': None, 'type': None, 'codec_id': '', 'private': b'', 'language': 'eng',
+                 'width': None, 'height': None, 'channels': 1, 'sample_rate': 8000}
+        for child, child_start, child_end in iter_elements(data, start, end):
+            if child == TRACK_NUMBER:
+                track['number'] = _uint(data, child_start, child_end)
+            elif child == TRACK_TYPE:
+                track['type'] = _uint(data, child_start, child_end)
+            elif child == CODEC_ID:
+                track['codec_id'] = _string(data, child_start, child_end)
+            elif child == CODEC_PRIVATE:
+                track['private'] = bytes(data[child_start:child_start + 16])
+            elif child == LANGUAGE and track['language'] == 'eng':
+                track['language'] = _string(data, child_start, child_end)
+            elif child == LANGUAGE_BCP47:
+                track['language'] = _string(data, child_start, child_end)
+            elif child == VIDEO:
+                for setting, value_start, value_end in iter_elements(data, child_start, child_end):
+                    if setting == PIXEL_WIDTH:
+                        track['width'] = _uint(data, value_start, value_end)
+                    elif setting == PIXEL_HEIGHT:
+                        track['height'] = _uint(data, value_start, value_end)
+            elif child == AUDIO:
+                for setting, value_start, value_end in iter_elements(data, child_start, child_end):
+                    if setting == CHANNELS:
+                        track['channels'] = _uint(data, value_start, value_end)
+                    elif setting == SAMPLING_FREQUENCY:
+                        track['sample_rate'] = int(_float(data, value_start, value_end))
+        track['codec'] = _codec(track['codec_id'], track['private'])
+        tracks.append(track)
+    return tracks
+
+
+def parse_cues(data, track_number, scale, segment_start):
+    """
+    [[seconds, byte offset of the cluster], ...] for one track from a Cues
+    payload. A film has a CuePoint every few seconds, so this is one flat
+    pass that steps into CuePoint and CueTrackPositions instead of walking
+    them as nested elements.
+    """
+    lengths = VINT_LENGTHS
+    keyframes = []
+    time = track = cluster = None
+    found = False
+    position = 0
+    end = len(data)
+    while position < end:
+        id_length = lengths[data[position]]
+        size_at = position + id_length
+        size_length = lengths[data[size_at]] if size_at < end else 0
+        if not id_length or not size_length:
+            raise MKVError(f'Bad element header at {position} in Cues')
+        element_id = data[position] if id_length == 1 else int.from_bytes(data[position:size_at], 'big')
+        payload = size_at + size_length
+        size = int.from_bytes(data[size_at:payload], 'big') & ((1 << (7 * size_length)) - 1)
+        if element_id == CUE_POINT:
+            time = track = cluster = None
+            found = False
+            position = payload
+            continue
+        if element_id == CUE_TRACK_POSITIONS:
+            track = cluster = None
+            position = payload
+            continue
+        if element_id == CUE_TIME:
+            time = int.from_bytes(data[payload:payload + size], 'big')
+        elif element_id == CUE_TRACK:
+            track = int.from_bytes(data[payload:payload + size], 'big')
+        elif element_id == CUE_CLUSTER_POSITION:
+            cluster = int.from_bytes(data[payload:payload + size], 'big')
+        if not found and track == track_number and cluster is not None and time is not None:
+            keyframes.append([round(time * scale / 1e9, 3), segment_start + cluster])
+            found = True
+        position = payload + size
+    keyframes.sort()
+    return keyframes
+
+
+def parse_seek_head(data, segment_start):
+    """{element ID: absolute offset} from a SeekHead payload"""
+    positions = {}
+    for element_id, start, end in iter_elements(data):
+        if element_id != SEEK:
+            continue
+        target = offset = None
+        for child, child_start, child_end in iter_elements(data, start, end):
+            if child == SEEK_ID:
+                target = _uint(data, child_start, child_end)
+            elif child == SEEK_POSITION:
+                offset = _uint(data, child_start, child_end)
+        if target is not None and offset is not None:
+            positions.setdefault(target, segment_start + offset)
+    return positions
+
+
+def _read_element(file, position, file_size):
+    """(ID, payload size, header length) of the element at `position`, or None past the end"""
+    if position >= file_size:
+        return None
+    file.seek(position)
+    return element_header(file.read(12))
+
+
+def read_file(path):
+    """Metadata dict (the keys of mp4.parse()) for a Matroska or WebM file"""
+    with open(path, 'rb', buffering=READ_BUFFER) as file:
+        file_size = os.fstat(file.fileno()).st_size
+        if not file_size:
+            raise MKVError('Empty file')
+        header = _read_element(file, 0, file_size)
+        if header[0] != EBML or header[1] == UNKNOWN_SIZE:
+            raise MKVError('No EBML header')
+        doc_type = 'matroska'
+        file.seek(header[2])
+        payload = file.read(header[1])
+        for element_id, start, end in iter_elements(payload):
+            if element_id == DOC_TYPE:
+                doc_type = _string(payload, start, end)
+
+        position = header[2] + header[1]
+        header = _read_element(file, position, file_size)
+        if header is None or header[0] != SEGMENT:
+            raise MKVError('No Segment')
+        segment_start = position + header[2]
+        segment_end = file_size if header[1] == UNKNOWN_SIZE else min(segment_start + header[1], file_size)
+
+        # Top level of the Segment, up to the first Cluster
+        payloads = {}
+        offsets = {}
+        seeks = {}
+        first_cluster = None
+        position = segment_start
+        while position < segment_end:
+            header = _read_element(file, position, segment_end)
+            if header is None:
+                break
+            element_id, size, length = header
+            if element_id == CLUSTER or size == UNKNOWN_SIZE:
+                first_cluster = position
+                break
+            if element_id in (INFO, TRACKS, CUES) and element_id not in payloads:
+                file.seek(position + length)
+                payloads[element_id] = file.read(size)
+                offsets[element_id] = position
+            elif element_id == SEEK_HEAD:
+                file.seek(position + length)
+                for target, offset in parse_seek_head(file.read(size), segment_start).items():
+                    seeks.setdefault(target, offset)
+            position += length + size
+
+        # Whatever comes after the media, through the SeekHead
+        for element_id in (INFO, TRACKS, CUES):
+            if element_id in payloads or element_id not in seeks:
+                continue
+            header = _read_element(file, seeks[element_id], segment_end)
+            if header is None or header[0] != element_id or header[1] == UNKNOWN_SIZE:
+                continue
+            file.seek(seeks[element_id] + header[2])
+            payloads[element_id] = file.read(header[1])
+            offsets[element_id] = seeks[element_id]
+
+    if TRACKS not in payloads:
+        raise MKVError('No Tracks element')
+    duration, scale = parse_info(payloads.get(INFO, b''))
+    tracks = parse_tracks(payloads[TRACKS])
+    video = next((track for track in tracks if track['type'] == VIDEO_TRACK), None)
+    audio = [track for track in tracks if track['type'] == AUDIO_TRACK]
+
+    info = {
+        'container': 'webm' if doc_type == 'webm' else 'mkv',
+        'duration': duration,
+        'video_codec': video['codec'] if video else '',
+        'audio_codec': audio[0]['codec'] if audio else '',
+        'width': video['width'] if video else None,
+        'height': video['height'] if video else None,
+        'moov_offset': None,
+        'moov_size': None,
+        # The index (Cues) precedes the media, so seeking needs no read from the end
+        'is_faststart': CUES not in offsets or first_cluster is None or offsets[CUES] < first_cluster,
+        'keyframes': [],
+        'audio_tracks': [
+            {'codec': track['codec'], 'language': track['language'], 'channels': track['channels'],
+             'sample_rate': track['sample_rate']}
+            for track in audio
+        ],
+    }
+    if video is not None and CUES in payloads:
+        info['keyframes'] = parse_cues(payloads[CUES], video['number'], scale, segment_start)
+    return info
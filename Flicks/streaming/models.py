@@ -0,0 +1,153 @@
+"""
+Cynara Streaming Models
+
+Per-movie media metadata read from the files themselves, the
+transcoded renditions served for adaptive playback, the sprite sheets
+behind seek-bar previews, the library scanner's file manifest, and when
+each watch session's position was reported.
+"""
+
+from bisect import bisect_right
+
+from django.db import models
+from movies.models import Movie, WatchHistory
+
+
+class MediaInfo(models.Model):
+    """Container metadata and keyframe index of a movie's file"""
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, related_name='media_info')
+    container = models.CharField(max_length=20, blank=True)
+    duration = models.FloatField(null=True, blank=True)  # Seconds
+    video_codec = models.CharField(max_length=40, blank=True)  # RFC 6381 string, e.g. avc1.64001f
+    audio_codec = models.CharField(max_length=40, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    is_faststart = models.BooleanField(default=False)  # Index (moov, Matroska Cues) precedes the media data
+    moov_offset = models.BigIntegerField(null=True, blank=True)
+    moov_size = models.BigIntegerField(null=True, blank=True)
+    keyframes = models.JSONField(default=list, blank=True)  # [[seconds, byte offset], ...] of video sync samples
+    audio_tracks = models.JSONField(default=list, blank=True)  # [{codec, language, channels, sample_rate}, ...]
+
+    # The file as it was when analyzed; a change to either triggers re-analysis
+    file_size = models.BigIntegerField(default=0)
+    file_mtime = models.FloatField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    analyzed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Media info'
+
+    def __str__(self):
+        return f"Media info for {self.movie.title}"
+
+    def keyframe_before(self, seconds):
+        """(time, byte offset) of the last keyframe at or before `seconds`, or None"""
+        if not self.keyframes:
+            return None
+        position = bisect_right([time for time, _ in self.keyframes], seconds) - 1
+        return tuple(self.keyframes[max(position, 0)])
+
+
+class Rendition(models.Model):
+    """One rung of a movie's bitrate ladder, transcoded into HLS segments"""
+    QUALITY_CHOICES = [
+        ('1080p', '1080p'),
+        ('720p', '720p'),
+        ('480p', '480p'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='renditions')
+    quality = models.CharField(max_length=10, choices=QUALITY_CHOICES)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField()
+    bandwidth = models.PositiveIntegerField()  # Peak bits/s advertised in the master playlist
+    codecs = models.CharField(max_length=100, blank=True)
+    segment_seconds = models.FloatField()
+    segment_count = models.PositiveIntegerField(default=0)
+    segments_done = models.PositiveIntegerField(default=0)  # Finished segments survive restarts
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('movie', 'quality')
+        ordering = ['movie', '-height']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.movie.title} {self.quality} ({self.status})"
+
+
+class Trickplay(models.Model):
+    """Seek-bar preview sprite sheets of a movie and their WebVTT index"""
+    FORMAT_CHOICES = [
+        ('jpeg', 'JPEG'),
+        ('webp', 'WebP'),
+    ]
+
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, related_name='trickplay')
+    interval = models.FloatField()  # Seconds between tiles
+    tile_width = models.PositiveSmallIntegerField()
+    tile_height = models.PositiveSmallIntegerField()
+    columns = models.PositiveSmallIntegerField()
+    rows = models.PositiveSmallIntegerField()
+    image_format = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+    tile_count = models.PositiveIntegerField(default=0)
+    sheet_count = models.PositiveIntegerField(default=0)
+    version = models.CharField(max_length=16, blank=True)  # Changes with every generation; part of the URLs
+
+    # The file as it was when generated; a change to either triggers regeneration
+    file_size = models.BigIntegerField(default=0)
+    file_mtime = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    generated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Trickplay for {self.movie.title}"
+
+
+class LibraryFile(models.Model):
+    """A video file under the library root, as the scanner last saw it"""
+    path = models.CharField(max_length=1024, unique=True)  # Absolute
+    movie = models.ForeignKey(
+        Movie, on_delete=models.SET_NULL, null=True, blank=True, related_name='library_files'
+    )
+
+    # A change to any of these sends the file back through metadata extraction
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    inode = models.BigIntegerField()
+    scanned_at = models.DateTimeField(auto_now=True)
+
+    # Sampled content hash (streaming.fingerprint); follows the file through renames and moves
+    fingerprint = models.CharField(max_length=32, blank=True, db_index=True)
+    # Gone from disk; kept so the movie can be relinked if the file turns up under another path
+    is_missing = models.BooleanField(default=False)
+    # Another present copy of the same file
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates'
+    )
+
+    def __str__(self):
+        return self.path
+
+
+class ProgressReport(models.Model):
+    """When the position stored on a watch session was reported by the player"""
+    session = models.OneToOneField(
+        WatchHistory, on_delete=models.CASCADE, primary_key=True, related_name='progress_report'
+    )
+    # Positions buffered by several workers can be written out of order; older ones are ignored
+    reported_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Progress of {self.session_id} reported at {self.reported_at}"
@@ -0,0 +1,438 @@
+"""
+Cynara MP4 Parser
+
+Pure-Python reader for ISO base media files (MP4, M4V, MOV). read_file()
+walks the top-level box headers through a READ_BUFFER-sized buffer,
+seeking over everything else, and reads the `moov` box whole, so the cost
+depends on the size of the index, not of the film: the media data is
+never read.
+
+From `moov` it takes the duration, codecs, resolution, the audio tracks
+and, for the video track, the sync-sample (keyframe) table with each
+keyframe's byte offset, computed from the stts/stss/stsc/stsz/stco tables
+with NumPy.
+
+`faststart()` rewrites a file whose `moov` follows the media data so the
+index comes first, patching chunk offsets (and widening stco to co64 if
+they overflow 32 bits). Media data is copied through a fixed-size buffer,
+so memory use doesn't grow with the file.
+"""
+
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+# Boxes whose payload is just more boxes
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf', b'mvex', b'udta'}
+
+COPY_SIZE = 1024 * 1024
+
+READ_BUFFER = 16 * 1024
+
+
+class MP4Error(Exception):
+    """The file isn't a well-formed MP4"""
+
+
+class Box:
+    __slots__ = ('type', 'start', 'header', 'end')
+
+    def __init__(self, kind, start, header, end):
+        self.type = kind
+        self.start = start
+        self.header = header
+        self.end = end
+
+    @property
+    def payload(self):
+        return self.start + self.header
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f'<Box {self.type.decode("latin-1")} {self.start}+{self.size}>'
+
+
+def _box(data, offset, position, end):
+    """The Box whose header is at data[offset], `position` in the file, in a parent ending at `end`"""
+    size, kind = struct.unpack_from('>I4s', data, offset)
+    header = 8
+    if size == 1:
+        if position + 16 > end or offset + 16 > len(data):
+            raise MP4Error(f'Truncated {kind!r} header at {position}')
+        size = struct.unpack_from('>Q', data, offset + 8)[0]
+        header = 16
+    elif size == 0:
+        size = end - position
+    if size < header or position + size > end:
+        raise MP4Error(f'Box {kind!r} at {position} overruns its parent')
+    return Box(kind, position, header, position + size)
+
+
+def iter_boxes(data, start=0, end=None):
+    """Yield the Boxes laid out back to back in data[start:end]"""
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        box = _box(data, position, position, end)
+        yield box
+        position = box.end
+
+
+def find_box(data, parent, *path):
+    """First descendant of parent along the box-type path, or None"""
+    box = parent
+    for kind in path:
+        box = next((child for child in iter_boxes(data, box.payload, box.end) if child.type == kind), None)
+        if box is None:
+            return None
+    return box
+
+
+def _array(data, offset, count, dtype):
+    return np.frombuffer(data, dtype=dtype, count=count, offset=offset).astype(np.int64)
+
+
+def _fourcc(kind):
+    return kind.decode('latin-1').strip()
+
+
+def _read_descriptor(data, position):
+    """(tag, payload start, payload end) of an MPEG-4 descriptor inside esds"""
+    tag = data[position]
+    position += 1
+    length = 0
+    for _ in range(4):
+        byte = data[position]
+        position += 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, position, position + length
+
+
+def _audio_codec(data, esds):
+    """RFC 6381 codec string ('mp4a.40.2') from an esds box"""
+    tag, position, end = _read_descriptor(data, esds.payload + 4)
+    if tag != 0x03:
+        return 'mp4a'
+    flags = data[position + 2]
+    position += 3
+    if flags & 0x80:
+        position += 2
+    if flags & 0x40:
+        position += 1 + data[position]
+    if flags & 0x20:
+        position += 2
+    tag, position, end = _read_descriptor(data, position)
+    if tag != 0x04:
+        return 'mp4a'
+    object_type = data[position]
+    codec = f'mp4a.{object_type:x}'
+    position += 13
+    if position < end:
+        tag, position, _ = _read_descriptor(data, position)
+        if tag == 0x05:
+            codec += f'.{data[position] >> 3}'
+    return codec
+
+
+def _sample_entry(data, stbl):
+    """(codec string, width, height) from the first stsd entry"""
+    stsd = find_box(data, stbl, b'stsd')
+    if stsd is None or stsd.end - stsd.payload < 16:
+        return '', None, None
+    entry = next(iter_boxes(data, stsd.payload + 8, stsd.end), None)
+    if entry is None:
+        return '', None, None
+    codec = _fourcc(entry.type)
+
+    try:
+        if entry.type in (b'avc1', b'avc3', b'hvc1', b'hev1', b'av01', b'vp09', b'mp4v'):
+            width, height = struct.unpack_from('>HH', data, entry.payload + 24)
+            for child in iter_boxes(data, entry.payload + 78, entry.end):
+                if child.type == b'avcC':
+                    profile, compatibility, level = data[child.payload + 1:child.payload + 4]
+                    codec = f'{codec}.{profile:02x}{compatibility:02x}{level:02x}'
+            return codec, width, height
+        if entry.type == b'mp4a':
+            for child in iter_boxes(data, entry.payload + 28, entry.end):
+                if child.type == b'esds':
+                    return _audio_codec(data, child), None, None
+    except (MP4Error, struct.error, IndexError):
+        # QuickTime v1/v2 sound entries and other variants: the fourcc will do
+        pass
+    return codec, None, None
+
+
+def _media_header(data, box):
+    """(timescale, duration) from an mvhd or mdhd box"""
+    version = data[box.payload]
+    if version == 1:
+        return struct.unpack_from('>IQ', data, box.payload + 20)
+    return struct.unpack_from('>II', data, box.payload + 12)
+
+
+def _language(data, mdhd):
+    """ISO 639-2 code packed into an mdhd box, 'und' when unset"""
+    offset = mdhd.payload + (32 if data[mdhd.payload] == 1 else 20)
+    packed = struct.unpack_from('>H', data, offset)[0]
+    code = ''.join(chr(((packed >> shift) & 0x1F) + 0x60) for shift in (10, 5, 0))
+    return code if code.isalpha() else 'und'
+
+
+def _audio_format(data, stbl):
+    """(channels, sample rate) from the first sound sample entry"""
+    stsd = find_box(data, stbl, b'stsd')
+    entry = next(iter_boxes(data, stsd.payload + 8, stsd.end), None) if stsd is not None else None
+    if entry is None or entry.end - entry.payload < 28:
+        return None, None
+    channels, _, _, _, rate = struct.unpack_from('>HHHHI', data, entry.payload + 16)
+    return channels, rate >> 16
+
+
+def sample_tables(data, stbl):
+    """
+    (decode times in timescale units, byte offsets, sync sample indexes)
+    for every sample of a track. Sync indexes are None when every sample is
+    a sync sample (no stss box).
+    """
+    stts = find_box(data, stbl, b'stts')
+    stsc = find_box(data, stbl, b'stsc')
+    stsz = find_box(data, stbl, b'stsz') or find_box(data, stbl, b'stz2')
+    stco = find_box(data, stbl, b'stco') or find_box(data, stbl, b'co64')
+    if not (stts and stsc and stsz and stco):
+        raise MP4Error('Incomplete sample table')
+
+    count = struct.unpack_from('>I', data, stts.payload + 4)[0]
+    pairs = _array(data, stts.payload + 8, count * 2, '>u4').reshape(-1, 2)
+    deltas = np.repeat(pairs[:, 1], pairs[:, 0])
+    times = np.cumsum(deltas) - deltas
+
+    if stsz.type == b'stsz':
+        uniform, count = struct.unpack_from('>II', data, stsz.payload + 4)
+        sizes = np.full(count, uniform, dtype=np.int64) if uniform else _array(data, stsz.payload + 12, count, '>u4')
+    else:
+        field, count = data[stsz.payload + 7], struct.unpack_from('>I', data, stsz.payload + 8)[0]
+        if field == 4:
+            packed = np.frombuffer(data, dtype=np.uint8, count=(count + 1) // 2, offset=stsz.payload + 12)
+            sizes = np.stack([packed >> 4, packed & 0x0F], axis=1).reshape(-1)[:count].astype(np.int64)
+        else:
+            sizes = _array(data, stsz.payload + 12, count, {8: '>u1', 16: '>u2'}[field])
+
+    count = struct.unpack_from('>I', data, stco.payload + 4)[0]
+    chunk_offsets = _array(data, stco.payload + 8, count, '>u4' if stco.type == b'stco' else '>u8')
+
+    count = struct.unpack_from('>I', data, stsc.payload + 4)[0]
+    runs = _array(data, stsc.payload + 8, count * 3, '>u4').reshape(-1, 3)
+    first_chunks = runs[:, 0] - 1
+    run_lengths = np.diff(np.append(first_chunks, len(chunk_offsets)))
+    per_chunk = np.repeat(runs[:, 1], np.maximum(run_lengths, 0))
+
+    # Offset of each sample = its chunk's offset + sizes of the samples before it in that chunk
+    chunk_of_sample = np.repeat(np.arange(len(per_chunk)), per_chunk)
+    total = min(len(chunk_of_sample), len(sizes), len(times))
+    chunk_of_sample, sizes, times = chunk_of_sample[:total], sizes[:total], times[:total]
+    before = np.cumsum(sizes) - sizes
+    chunk_first_sample = (np.cumsum(per_chunk) - per_chunk)[chunk_of_sample]
+    offsets = chunk_offsets[chunk_of_sample] + before - before[chunk_first_sample]
+
+    stss = find_box(data, stbl, b'stss')
+    sync = None
+    if stss is not None:
+        count = struct.unpack_from('>I', data, stss.payload + 4)[0]
+        sync = _array(data, stss.payload + 8, count, '>u4') - 1
+        sync = sync[(sync >= 0) & (sync < total)]
+    return times, offsets, sync
+
+
+def parse(data):
+    """Metadata dict for the MP4 in `data` (bytes or an mmap)"""
+    top = list(iter_boxes(data))
+    moov = next((box for box in top if box.type == b'moov'), None)
+    if moov is None:
+        raise MP4Error('No moov box')
+    return describe(top, data, moov)
+
+
+def describe(top, data, moov):
+    """
+    Metadata dict from the top-level boxes of a file and its moov box;
+    `data` holds moov's bytes, at the offsets `moov` says.
+    """
+    file_moov = next(box for box in top if box.type == b'moov')
+    mdat = next((box for box in top if box.type == b'mdat'), None)
+    info = {
+        'container': 'mp4',
+        'duration': None,
+        'video_codec': '',
+        'audio_codec': '',
+        'width': None,
+        'height': None,
+        'moov_offset': file_moov.start,
+        'moov_size': file_moov.size,
+        'is_faststart': mdat is None or file_moov.start < mdat.start,
+        'keyframes': [],
+        'audio_tracks': [],
+    }
+    mvhd = find_box(data, moov, b'mvhd')
+    if mvhd is not None:
+        timescale, duration = _media_header(data, mvhd)
+        if timescale:
+            info['duration'] = duration / timescale
+
+    for trak in iter_boxes(data, moov.payload, moov.end):
+        if trak.type != b'trak':
+            continue
+        hdlr = find_box(data, trak, b'mdia', b'hdlr')
+        mdhd = find_box(data, trak, b'mdia', b'mdhd')
+        stbl = find_box(data, trak, b'mdia', b'minf', b'stbl')
+        if hdlr is None or stbl is None:
+            continue
+        handler = bytes(data[hdlr.payload + 8:hdlr.payload + 12])
+        codec, width, height = _sample_entry(data, stbl)
+
+        if handler == b'vide' and not info['video_codec']:
+            info['video_codec'] = codec
+            tkhd = find_box(data, trak, b'tkhd')
+            if tkhd is not None:
+                width, height = (value >> 16 for value in struct.unpack_from('>II', data, tkhd.end - 8))
+            info['width'], info['height'] = width or None, height or None
+            timescale = _media_header(data, mdhd)[0] if mdhd is not None else 0
+            if timescale:
+                times, offsets, sync = sample_tables(data, stbl)
+                if sync is None:
+                    # All-intra track: one entry per second is plenty for seeking
+                    seconds = times // timescale
+                    sync = np.flatnonzero(np.diff(seconds, prepend=-1))
+                info['keyframes'] = [
+                    list(pair) for pair in zip(np.round(times[sync] / timescale, 3).tolist(), offsets[sync].tolist())
+                ]
+        elif handler == b'soun':
+            info['audio_codec'] = info['audio_codec'] or codec
+            channels, rate = _audio_format(data, stbl)
+            info['audio_tracks'].append({
+                'codec': codec,
+                'language': _language(data, mdhd) if mdhd is not None else 'und',
+                'channels': channels,
+                'sample_rate': rate,
+            })
+    return info
+
+
+def read_file(path):
+    """Metadata dict for a file on disk, reading only box headers and moov"""
+    with open(path, 'rb', buffering=READ_BUFFER) as file:
+        file_size = os.fstat(file.fileno()).st_size
+        if not file_size:
+            raise MP4Error('Empty file')
+        top = []
+        position = 0
+        while position + 8 <= file_size:
+            file.seek(position)
+            box = _box(file.read(16), 0, position, file_size)
+            top.append(box)
+            position = box.end
+
+        moov = next((box for box in top if box.type == b'moov'), None)
+        if moov is None:
+            raise MP4Error('No moov box')
+        file.seek(moov.start)
+        data = file.read(moov.size)
+    return describe(top, data, Box(b'moov', 0, moov.header, len(data)))
+
+
+def _rebuild(data, start, end, relocate):
+    """Re-serialize boxes in data[start:end] with relocated chunk offsets"""
+    parts = []
+    for box in iter_boxes(data, start, end):
+        if box.type in CONTAINERS:
+            payload = _rebuild(data, box.payload, box.end, relocate)
+        elif box.type in (b'stco', b'co64'):
+            count = struct.unpack_from('>I', data, box.payload + 4)[0]
+            dtype = '>u4' if box.type == b'stco' else '>u8'
+            offsets = relocate(_array(data, box.payload + 8, count, dtype))
+            kind = b'co64' if box.type == b'co64' or (count and offsets.max() > 0xFFFFFFFF) else b'stco'
+            payload = bytes(data[box.payload:box.payload + 8]) + offsets.astype(
+                '>u4' if kind == b'stco' else '>u8'
+            ).tobytes()
+            parts.append(struct.pack('>I4s', 8 + len(payload), kind) + payload)
+            continue
+        else:
+            parts.append(bytes(data[box.start:box.end]))
+            continue
+        if 8 + len(payload) > 0xFFFFFFFF:
+            parts.append(struct.pack('>I4sQ', 1, box.type, 16 + len(payload)) + payload)
+        else:
+            parts.append(struct.pack('>I4s', 8 + len(payload), box.type) + payload)
+    return b''.join(parts)
+
+
+def _copy(source, destination, start, end):
+    while start < end:
+        chunk = os.pread(source, min(COPY_SIZE, end - start), start)
+        if not chunk:
+            raise MP4Error('File shrank while copying')
+        destination.write(chunk)
+        start += len(chunk)
+
+
+def faststart(path):
+    """
+    Move the moov box in front of the media data, in place. Returns False
+    when the file already starts with its index.
+
+    The new file is written next to the original and swapped in with
+    os.replace, so readers holding the old file keep a consistent copy.
+    """
+    with open(path, 'rb') as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        top = list(iter_boxes(data))
+        kinds = [box.type for box in top]
+        if b'moov' not in kinds or b'mdat' not in kinds:
+            raise MP4Error('Need both moov and mdat to rewrite')
+        moov = top[kinds.index(b'moov')]
+        first_mdat = top[kinds.index(b'mdat')]
+        if moov.start < first_mdat.start:
+            return False
+
+        head = [box for box in top if box is not moov and box.start < first_mdat.start]
+        tail = [box for box in top if box is not moov and box.start >= first_mdat.start]
+        head_size = sum(box.size for box in head)
+        old_starts = np.array([box.start for box in tail], dtype=np.int64)
+
+        moov_size = moov.size
+        while True:
+            # Widening stco to co64 grows moov, which shifts everything after it again
+            new_starts = head_size + moov_size + np.cumsum([0] + [box.size for box in tail[:-1]])
+            shifts = new_starts - old_starts
+
+            def relocate(offsets):
+                return offsets + shifts[np.maximum(np.searchsorted(old_starts, offsets, side='right') - 1, 0)]
+
+            new_moov = _rebuild(data, moov.start, moov.end, relocate)
+            if len(new_moov) == moov_size:
+                break
+            moov_size = len(new_moov)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.faststart')
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                for box in head:
+                    _copy(source.fileno(), output, box.start, box.end)
+                output.write(new_moov)
+                for box in tail:
+                    _copy(source.fileno(), output, box.start, box.end)
+            shutil.copymode(path, temporary)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+    return True
@@ -0,0 +1,203 @@
+"""
+Cynara Watch Progress
+
+The player reports its position every few seconds for as long as a movie
+plays. Writing each report would be one UPDATE per viewer per report, so
+reports are coalesced in memory instead: only the latest position per
+(user, movie) is kept, and the buffer is written in bulk every
+PROGRESS_FLUSH_INTERVAL seconds, or sooner once PROGRESS_FLUSH_SIZE pairs
+are waiting. Pending positions are flushed when the process exits, and put
+back in the buffer for the next flush if writing them fails.
+
+A report continues the user's latest WatchHistory row for the movie if
+that session started within PROGRESS_SESSION_GAP_HOURS; otherwise it
+starts a new session row. watched_at is the time a session started and
+never moves afterwards, so trending can fold each row in once by id.
+Several workers buffer reports independently, so their flushes can land
+out of order: a ProgressReport per session remembers when its stored
+position was reported, and an older position never overwrites it.
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from movies.models import WatchHistory
+from recommendations.tasks import batcher
+from .models import ProgressReport
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = settings.CYNARA_SETTINGS.get('PROGRESS_FLUSH_INTERVAL', 30)
+
+# Positions and durations are stored in PositiveIntegerFields
+MAX_SECONDS = 2 ** 31 - 1
+
+
+class Position:
+    """Latest report for one (user, movie) pair"""
+
+    __slots__ = ('seconds', 'watched', 'completed', 'started_at', 'reported_at')
+
+    def __init__(self, seconds, watched, completed, reported_at, started_at=None):
+        self.seconds = seconds
+        self.watched = watched
+        self.completed = completed
+        self.started_at = started_at or reported_at
+        self.reported_at = reported_at
+
+    def merge(self, other):
+        """Fold in another buffered report for the same pair; the later position wins"""
+        if other.reported_at > self.reported_at:
+            self.seconds = other.seconds
+            self.reported_at = other.reported_at
+        self.watched += other.watched
+        self.completed = self.completed or other.completed
+        self.started_at = min(self.started_at, other.started_at)
+
+
+_buffer = {}
+_buffer_lock = threading.Lock()
+
+
+def record(user_id, movie_id, seconds, watched=0, completed=False):
+    """Buffer a progress report; `watched` is playback seconds since the previous one"""
+    key = (user_id, movie_id)
+    seconds = min(max(int(seconds), 0), MAX_SECONDS)
+    watched = max(float(watched), 0)
+    with _buffer_lock:
+        position = _buffer.get(key)
+        if position is None:
+            _buffer[key] = Position(seconds, watched, completed, timezone.now())
+        else:
+            position.seconds = seconds
+            position.watched += watched
+            # Scrubbing back to the opening credits doesn't un-finish a movie
+            position.completed = position.completed or completed
+            position.reported_at = timezone.now()
+        waiting = len(_buffer)
+
+    progress_flushes.add(key)
+    if waiting >= settings.CYNARA_SETTINGS.get('PROGRESS_FLUSH_SIZE', 1000):
+        progress_flushes.hurry()
+
+
+def _take(keys):
+    with _buffer_lock:
+        return {key: position for key in keys if (position := _buffer.pop(key, None)) is not None}
+
+
+def _restore(positions):
+    """Put positions from a failed write back, merged with reports received since"""
+    with _buffer_lock:
+        for key, position in positions.items():
+            newer = _buffer.get(key)
+            if newer is None:
+                _buffer[key] = position
+            else:
+                newer.merge(position)
+
+
+def write_positions(positions):
+    """Upsert buffered positions into WatchHistory; returns (updated, created) counts"""
+    if not positions:
+        return 0, 0
+    gap = timedelta(hours=settings.CYNARA_SETTINGS.get('PROGRESS_SESSION_GAP_HOURS', 6))
+    oldest = min(position.started_at for position in positions.values())
+    user_ids = {user_id for user_id, _ in positions}
+    movie_ids = {movie_id for _, movie_id in positions}
+
+    updated = []
+    created = []
+    finished = []
+    reported = []  # (row, reported_at) for sessions whose stored position changes
+    with transaction.atomic():
+        # The latest recent row per pair; ordering lets the first one seen win. Locked, so
+        # another worker's flush for the same sessions waits for this one
+        sessions = {}
+        rows = WatchHistory.objects.select_for_update().filter(
+            user_id__in=user_ids, movie_id__in=movie_ids, watched_at__gte=oldest - gap
+        ).order_by('user_id', 'movie_id', '-watched_at')
+        for row in rows:
+            sessions.setdefault((row.user_id, row.movie_id), row)
+        last_reported = dict(ProgressReport.objects.filter(
+            session_id__in=[row.pk for row in sessions.values()]
+        ).values_list('session_id', 'reported_at'))
+
+        for (user_id, movie_id), position in positions.items():
+            row = sessions.get((user_id, movie_id))
+            if row is not None and position.reported_at - row.watched_at <= gap:
+                if position.completed and not row.completed:
+                    finished.append((row, False))
+                # Rows from before reports were tracked count as reported when they started
+                if position.reported_at > last_reported.get(row.pk, row.watched_at):
+                    row.progress_seconds = position.seconds
+                    reported.append((row, position.reported_at))
+                row.watch_duration = min(row.watch_duration + round(position.watched), MAX_SECONDS)
+                row.completed = row.completed or position.completed
+                updated.append(row)
+            else:
+                row = WatchHistory(
+                    user_id=user_id,
+                    movie_id=movie_id,
+                    progress_seconds=position.seconds,
+                    watch_duration=min(round(position.watched), MAX_SECONDS),
+                    completed=position.completed,
+                    watched_at=position.started_at,
+                )
+                if row.completed:
+                    finished.append((row, True))
+                created.append(row)
+                reported.append((row, position.reported_at))
+
+        if created:
+            started = [row.watched_at for row in created]
+            WatchHistory.objects.bulk_create(created, batch_size=500)
+            # auto_now stamped the flush time; the session started at its first report
+            for row, watched_at in zip(created, started):
+                row.watched_at = watched_at
+            if created[0].pk is not None:
+                WatchHistory.objects.bulk_update(created, ['watched_at'], batch_size=500)
+        if updated:
+            # bulk_update skips auto_now, so a continued session keeps its start time
+            WatchHistory.objects.bulk_update(
+                updated, ['progress_seconds', 'watch_duration', 'completed'], batch_size=500
+            )
+        ProgressReport.objects.bulk_create(
+            [
+                ProgressReport(session_id=row.pk, reported_at=reported_at)
+                for row, reported_at in reported
+                # Backends that don't return new ids leave these sessions untracked
+                if row.pk is not None
+            ],
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['session'],
+            update_fields=['reported_at'],
+        )
+        # Bulk writes skip post_save; finished movies still feed taste profiles
+        for row, is_new in finished:
+            post_save.send(sender=WatchHistory, instance=row, created=is_new, raw=False)
+    return len(updated), len(created)
+
+
+@batcher(delay=FLUSH_INTERVAL, max_delay=FLUSH_INTERVAL)
+def progress_flushes(keys):
+    """Write the buffered positions for these (user_id, movie_id) pairs"""
+    started = time.monotonic()
+    positions = _take(keys)
+    try:
+        updated, created = write_positions(positions)
+    except Exception:
+        _restore(positions)
+        progress_flushes.retry(positions)
+        raise
+    logger.debug(
+        'Watch progress: %d updated, %d created in %.0fms', updated, created, (time.monotonic() - started) * 1000
+    )
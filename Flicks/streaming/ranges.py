@@ -0,0 +1,75 @@
+"""
+Cynara Byte Ranges
+
+Parsing of HTTP `Range: bytes=...` headers against a file of known size.
+Supports the three forms (`a-b`, `a-` and the suffix `-n`), drops ranges
+that start past the end, and merges overlapping or adjacent ranges so a
+client can't make us send the same bytes many times over.
+"""
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlap the file (HTTP 416)"""
+
+
+def parse_range_header(header, size, max_ranges=None, open_end_limit=None):
+    """
+    Return the requested byte ranges as a sorted list of inclusive
+    (start, end) pairs, or None when the header should be ignored and the
+    whole file served (missing, malformed, another unit, or more than
+    `max_ranges` ranges after merging).
+
+    `open_end_limit` caps `a-` ranges to that many bytes. Players ask for
+    `bytes=0-` and then read for the whole film; answering with a bounded
+    206 makes them come back for the next piece instead of holding one
+    response (and one worker) open for hours.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        first, dash, last = spec.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or last.isdigit()):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if not length:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            if last:
+                end = int(last)
+                if end < start:
+                    return None
+            else:
+                end = size - 1
+                if open_end_limit:
+                    end = min(end, start + open_end_limit - 1)
+            end = min(end, size - 1)
+        if start < size:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable(header)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    if max_ranges and len(merged) > max_ranges:
+        return None
+    return merged
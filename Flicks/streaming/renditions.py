@@ -0,0 +1,397 @@
+"""
+Cynara Renditions
+
+Transcodes each movie into a small bitrate ladder (1080p/720p/480p, never
+above the source) of HLS segments, so players can switch quality and
+UserPreferences.default_quality means something.
+
+Every segment is encoded as its own job by a pluggable encoder command
+(ffmpeg by default, settings.CYNARA_SETTINGS['RENDITION_ENCODER_COMMAND']),
+written to a temporary name and renamed when complete. That makes the
+work resumable: a restarted run re-encodes only the segments that are
+missing. At most RENDITION_CONCURRENCY encoders run at once, at a lower
+CPU priority, no faster than RENDITION_SEGMENTS_PER_MINUTE, and not at
+all while the load average says the host is busy serving playback.
+
+Layout on disk:
+
+    RENDITIONS_ROOT/<movie id>/<quality>/index.m3u8
+    RENDITIONS_ROOT/<movie id>/<quality>/seg_00000.ts ...
+
+The master playlist is built per request from the finished renditions and
+the viewer's quality preference (see master_playlist).
+"""
+
+import logging
+import math
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .files import movie_file_path
+from .models import MediaInfo, Rendition
+
+logger = logging.getLogger(__name__)
+
+# quality -> (height, video kbit/s, audio kbit/s, codecs for the master playlist)
+LADDER = {
+    '1080p': (1080, 5000, 192, 'avc1.640028,mp4a.40.2'),
+    '720p': (720, 2800, 128, 'avc1.64001f,mp4a.40.2'),
+    '480p': (480, 1200, 96, 'avc1.64001e,mp4a.40.2'),
+}
+
+DEFAULT_ENCODER_COMMAND = [
+    'ffmpeg', '-nostdin', '-v', 'error', '-y',
+    '-ss', '{start}', '-i', '{input}', '-t', '{duration}',
+    '-map', '0:v:0', '-map', '0:a:0?',
+    '-vf', 'scale=-2:{height}',
+    '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'high',
+    '-b:v', '{video_bitrate}k', '-maxrate', '{video_bitrate}k', '-bufsize', '{buffer_size}k',
+    '-c:a', 'aac', '-b:a', '{audio_bitrate}k', '-ac', '2',
+    '-threads', '{threads}',
+    '-output_ts_offset', '{start}',
+    '-f', 'mpegts', '{output}',
+]
+
+SEGMENT_NAME = re.compile(r'^seg_\d{5}\.ts$')
+
+
+def _setting(key, default):
+    return settings.CYNARA_SETTINGS.get(key, default)
+
+
+def renditions_root():
+    return Path(_setting('RENDITIONS_ROOT', Path(settings.MEDIA_ROOT) / 'renditions'))
+
+
+def rendition_dir(movie_id, quality):
+    return renditions_root() / str(movie_id) / quality
+
+
+def segment_name(index):
+    return f'seg_{index:05d}.ts'
+
+
+def ladder_for(source_height):
+    """Ladder rungs at or below the source resolution (the lowest one if it's smaller still)"""
+    rungs = [quality for quality, (height, *_) in LADDER.items() if not source_height or height <= source_height]
+    return rungs or [min(LADDER, key=lambda quality: LADDER[quality][0])]
+
+
+def segment_bounds(duration, segment_seconds, index):
+    start = index * segment_seconds
+    return start, min(segment_seconds, duration - start)
+
+
+def schedule_renditions(movie_ids=None):
+    """
+    Create pending Renditions for analyzed movies that lack them.
+
+    Needs MediaInfo (duration and source height); returns how many were
+    created.
+    """
+    segment_seconds = float(_setting('RENDITION_SEGMENT_SECONDS', 6))
+    infos = MediaInfo.objects.filter(error='', duration__gt=0)
+    if movie_ids is not None:
+        infos = infos.filter(movie_id__in=movie_ids)
+    existing = set(Rendition.objects.filter(
+        movie_id__in=infos.values('movie_id')
+    ).values_list('movie_id', 'quality'))
+
+    created = []
+    for movie_id, duration, width, height in infos.values_list('movie_id', 'duration', 'width', 'height'):
+        for quality in ladder_for(height):
+            if (movie_id, quality) in existing:
+                continue
+            rung_height, video_bitrate, audio_bitrate, codecs = LADDER[quality]
+            if height:
+                # Sources below the lowest rung are re-encoded at their own size, not upscaled
+                rung_height = min(rung_height, height // 2 * 2)
+            rung_width = None
+            if width and height:
+                rung_width = int(round(width * rung_height / height / 2)) * 2
+            created.append(Rendition(
+                movie_id=movie_id,
+                quality=quality,
+                width=rung_width,
+                height=rung_height,
+                bandwidth=(video_bitrate + audio_bitrate) * 1000,
+                codecs=codecs,
+                segment_seconds=segment_seconds,
+                segment_count=math.ceil(duration / segment_seconds),
+            ))
+    for rendition in created:
+        # Leftovers from a deleted rendition would otherwise be taken as finished segments
+        shutil.rmtree(rendition_dir(rendition.movie_id, rendition.quality), ignore_errors=True)
+    Rendition.objects.bulk_create(created, batch_size=500, ignore_conflicts=True)
+    return len(created)
+
+
+def encoder_command(source, output, start, duration, height, video_bitrate, audio_bitrate):
+    """The configured encoder command with this segment's values filled in"""
+    template = _setting('RENDITION_ENCODER_COMMAND', None) or DEFAULT_ENCODER_COMMAND
+    values = {
+        'input': str(source),
+        'output': str(output),
+        'start': f'{start:.3f}',
+        'duration': f'{duration:.3f}',
+        'height': height,
+        'video_bitrate': video_bitrate,
+        'audio_bitrate': audio_bitrate,
+        'buffer_size': video_bitrate * 2,
+        'threads': _setting('RENDITION_ENCODER_THREADS', 2),
+    }
+    return [part.format(**values) for part in template]
+
+
+class Throttle:
+    """
+    Gate for starting encoder jobs.
+
+    Spaces starts to at most `per_minute`, and waits while the 1-minute
+    load average per CPU, not counting our own running encoders, is above
+    `max_load`.
+    """
+
+    def __init__(self, per_minute=None, max_load=None):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.max_load = max_load
+        self._next = 0.0
+
+    def _busy(self, running):
+        if not self.max_load or not hasattr(os, 'getloadavg'):
+            return False
+        return (os.getloadavg()[0] - running) / (os.cpu_count() or 1) > self.max_load
+
+    def wait(self, running=0):
+        while self._busy(running):
+            time.sleep(5)
+        now = time.monotonic()
+        delay = self._next - now
+        self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def encode_segment(source, rendition, index):
+    """Encode one segment; the file only appears under its final name once complete"""
+    directory = rendition_dir(rendition.movie_id, rendition.quality)
+    output = directory / segment_name(index)
+    partial = directory / (segment_name(index) + '.part')
+    start, duration = segment_bounds(rendition.movie.media_info.duration, rendition.segment_seconds, index)
+    _, video_bitrate, audio_bitrate, _ = LADDER[rendition.quality]
+    command = encoder_command(source, partial, start, duration, rendition.height, video_bitrate, audio_bitrate)
+    niceness = _setting('RENDITION_NICE', 10)
+    result = subprocess.run(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        # Runs in the child before exec, so the encoder yields the CPU to playback
+        preexec_fn=(lambda: os.nice(niceness)) if os.name == 'posix' and niceness else None,
+        timeout=_setting('RENDITION_SEGMENT_TIMEOUT', 600),
+    )
+    if result.returncode != 0:
+        partial.unlink(missing_ok=True)
+        raise RuntimeError(result.stderr.decode(errors='replace')[-1000:] or f'Encoder exited with {result.returncode}')
+    os.replace(partial, output)
+    return index
+
+
+def write_variant_playlist(rendition):
+    """index.m3u8 listing every segment of a finished rendition"""
+    duration = rendition.movie.media_info.duration
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{math.ceil(rendition.segment_seconds)}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    for index in range(rendition.segment_count):
+        lines.append(f'#EXTINF:{segment_bounds(duration, rendition.segment_seconds, index)[1]:.3f},')
+        lines.append(segment_name(index))
+    lines.append('#EXT-X-ENDLIST')
+    path = rendition_dir(rendition.movie_id, rendition.quality) / 'index.m3u8'
+    partial = path.with_suffix('.m3u8.part')
+    partial.write_text('\n'.join(lines) + '\n')
+    os.replace(partial, path)
+
+
+def missing_segments(rendition):
+    directory = rendition_dir(rendition.movie_id, rendition.quality)
+    directory.mkdir(parents=True, exist_ok=True)
+    done = {name for name in os.listdir(directory) if SEGMENT_NAME.match(name)}
+    return [index for index in range(rendition.segment_count) if segment_name(index) not in done]
+
+
+def claim_renditions(movie_ids=None, limit=None, retry_failed=False, exclude=()):
+    """
+    Take renditions to work on: pending ones, running ones whose worker went
+    quiet (a crashed or killed run) and, optionally, failed ones.
+
+    The rows are locked, skipping any another run holds, and marked running
+    in one transaction, so concurrent runs never encode the same rendition.
+    """
+    stale = timezone.now() - timedelta(seconds=_setting('RENDITION_STALE_SECONDS', 1800))
+    statuses = ['pending', 'failed'] if retry_failed else ['pending']
+    queryset = Rendition.objects.filter(status__in=statuses) | Rendition.objects.filter(
+        status='running', updated_at__lt=stale
+    )
+    if movie_ids is not None:
+        queryset = queryset.filter(movie_id__in=movie_ids)
+    if exclude:
+        queryset = queryset.exclude(pk__in=exclude)
+    queryset = queryset.order_by('movie_id', '-height')
+    with transaction.atomic():
+        claimed = list(queryset.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+        Rendition.objects.filter(pk__in=claimed).update(status='running', error='', updated_at=timezone.now())
+    return list(
+        Rendition.objects.filter(pk__in=claimed)
+        .select_related('movie', 'movie__media_info')
+        .order_by('movie_id', '-height')
+    )
+
+
+def run_transcoding(movie_ids=None, limit=None, concurrency=None, retry_failed=False, progress=None):
+    """
+    Encode the missing segments of claimed renditions; returns counts.
+
+    Renditions are claimed one at a time as encoder slots free up, so none
+    sits claimed but idle long enough to look abandoned to another run.
+    Segments from all renditions share one pool of `concurrency` encoder
+    processes. A rendition is marked done (and its playlist written) when
+    its last segment lands, or failed on its first encoder error.
+    """
+    concurrency = concurrency or _setting('RENDITION_CONCURRENCY', 1)
+    throttle = Throttle(
+        per_minute=_setting('RENDITION_SEGMENTS_PER_MINUTE', None),
+        max_load=_setting('RENDITION_MAX_LOAD', 0.75),
+    )
+    counts = {'segments': 0, 'done': 0, 'failed': 0}
+    remaining = {}
+    failed = set()
+
+    def jobs():
+        while limit is None or len(remaining) < limit:
+            # This run's failures are excluded, or retry_failed would claim them again right away
+            claimed = claim_renditions(movie_ids, limit=1, retry_failed=retry_failed, exclude=failed)
+            if not claimed:
+                return
+            rendition = claimed[0]
+            remaining[rendition.pk] = 0
+            missing = missing_segments(rendition)
+            Rendition.objects.filter(pk=rendition.pk).update(
+                segments_done=rendition.segment_count - len(missing),
+                updated_at=timezone.now(),
+            )
+            source = movie_file_path(rendition.movie)
+            for index in missing:
+                if rendition.pk in failed:
+                    break
+                yield source, rendition, index
+            yield None, rendition, None  # Marker: everything for this rendition was submitted
+
+    submitted_all = set()
+
+    def finish(rendition):
+        if rendition.pk in failed:
+            return
+        write_variant_playlist(rendition)
+        Rendition.objects.filter(pk=rendition.pk).update(
+            status='done', segments_done=rendition.segment_count, updated_at=timezone.now()
+        )
+        counts['done'] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+        source_jobs = jobs()
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < concurrency:
+                job = next(source_jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                source, rendition, index = job
+                if index is None:
+                    submitted_all.add(rendition.pk)
+                    if not remaining[rendition.pk]:
+                        finish(rendition)
+                    continue
+                throttle.wait(running=len(in_flight))
+                remaining[rendition.pk] += 1
+                in_flight[executor.submit(encode_segment, source, rendition, index)] = rendition
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                rendition = in_flight.pop(future)
+                remaining[rendition.pk] -= 1
+                try:
+                    future.result()
+                except Exception as exc:
+                    logger.warning('Transcoding %s failed: %s', rendition, exc)
+                    if rendition.pk not in failed:
+                        failed.add(rendition.pk)
+                        counts['failed'] += 1
+                        Rendition.objects.filter(pk=rendition.pk).update(
+                            status='failed', error=str(exc)[-2000:], updated_at=timezone.now()
+                        )
+                    continue
+                counts['segments'] += 1
+                Rendition.objects.filter(pk=rendition.pk).update(
+                    segments_done=F('segments_done') + 1, updated_at=timezone.now()
+                )
+                if rendition.pk in submitted_all and not remaining[rendition.pk]:
+                    finish(rendition)
+                if progress is not None:
+                    progress(counts)
+    return counts
+
+
+def preferred_quality(user):
+    """The viewer's default_quality preference ('auto' when unset)"""
+    preferences = getattr(user, 'preferences', None) if user.is_authenticated else None
+    return getattr(preferences, 'default_quality', None) or 'auto'
+
+
+def pick_renditions(renditions, quality):
+    """
+    Renditions to offer for a preference: all of them for 'auto', else the
+    requested one, or the best one below it when it wasn't produced.
+    """
+    if quality == 'auto' or quality not in LADDER:
+        return renditions
+    height = LADDER[quality][0]
+    exact = [rendition for rendition in renditions if rendition.quality == quality]
+    if exact:
+        return exact
+    lower = [rendition for rendition in renditions if rendition.height <= height]
+    if lower:
+        return [max(lower, key=lambda rendition: rendition.height)]
+    return [min(renditions, key=lambda rendition: rendition.height)] if renditions else []
+
+
+def master_playlist(renditions):
+    """HLS master playlist text for the given finished renditions, best first"""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rendition in sorted(renditions, key=lambda rendition: -rendition.height):
+        attributes = [f'BANDWIDTH={rendition.bandwidth}']
+        if rendition.width:
+            attributes.append(f'RESOLUTION={rendition.width}x{rendition.height}')
+        if rendition.codecs:
+            attributes.append(f'CODECS="{rendition.codecs}"')
+        lines.append('#EXT-X-STREAM-INF:' + ','.join(attributes))
+        lines.append(f'{rendition.quality}/index.m3u8')
+    return '\n'.join(lines) + '\n'
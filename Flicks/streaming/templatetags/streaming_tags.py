@@ -0,0 +1,15 @@
+"""
+Cynara Streaming Template Tags
+"""
+
+from django import template
+
+from ..files import poster_url as versioned_poster_url
+
+register = template.Library()
+
+
+@register.filter
+def poster_url(movie):
+    """Cacheable poster URL: {{ movie|poster_url }}"""
+    return versioned_poster_url(movie)
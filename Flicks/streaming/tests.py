@@ -0,0 +1,441 @@
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from movies.models import Movie, WatchHistory
+
+from . import mp4, progress
+from .files import serve_file
+from .fingerprint import sample_offsets
+from .headerbench import write_mp4
+from .library import import_library, sync_files
+from .models import LibraryFile, MediaInfo, ProgressReport, Rendition
+from .progress import Position, write_positions
+from .ranges import RangeNotSatisfiable, parse_range_header
+from .renditions import claim_renditions, run_transcoding, schedule_renditions
+from .validators import file_validators
+
+
+class ParseRangeHeaderTests(SimpleTestCase):
+    def test_forms(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), [(0, 999)])
+
+    def test_end_is_clamped_to_the_file(self):
+        self.assertEqual(parse_range_header('bytes=990-5000', 1000), [(990, 999)])
+
+    def test_ignored_headers(self):
+        for header in (None, '', 'items=0-1', 'bytes=', 'bytes=abc', 'bytes=5-1', 'bytes=1-2-3', 'bytes=-'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range_header(header, 1000))
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(
+            parse_range_header('bytes=500-599, 0-99, 50-149, 150-199', 1000),
+            [(0, 199), (500, 599)],
+        )
+
+    def test_ranges_past_the_end_are_dropped(self):
+        self.assertEqual(parse_range_header('bytes=0-9, 2000-3000', 1000), [(0, 9)])
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=1000-', 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=-0', 1000)
+
+    def test_max_ranges(self):
+        self.assertIsNone(parse_range_header('bytes=0-0, 2-2, 4-4', 1000, max_ranges=2))
+        self.assertEqual(parse_range_header('bytes=0-0, 1-1, 2-2', 1000, max_ranges=1), [(0, 2)])
+
+    def test_open_end_limit(self):
+        self.assertEqual(parse_range_header('bytes=100-', 1000, open_end_limit=50), [(100, 149)])
+        self.assertEqual(parse_range_header('bytes=100-799', 1000, open_end_limit=50), [(100, 799)])
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        self.cynara_settings = override_settings(CYNARA_SETTINGS=dict(
+            settings.CYNARA_SETTINGS, STREAM_OFFLOAD=None, STREAM_MAX_RANGE_BYTES=None, STREAM_MAX_RANGES=16,
+        ))
+        self.cynara_settings.enable()
+        self.addCleanup(self.cynara_settings.disable)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.content = bytes(range(256)) * 40
+        self.path = os.path.join(directory, 'movie.mp4')
+        with open(self.path, 'wb') as file:
+            file.write(self.content)
+        self.validators = file_validators(self.path)
+        self.factory = RequestFactory()
+
+    def serve(self, **headers):
+        response = serve_file(self.factory.get('/stream/movie/', headers=headers), self.path)
+        self.addCleanup(response.close)
+        return response
+
+    @staticmethod
+    def body(response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_whole_file(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['ETag'], self.validators.etag)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_single_range(self):
+        response = self.serve(Range='bytes=100-299')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-299/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '200')
+        self.assertEqual(self.body(response), self.content[100:300])
+
+    def test_multiple_ranges(self):
+        response = self.serve(Range='bytes=0-9, 5000-5009')
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = self.body(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        parts = body.split(f'--{boundary}'.encode())
+        self.assertEqual(parts[-1], b'--\r\n')
+        self.assertIn(f'Content-Range: bytes 0-9/{len(self.content)}'.encode(), parts[1])
+        self.assertTrue(parts[1].endswith(b'\r\n\r\n' + self.content[0:10] + b'\r\n'))
+        self.assertIn(f'Content-Range: bytes 5000-5009/{len(self.content)}'.encode(), parts[2])
+        self.assertTrue(parts[2].endswith(b'\r\n\r\n' + self.content[5000:5010] + b'\r\n'))
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(Range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range(self):
+        response = self.serve(Range='bytes=0-9', If_Range=self.validators.etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), self.content[:10])
+
+        # The client's partial copy is of another version: send the whole file
+        response = self.serve(Range='bytes=0-9', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_not_modified(self):
+        response = self.serve(If_None_Match=self.validators.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.validators.etag)
+        self.assertEqual(response.content, b'')
+
+
+def chunk_offsets(path):
+    """{track number: chunk offsets} from the stco/co64 boxes of an MP4"""
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        moov = next(box for box in mp4.iter_boxes(data) if box.type == b'moov')
+        offsets = {}
+        traks = [box for box in mp4.iter_boxes(data, moov.payload, moov.end) if box.type == b'trak']
+        for number, trak in enumerate(traks):
+            stbl = mp4.find_box(data, trak, b'mdia', b'minf', b'stbl')
+            stco = mp4.find_box(data, stbl, b'stco') or mp4.find_box(data, stbl, b'co64')
+            count = struct.unpack_from('>I', data, stco.payload + 4)[0]
+            dtype = '>u4' if stco.type == b'stco' else '>u8'
+            offsets[number] = mp4._array(data, stco.payload + 8, count, dtype).tolist()
+        return offsets
+
+
+class FaststartTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'movie.mp4')
+        write_mp4(self.path, 4, 320, 240, 200_000, ['eng', 'fra'], False, np.random.default_rng(0))
+
+        # Tag the first bytes of every chunk so moved offsets can be checked against the data
+        self.tags = {}
+        with open(self.path, 'r+b') as file:
+            for track, offsets in chunk_offsets(self.path).items():
+                for index, offset in enumerate(offsets):
+                    tag = struct.pack('>HH', track, index)
+                    file.seek(offset)
+                    file.write(tag)
+                    self.tags[track, index] = tag
+
+    def test_moov_moves_in_front_and_offsets_follow_the_data(self):
+        size = os.path.getsize(self.path)
+        self.assertFalse(mp4.read_file(self.path)['is_faststart'])
+
+        self.assertTrue(mp4.faststart(self.path))
+
+        self.assertTrue(mp4.read_file(self.path)['is_faststart'])
+        self.assertEqual(os.path.getsize(self.path), size)
+        with open(self.path, 'rb') as file:
+            kinds = [box.type for box in mp4.iter_boxes(file.read())]
+            self.assertEqual(kinds, [b'ftyp', b'moov', b'mdat'])
+            for track, offsets in chunk_offsets(self.path).items():
+                for index, offset in enumerate(offsets):
+                    file.seek(offset)
+                    self.assertEqual(file.read(4), self.tags[track, index])
+
+    def test_already_faststart(self):
+        mp4.faststart(self.path)
+        with open(self.path, 'rb') as file:
+            before = file.read()
+        self.assertFalse(mp4.faststart(self.path))
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), before)
+
+
+class AsyncStreamTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'movie.mp4')
+        with open(path, 'wb') as file:
+            file.write(bytes(range(256)))
+        self.movie = Movie.objects.create(title='Movie', slug='movie', file_path=path)
+        self.user = User.objects.create_user('viewer')
+
+    def test_not_served_under_wsgi(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('streaming:movie_async', args=[self.movie.slug]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_served_under_asgi(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(
+            reverse('streaming:movie_async', args=[self.movie.slug]), headers={'Range': 'bytes=10-19'}
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), bytes(range(10, 20)))
+
+
+class TranscodingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Stand-in encoder: writes a placeholder segment wherever it's told to
+        encoder = [sys.executable, '-c', 'import sys; open(sys.argv[1], "wb").write(b"ts")', '{output}']
+        self.cynara_settings = override_settings(CYNARA_SETTINGS=dict(
+            settings.CYNARA_SETTINGS, RENDITIONS_ROOT=directory, RENDITION_ENCODER_COMMAND=encoder,
+            RENDITION_SEGMENT_SECONDS=6, RENDITION_SEGMENTS_PER_MINUTE=None, RENDITION_MAX_LOAD=None,
+            RENDITION_NICE=0,
+        ))
+        self.cynara_settings.enable()
+        self.addCleanup(self.cynara_settings.disable)
+        self.movies = []
+        for index in range(2):
+            movie = Movie.objects.create(title=f'Movie {index}', slug=f'movie-{index}', file_path=f'{index}.mp4')
+            MediaInfo.objects.create(movie=movie, duration=10, width=640, height=480)
+            self.movies.append(movie)
+        schedule_renditions()
+
+    def test_claimed_renditions_are_not_claimed_again(self):
+        claimed = claim_renditions([self.movies[0].id])
+        self.assertEqual([rendition.movie_id for rendition in claimed], [self.movies[0].id])
+        self.assertEqual(Rendition.objects.get(pk=claimed[0].pk).status, 'running')
+
+        self.assertEqual(claim_renditions([self.movies[0].id]), [])
+        self.assertEqual([rendition.movie_id for rendition in claim_renditions()], [self.movies[1].id])
+
+    def test_run_is_limited_to_the_given_movies(self):
+        counts = run_transcoding(movie_ids=[self.movies[1].id])
+
+        self.assertEqual(counts, {'segments': 2, 'done': 1, 'failed': 0})
+        statuses = dict(Rendition.objects.values_list('movie_id', 'status'))
+        self.assertEqual(statuses, {self.movies[0].id: 'pending', self.movies[1].id: 'done'})
+
+
+class WritePositionsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('viewer')
+        self.movie = Movie.objects.create(title='Movie', slug='movie', file_path='movie.mp4')
+        self.key = (self.user.id, self.movie.id)
+
+    def test_first_report_starts_a_session(self):
+        started = timezone.now() - timedelta(seconds=30)
+        position = Position(120, 30.4, False, started + timedelta(seconds=30), started_at=started)
+
+        self.assertEqual(write_positions({self.key: position}), (0, 1))
+
+        row = WatchHistory.objects.get(user=self.user, movie=self.movie)
+        self.assertEqual((row.progress_seconds, row.watch_duration, row.completed), (120, 30, False))
+        self.assertEqual(row.watched_at, started)
+
+    def test_later_reports_continue_the_session(self):
+        started = timezone.now() - timedelta(minutes=5)
+        write_positions({self.key: Position(60, 60, False, started, started_at=started)})
+
+        reported = started + timedelta(minutes=4)
+        self.assertEqual(write_positions({self.key: Position(300, 240, True, reported)}), (1, 0))
+
+        row = WatchHistory.objects.get(user=self.user, movie=self.movie)
+        self.assertEqual((row.progress_seconds, row.watch_duration, row.completed), (300, 300, True))
+        # watched_at stays at the session start; trending depends on it not moving
+        self.assertEqual(row.watched_at, started)
+
+    def test_report_after_the_gap_starts_a_new_session(self):
+        started = timezone.now() - timedelta(days=1)
+        write_positions({self.key: Position(60, 60, True, started)})
+
+        self.assertEqual(write_positions({self.key: Position(10, 10, False, timezone.now())}), (0, 1))
+        self.assertEqual(WatchHistory.objects.filter(user=self.user, movie=self.movie).count(), 2)
+
+    def test_report_older_than_the_session_keeps_the_later_position(self):
+        started = timezone.now() - timedelta(minutes=1)
+        write_positions({self.key: Position(600, 30, False, started)})
+
+        # Buffered by another worker before this session row was started
+        stale = Position(580, 20, False, started - timedelta(seconds=10))
+        self.assertEqual(write_positions({self.key: stale}), (1, 0))
+
+        row = WatchHistory.objects.get(user=self.user, movie=self.movie)
+        self.assertEqual((row.progress_seconds, row.watch_duration), (600, 50))
+
+    def test_positions_written_out_of_order_keep_the_latest(self):
+        started = timezone.now() - timedelta(minutes=2)
+        write_positions({self.key: Position(60, 60, False, started)})
+
+        # Two workers buffered reports for the session; the later one is flushed first
+        later = Position(600, 30, False, started + timedelta(seconds=90))
+        earlier = Position(580, 20, False, started + timedelta(seconds=80))
+        write_positions({self.key: later})
+        write_positions({self.key: earlier})
+
+        row = WatchHistory.objects.get(user=self.user, movie=self.movie)
+        self.assertEqual((row.progress_seconds, row.watch_duration), (600, 110))
+        self.assertEqual(ProgressReport.objects.get(session=row).reported_at, later.reported_at)
+
+
+class ProgressFlushTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(progress._buffer.clear)
+
+    def test_failed_flush_keeps_the_positions(self):
+        started = timezone.now()
+        key = (1, 10)
+        progress._buffer[key] = Position(100, 20, False, started)
+
+        def fail(positions):
+            # A newer report arrives while the batch is being written
+            progress._buffer[key] = Position(130, 30, False, started + timedelta(seconds=30))
+            raise RuntimeError('database is down')
+
+        with mock.patch.object(progress, 'write_positions', side_effect=fail), \
+                mock.patch.object(progress.progress_flushes, 'retry') as retry:
+            with self.assertRaises(RuntimeError):
+                progress.progress_flushes.handler({key})
+
+        position = progress._buffer[key]
+        self.assertEqual((position.seconds, position.watched), (130, 50))
+        self.assertEqual(position.started_at, started)
+        self.assertEqual(set(retry.call_args.args[0]), {key})
+
+
+class LibraryTests(TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.movies_root = override_settings(MOVIES_ROOT=self.root)
+        self.movies_root.enable()
+        self.addCleanup(self.movies_root.disable)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, name, content):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        with open(self.path(name), 'wb') as file:
+            file.write(content)
+        return self.path(name)
+
+    def move(self, source, target):
+        os.makedirs(os.path.dirname(self.path(target)), exist_ok=True)
+        os.rename(self.path(source), self.path(target))
+
+    def scan(self):
+        return import_library(self.root, threads=2, analyze=False)
+
+    def test_move_within_one_run(self):
+        self.write('Heat (1995).mp4', b'heat' * 1000)
+        self.scan()
+        entry = LibraryFile.objects.get()
+
+        self.move('Heat (1995).mp4', 'Crime/Heat.1995.mp4')
+        counts = self.scan()
+
+        self.assertEqual((counts['moved'], counts['new'], counts['removed']), (1, 0, 0))
+        moved = LibraryFile.objects.get()
+        self.assertEqual(
+            (moved.id, moved.path, moved.movie_id), (entry.id, self.path('Crime/Heat.1995.mp4'), entry.movie_id)
+        )
+        movie = Movie.objects.get()
+        self.assertEqual((movie.file_path, movie.is_available), ('Crime/Heat.1995.mp4', True))
+
+    def test_move_across_watcher_batches(self):
+        old = self.write('Alien (1979).mp4', b'alien' * 1000)
+        self.scan()
+        entry = LibraryFile.objects.get()
+
+        # The watcher sees the removal in one batch and the new path in a later one
+        self.move('Alien (1979).mp4', 'Alien.mkv')
+        sync_files([old], analyze=False)
+        self.assertTrue(LibraryFile.objects.get().is_missing)
+        self.assertFalse(Movie.objects.get().is_available)
+
+        counts = sync_files([self.path('Alien.mkv')], analyze=False)
+
+        self.assertEqual((counts['moved'], counts['new']), (1, 0))
+        moved = LibraryFile.objects.get()
+        self.assertEqual((moved.id, moved.path, moved.is_missing), (entry.id, self.path('Alien.mkv'), False))
+        movie = Movie.objects.get()
+        self.assertEqual((movie.id, movie.file_path, movie.is_available), (entry.movie_id, 'Alien.mkv', True))
+
+    def test_copies_in_one_chunk_share_a_movie(self):
+        content = b'ran' * 1000
+        self.write('a/Ran (1985).mp4', content)
+        self.write('b/Ran (1985).mp4', content)
+        self.write('b/Ran copy.mp4', content)
+
+        counts = self.scan()
+
+        self.assertEqual((counts['new'], counts['duplicates']), (3, 2))
+        movie = Movie.objects.get()
+        original = LibraryFile.objects.get(duplicate_of__isnull=True)
+        self.assertEqual(original.path, self.path('a/Ran (1985).mp4'))
+        copies = LibraryFile.objects.filter(duplicate_of__isnull=False)
+        self.assertEqual({(copy.duplicate_of_id, copy.movie_id) for copy in copies}, {(original.id, movie.id)})
+
+    def test_removed_original_hands_the_movie_to_a_copy(self):
+        content = b'm' * 1000
+        self.write('M (1931).mp4', content)
+        self.write('backup/M (1931).mp4', content)
+        self.scan()
+
+        os.remove(self.path('M (1931).mp4'))
+        counts = self.scan()
+
+        self.assertEqual(counts['removed'], 1)
+        movie = Movie.objects.get()
+        self.assertEqual((movie.file_path, movie.is_available), ('backup/M (1931).mp4', True))
+
+
+class FingerprintTests(SimpleTestCase):
+    def test_sample_offsets(self):
+        self.assertEqual(sample_offsets(100, 4, 64), [(0, 100)])
+        self.assertEqual(sample_offsets(1000, 3, 100), [(0, 100), (450, 100), (900, 100)])
+        # One block can't span first to last; it samples both ends instead of dividing by zero
+        self.assertEqual(sample_offsets(1000, 1, 100), [(0, 100), (900, 100)])
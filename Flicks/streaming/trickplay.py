@@ -0,0 +1,290 @@
+"""
+Cynara Trickplay
+
+Seek-bar hover previews. A frame every TRICKPLAY_INTERVAL seconds is
+scaled to a small tile, the tiles are packed into sprite sheets (JPEG or
+WebP, via Pillow), and a WebVTT file maps each time range to a rectangle
+of a sheet (`sprite_000.jpg?v=...#xywh=0,0,160,90`), the layout video.js
+and JW Player thumbnails use too. Scrubbing then costs one cached image
+per TRICKPLAY_COLUMNS x TRICKPLAY_ROWS tiles instead of range requests
+into the movie.
+
+Frames come from a single ffmpeg pass that decodes keyframes only and
+pipes raw RGB tiles, so a feature film takes seconds rather than a full
+decode; a tile shows the last keyframe before its time. Movies are done
+in a process pool, since packing and encoding the sheets is CPU-bound.
+Each movie is built in a scratch directory and swapped in whole, and is
+only redone when its file or the tile settings change.
+
+Layout on disk:
+
+    TRICKPLAY_ROOT/<movie id>/thumbnails.vtt
+    TRICKPLAY_ROOT/<movie id>/sprite_000.jpg ...
+"""
+
+import logging
+import math
+import os
+import re
+import secrets
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image
+
+from .files import movie_file_path
+from .models import MediaInfo, Trickplay
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FRAME_COMMAND = [
+    'ffmpeg', '-nostdin', '-v', 'error',
+    '-skip_frame', 'nokey', '-i', '{input}',
+    '-map', '0:v:0', '-an', '-sn',
+    '-vf', 'fps=1/{interval},scale={width}:{height}',
+    '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-',
+]
+
+EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+SPRITE_NAME = re.compile(r'^sprite_\d{3,}\.(jpg|webp)$')
+
+INDEX_NAME = 'thumbnails.vtt'
+
+
+def _setting(key, default):
+    return settings.CYNARA_SETTINGS.get(key, default)
+
+
+def trickplay_root():
+    return Path(_setting('TRICKPLAY_ROOT', Path(settings.MEDIA_ROOT) / 'trickplay'))
+
+
+def trickplay_dir(movie_id):
+    return trickplay_root() / str(movie_id)
+
+
+def sprite_name(index, image_format):
+    return f'sprite_{index:03d}.{EXTENSIONS[image_format]}'
+
+
+def tile_options(width, height):
+    """Tile layout from the settings, for a source of `width` x `height`"""
+    tile_width = int(_setting('TRICKPLAY_TILE_WIDTH', 160)) // 2 * 2
+    if width and height:
+        tile_height = max(int(round(tile_width * height / width / 2)) * 2, 2)
+    else:
+        tile_height = tile_width * 9 // 16 // 2 * 2
+    image_format = _setting('TRICKPLAY_FORMAT', 'jpeg')
+    if image_format not in EXTENSIONS:
+        raise ValueError(f'Unknown TRICKPLAY_FORMAT: {image_format}')
+    return {
+        'interval': float(_setting('TRICKPLAY_INTERVAL', 10)),
+        'tile_width': tile_width,
+        'tile_height': tile_height,
+        'columns': int(_setting('TRICKPLAY_COLUMNS', 10)),
+        'rows': int(_setting('TRICKPLAY_ROWS', 10)),
+        'image_format': image_format,
+    }
+
+
+def frame_command(source, interval, width, height):
+    template = _setting('TRICKPLAY_FRAME_COMMAND', None) or DEFAULT_FRAME_COMMAND
+    values = {'input': str(source), 'interval': f'{interval:g}', 'width': width, 'height': height}
+    return [part.format(**values) for part in template]
+
+
+def _timestamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, rest = divmod(rest, 60)
+    return f'{int(hours):02d}:{int(minutes):02d}:{rest:06.3f}'
+
+
+def thumbnail_index(tile_count, duration, options, version):
+    """WebVTT text mapping each interval to its tile"""
+    interval = options['interval']
+    width, height = options['tile_width'], options['tile_height']
+    per_sheet = options['columns'] * options['rows']
+    lines = ['WEBVTT', '']
+    for index in range(tile_count):
+        start = index * interval
+        end = min(start + interval, duration) if duration else start + interval
+        sheet, position = divmod(index, per_sheet)
+        row, column = divmod(position, options['columns'])
+        lines.append(f'{_timestamp(start)} --> {_timestamp(max(end, start + 0.001))}')
+        lines.append(
+            f"{sprite_name(sheet, options['image_format'])}?v={version}"
+            f'#xywh={column * width},{row * height},{width},{height}'
+        )
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def _save_sheet(sheet, used, options, path):
+    # The last sheet is cropped to the rows it uses
+    rows = math.ceil(used / options['columns'])
+    if rows < options['rows']:
+        sheet = sheet.crop((0, 0, sheet.width, rows * options['tile_height']))
+    quality = _setting('TRICKPLAY_QUALITY', 70)
+    if options['image_format'] == 'webp':
+        sheet.save(path, 'WEBP', quality=quality, method=4)
+    else:
+        sheet.save(path, 'JPEG', quality=quality, optimize=True, progressive=True)
+
+
+def generate_trickplay(source, output_dir, duration, options):
+    """
+    Build the sprite sheets and index of one movie into `output_dir`,
+    replacing what was there. Runs in a pool process, so it touches no
+    database; returns (tile count, sheet count, version).
+    """
+    output_dir = Path(output_dir)
+    output_dir.parent.mkdir(parents=True, exist_ok=True)
+    work = Path(tempfile.mkdtemp(prefix=f'.{output_dir.name}-', dir=output_dir.parent))
+    work.chmod(0o755)
+    width, height = options['tile_width'], options['tile_height']
+    frame_size = width * height * 3
+    per_sheet = options['columns'] * options['rows']
+    expected = math.ceil(duration / options['interval']) if duration else None
+
+    tiles = 0
+    sheets = 0
+    sheet = None
+    try:
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                frame_command(source, options['interval'], width, height),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=errors,
+            )
+            try:
+                while expected is None or tiles < expected:
+                    frame = process.stdout.read(frame_size)
+                    if len(frame) < frame_size:
+                        break
+                    position = tiles % per_sheet
+                    if position == 0:
+                        sheet = Image.new('RGB', (width * options['columns'], height * options['rows']))
+                    row, column = divmod(position, options['columns'])
+                    sheet.paste(Image.frombytes('RGB', (width, height), frame), (column * width, row * height))
+                    tiles += 1
+                    if position == per_sheet - 1:
+                        _save_sheet(sheet, per_sheet, options, work / sprite_name(sheets, options['image_format']))
+                        sheets += 1
+                        sheet = None
+            finally:
+                process.stdout.close()
+                if process.poll() is None and expected is not None and tiles >= expected:
+                    # Everything needed is in; don't wait for the decoder to reach the end
+                    process.kill()
+                returncode = process.wait()
+            if not tiles:
+                errors.seek(0)
+                message = errors.read().decode(errors='replace')[-1000:]
+                raise RuntimeError(message or f'Frame extraction exited with {returncode}')
+
+        if sheet is not None:
+            _save_sheet(sheet, tiles % per_sheet, options, work / sprite_name(sheets, options['image_format']))
+            sheets += 1
+        version = secrets.token_hex(4)
+        (work / INDEX_NAME).write_text(thumbnail_index(tiles, duration, options, version))
+
+        # Swap the finished directory in; readers see the old set or the new one
+        previous = None
+        if output_dir.exists():
+            previous = output_dir.with_name(f'.{output_dir.name}-old-{version}')
+            os.replace(output_dir, previous)
+        os.replace(work, output_dir)
+        if previous is not None:
+            shutil.rmtree(previous, ignore_errors=True)
+        return tiles, sheets, version
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+
+
+def _lower_priority():
+    niceness = _setting('RENDITION_NICE', 10)
+    if os.name == 'posix' and niceness:
+        os.nice(niceness)
+
+
+def trickplay_jobs(movie_ids=None, force=False):
+    """(MediaInfo, source path, stat, options) for movies whose previews are missing or out of date"""
+    infos = MediaInfo.objects.filter(error='', duration__gt=0).select_related('movie').order_by('movie_id')
+    if movie_ids is not None:
+        infos = infos.filter(movie_id__in=movie_ids)
+    infos = list(infos)
+    existing = Trickplay.objects.in_bulk([info.movie_id for info in infos], field_name='movie_id')
+    for info in infos:
+        source = movie_file_path(info.movie)
+        try:
+            stat = os.stat(source)
+        except OSError:
+            continue
+        options = tile_options(info.width, info.height)
+        current = existing.get(info.movie_id)
+        if not force and current is not None and not current.error and current.file_size == stat.st_size \
+                and current.file_mtime == stat.st_mtime \
+                and all(getattr(current, key) == value for key, value in options.items()):
+            continue
+        yield info, source, stat, options
+
+
+def run_trickplay(movie_ids=None, force=False, workers=None, progress=None):
+    """
+    Generate previews for new and changed movies in a pool of `workers`
+    processes; returns counts.
+    """
+    workers = workers or _setting('TRICKPLAY_WORKERS', None) or os.cpu_count() or 1
+    counts = {'generated': 0, 'failed': 0, 'tiles': 0}
+    jobs = trickplay_jobs(movie_ids=movie_ids, force=force)
+
+    def record(info, stat, options, tiles=0, sheets=0, version='', error=''):
+        Trickplay.objects.update_or_create(movie_id=info.movie_id, defaults=dict(
+            options,
+            tile_count=tiles,
+            sheet_count=sheets,
+            version=version,
+            file_size=stat.st_size,
+            file_mtime=stat.st_mtime,
+            error=error,
+        ))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_lower_priority) as executor:
+        in_flight = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < workers * 2:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                info, source, stat, options = job
+                future = executor.submit(
+                    generate_trickplay, str(source), str(trickplay_dir(info.movie_id)), info.duration, options
+                )
+                in_flight[future] = (info, stat, options)
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                info, stat, options = in_flight.pop(future)
+                try:
+                    tiles, sheets, version = future.result()
+                except Exception as exc:
+                    logger.warning('Trickplay for %s failed: %s', info.movie, exc)
+                    record(info, stat, options, error=str(exc)[-2000:])
+                    counts['failed'] += 1
+                else:
+                    record(info, stat, options, tiles, sheets, version)
+                    counts['generated'] += 1
+                    counts['tiles'] += tiles
+                if progress is not None:
+                    progress(counts)
+    return counts
@@ -0,0 +1,34 @@
+"""
+Cynara Streaming URLs
+
+URL patterns for movie playback.
+"""
+
+from django.urls import path
+from . import views
+
+app_name = 'streaming'
+
+urlpatterns = [
+    # Byte-range streaming of the movie file
+    path('<slug:slug>/', views.stream_movie, name='movie'),
+
+    # Same, served from the event loop; 404 unless the request came in over ASGI
+    path('async/<slug:slug>/', views.stream_movie_async, name='movie_async'),
+
+    # Media metadata and keyframe times for the player
+    path('info/<slug:slug>/', views.media_info, name='info'),
+
+    # Seek-bar previews: WebVTT index and sprite sheets
+    path('trickplay/<slug:slug>/<str:name>', views.trickplay_file, name='trickplay'),
+
+    # Posters with validators; versioned URLs are immutable
+    path('poster/<slug:slug>/', views.poster, name='poster'),
+
+    # Watch progress reports, buffered and written in bulk
+    path('progress/<slug:slug>/', views.record_progress, name='progress'),
+
+    # Adaptive streaming: master playlist per viewer preference, then variant playlists and segments
+    path('hls/<slug:slug>/master.m3u8', views.hls_master, name='hls_master'),
+    path('hls/<slug:slug>/<str:quality>/<str:name>', views.hls_file, name='hls_file'),
+]
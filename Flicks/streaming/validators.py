@@ -0,0 +1,98 @@
+"""
+Cynara HTTP Validators
+
+Strong ETags and Last-Modified dates for files on disk, so a client that
+already holds a poster, segment or movie gets a 304 instead of the bytes,
+and a resumed download can send If-Range safely. The ETag is the file's
+inode, size and mtime in nanoseconds, so computing it costs one stat()
+and no reading. Validators are cached per path for
+STREAM_VALIDATOR_CACHE_SECONDS, so repeat hits on a hot file don't even
+stat it. A file replaced within that window can be answered with the old
+validators for that long; any response with a body re-checks the open
+file.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+IMMUTABLE = {'public': True, 'max_age': 365 * 24 * 3600, 'immutable': True}
+PRIVATE_IMMUTABLE = {'private': True, 'max_age': 365 * 24 * 3600, 'immutable': True}
+
+MAX_CACHED_PATHS = 4096
+
+
+class FileValidators:
+    """ETag, version token and Last-Modified of one version of a file"""
+
+    __slots__ = ('etag', 'version', 'last_modified', 'size')
+
+    def __init__(self, stat):
+        self.version = f'{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}'
+        self.etag = f'"{self.version}"'
+        self.last_modified = int(stat.st_mtime)
+        self.size = stat.st_size
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def cached_validators(path):
+    """Validators from the cache, or None (never touches the disk)"""
+    with _cache_lock:
+        entry = _cache.get(str(path))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        _cache.move_to_end(str(path))
+        return entry[1]
+
+
+def file_validators(path, stat=None):
+    """
+    Validators for `path`; raises OSError like os.stat(). Pass the stat of
+    an already open file to refresh the cache from it.
+    """
+    if stat is None:
+        validators = cached_validators(path)
+        if validators is not None:
+            return validators
+        stat = os.stat(path)
+    validators = FileValidators(stat)
+    expires = time.monotonic() + settings.CYNARA_SETTINGS.get('STREAM_VALIDATOR_CACHE_SECONDS', 5)
+    with _cache_lock:
+        _cache[str(path)] = (expires, validators)
+        _cache.move_to_end(str(path))
+        while len(_cache) > MAX_CACHED_PATHS:
+            _cache.popitem(last=False)
+    return validators
+
+
+def not_modified_response(request, validators):
+    """304 when the client's copy is current, 412 when a precondition fails, else None"""
+    return get_conditional_response(request, etag=validators.etag, last_modified=validators.last_modified)
+
+
+def if_range_matches(request, validators):
+    """False when If-Range names another version of the file, so Range must be ignored"""
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith(('"', 'W/')):
+        # Weak tags never match for ranges
+        return value == validators.etag
+    return parse_http_date_safe(value) == validators.last_modified
+
+
+def apply_validators(response, validators, cache_control=None):
+    """Add ETag, Last-Modified and the given Cache-Control directives"""
+    response['ETag'] = validators.etag
+    response['Last-Modified'] = http_date(validators.last_modified)
+    if cache_control:
+        patch_cache_control(response, **cache_control)
+    return response
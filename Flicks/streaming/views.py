@@ -0,0 +1,179 @@
+"""
+Cynara Streaming Views
+
+Movie playback endpoints.
+"""
+
+import json
+import math
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_POST, require_safe
+
+from movies.models import Movie
+from .aio import aserve_file
+from .files import movie_file_path, poster_file_path, serve_file
+from . import progress
+from .models import MediaInfo, Rendition, Trickplay
+from .renditions import SEGMENT_NAME, master_playlist, pick_renditions, preferred_quality, rendition_dir
+from .trickplay import INDEX_NAME, SPRITE_NAME, trickplay_dir
+from .validators import IMMUTABLE, PRIVATE_IMMUTABLE, file_validators
+
+
+def _private_cache(key, default):
+    return {'private': True, 'max_age': settings.CYNARA_SETTINGS.get(key, default)}
+
+
+@login_required
+@require_safe
+def stream_movie(request, slug):
+    """Stream a movie file with byte-range support"""
+    movie = get_object_or_404(Movie, slug=slug, is_available=True)
+    return serve_file(request, movie_file_path(movie), cache_control=_private_cache('STREAM_CACHE_SECONDS', 3600))
+
+
+@login_required
+@require_safe
+async def stream_movie_async(request, slug):
+    """Stream a movie file from the event loop (ASGI deployments)"""
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker would collect the whole async body in memory before sending it
+        raise Http404('Async streaming needs an ASGI server')
+    try:
+        movie = await Movie.objects.aget(slug=slug, is_available=True)
+    except Movie.DoesNotExist:
+        raise Http404('No movie matches the given query.')
+    return await aserve_file(
+        request, movie_file_path(movie), cache_control=_private_cache('STREAM_CACHE_SECONDS', 3600)
+    )
+
+
+@login_required
+def media_info(request, slug):
+    """Duration, codecs, audio tracks and keyframe times of a movie, for the player"""
+    info = MediaInfo.objects.filter(movie__slug=slug, error='').first()
+    if info is None:
+        return JsonResponse({'success': False, 'message': 'Not analyzed yet'}, status=404)
+    trickplay = Trickplay.objects.filter(movie_id=info.movie_id, error='', tile_count__gt=0).first()
+    return JsonResponse({
+        'success': True,
+        'duration': info.duration,
+        'width': info.width,
+        'height': info.height,
+        'video_codec': info.video_codec,
+        'audio_codec': info.audio_codec,
+        'audio_tracks': info.audio_tracks,
+        'faststart': info.is_faststart,
+        'keyframes': [time for time, _ in info.keyframes],
+        'hls': reverse('streaming:hls_master', args=[slug]) if Rendition.objects.filter(
+            movie_id=info.movie_id, status='done'
+        ).exists() else None,
+        'thumbnails': reverse(
+            'streaming:trickplay', args=[slug, INDEX_NAME]
+        ) + f'?v={trickplay.version}' if trickplay else None,
+    })
+
+
+@login_required
+@require_safe
+def hls_master(request, slug):
+    """HLS master playlist: every finished rendition for 'auto', else the preferred one"""
+    movie = get_object_or_404(Movie, slug=slug, is_available=True)
+    renditions = pick_renditions(
+        list(Rendition.objects.filter(movie=movie, status='done')), preferred_quality(request.user)
+    )
+    if not renditions:
+        raise Http404('No renditions available')
+    response = HttpResponse(master_playlist(renditions), content_type='application/vnd.apple.mpegurl')
+    # Depends on the viewer's preference
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+@require_safe
+def hls_file(request, slug, quality, name):
+    """A variant playlist or segment of a finished rendition"""
+    if name != 'index.m3u8' and not SEGMENT_NAME.match(name):
+        raise Http404('Unknown rendition file')
+    rendition = get_object_or_404(
+        Rendition, movie__slug=slug, movie__is_available=True, quality=quality, status='done'
+    )
+    return serve_file(
+        request,
+        rendition_dir(rendition.movie_id, quality) / name,
+        cache_control=_private_cache('RENDITION_CACHE_SECONDS', 86400),
+    )
+
+
+@require_safe
+def poster(request, slug):
+    """
+    A movie's poster. URLs from poster_url() carry the file's version, so
+    they can be cached for good; anything else is revalidated every time.
+    """
+    movie = get_object_or_404(Movie, slug=slug)
+    path = poster_file_path(movie)
+    if path is None:
+        raise Http404('No poster')
+    try:
+        current = request.GET.get('v') == file_validators(path).version
+    except OSError:
+        raise Http404('No poster')
+    return serve_file(request, path, cache_control=IMMUTABLE if current else {'public': True, 'no_cache': True})
+
+
+@login_required
+@require_POST
+def record_progress(request, slug):
+    """
+    Buffer the player's position. Takes JSON from fetch() or form data from
+    navigator.sendBeacon(), which can't set the CSRF header and sends the
+    token as a field instead.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'success': False, 'message': 'Invalid JSON'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'success': False, 'message': 'Invalid JSON'}, status=400)
+    else:
+        data = request.POST
+
+    try:
+        seconds = float(data.get('current_time') or 0)
+        watched = float(data.get('watched') or 0)
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'message': 'Invalid position'}, status=400)
+    # "nan", "inf" and 1e400 all parse as floats but aren't positions
+    if not (math.isfinite(seconds) and math.isfinite(watched)) or max(seconds, watched) > progress.MAX_SECONDS:
+        return JsonResponse({'success': False, 'message': 'Invalid position'}, status=400)
+    completed = data.get('completed') in (True, 'true', '1')
+
+    movie_id = Movie.objects.filter(slug=slug).values_list('id', flat=True).first()
+    if movie_id is None:
+        raise Http404('No movie matches the given query.')
+    progress.record(request.user.id, movie_id, seconds, watched=watched, completed=completed)
+    return JsonResponse({'success': True})
+
+
+@login_required
+@require_safe
+def trickplay_file(request, slug, name):
+    """Seek-bar preview index or sprite sheet; URLs naming the current version are immutable"""
+    if name != INDEX_NAME and not SPRITE_NAME.match(name):
+        raise Http404('Unknown preview file')
+    trickplay = get_object_or_404(Trickplay, movie__slug=slug, error='', tile_count__gt=0)
+    current = request.GET.get('v') == trickplay.version
+    return serve_file(
+        request,
+        trickplay_dir(trickplay.movie_id) / name,
+        cache_control=PRIVATE_IMMUTABLE if current else {'private': True, 'no_cache': True},
+    )
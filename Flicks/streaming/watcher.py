@@ -0,0 +1,308 @@
+"""
+Cynara Library Watcher
+
+Keeps the library in sync while files are added, moved and removed,
+without rescanning it. On Linux the directory tree is watched with
+inotify (through ctypes, no extra dependency); elsewhere, or with
+--poll, the tree is rescanned every LIBRARY_POLL_SECONDS and compared
+with the previous scan in memory.
+
+A file that was created or written to is only imported once its size has
+stayed the same for LIBRARY_SETTLE_SECONDS, so a copy in progress isn't
+analyzed half-written. Settled paths go through library.sync_files in
+batches of LIBRARY_WATCH_BATCH_SIZE: new files become movies, changed
+ones are re-analyzed, and vanished ones mark their movie unavailable. A
+move out of one watched directory and into another is two events that
+may land in different batches; the fingerprint of the file relinks it to
+its movie either way.
+The only full comparison is one import_library pass at startup (and after
+an inotify queue overflow), to catch up on changes made while the watcher
+wasn't running.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .library import VIDEO_EXTENSIONS, import_library, scan_tree, sync_files
+from .models import LibraryFile
+
+logger = logging.getLogger(__name__)
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def _setting(key, default):
+    return settings.CYNARA_SETTINGS.get(key, default)
+
+
+def _is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, 'inotify_init1') else None
+
+
+def inotify_available():
+    return _libc() is not None
+
+
+class InotifyWatcher:
+    """
+    Recursive inotify watch of a directory tree.
+
+    read() returns (file paths that changed, directories that left the
+    tree). Directories created or moved into the tree are watched as they
+    appear, and the files already inside them are reported.
+    """
+
+    def __init__(self, root):
+        self.root = os.fspath(root)
+        libc = _libc()
+        if libc is None:
+            raise OSError('inotify is not available on this platform')
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.directories = {}  # watch descriptor -> directory path
+        self.overflowed = False
+        self.watch_tree(self.root)
+
+    def _watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # ENOSPC: fs.inotify.max_user_watches is too low for this library
+            logger.warning('Cannot watch %s: %s', directory, os.strerror(error))
+            return
+        self.directories[wd] = directory
+
+    def watch_tree(self, directory):
+        """Watch `directory` and everything below it; returns the video files already there"""
+        files = []
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            self._watch(current)
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif _is_video(entry.name):
+                            files.append(entry.path)
+            except OSError:
+                continue
+        return files
+
+    def forget_tree(self, directory):
+        """Stop watching `directory` and below (it moved out of the tree or is gone)"""
+        prefix = os.path.join(directory, '')
+        for wd, path in list(self.directories.items()):
+            if path == directory or path.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                self.directories.pop(wd, None)
+
+    def _events(self, data):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            yield wd, mask, os.fsdecode(name)
+
+    def read(self, timeout):
+        files = set()
+        gone = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return files, gone
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            for wd, mask, name in self._events(data):
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.directories.pop(wd, None)
+                    continue
+                directory = self.directories.get(wd)
+                if directory is None:
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if directory == self.root:
+                        logger.warning('Library root %s went away', self.root)
+                    continue
+                if name.startswith('.'):
+                    # Hidden, like in library scans: partial downloads, editor and OS files
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        files.update(self.watch_tree(path))
+                    elif mask & (IN_MOVED_FROM | IN_DELETE):
+                        self.forget_tree(path)
+                        gone.add(path)
+                elif _is_video(name):
+                    files.add(path)
+        return files, gone
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback: rescan every `interval` seconds and report the differences"""
+
+    def __init__(self, root, interval=None):
+        self.root = os.fspath(root)
+        self.interval = interval or _setting('LIBRARY_POLL_SECONDS', 30)
+        self.overflowed = False
+        self.snapshot = scan_tree(self.root)
+        self._next = time.monotonic() + self.interval
+
+    def read(self, timeout):
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            return set(), set()
+        self._next = time.monotonic() + self.interval
+        current = scan_tree(self.root)
+        changed = {path for path, state in current.items() if self.snapshot.get(path) != state}
+        changed.update(path for path in self.snapshot if path not in current)
+        self.snapshot = current
+        return changed, set()
+
+    def close(self):
+        pass
+
+
+class SettlingFiles:
+    """Paths waiting for their size to stop changing"""
+
+    def __init__(self, settle_seconds):
+        self.settle_seconds = settle_seconds
+        self.pending = {}  # path -> (size or None when missing, since)
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return None
+
+    def touch(self, path):
+        self.pending[path] = (self._size(path), time.monotonic())
+
+    def ready(self):
+        """Paths whose size (or absence) held steady for settle_seconds"""
+        now = time.monotonic()
+        settled = []
+        for path, (size, since) in list(self.pending.items()):
+            current = self._size(path)
+            if current != size:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle_seconds:
+                settled.append(path)
+                del self.pending[path]
+        return settled
+
+
+def watch_library(root=None, poll=False, settle_seconds=None, batch_size=None, log=None, stop=None):
+    """
+    Follow changes under `root` (MOVIES_ROOT by default) until `stop()`
+    returns true (forever by default). `log` gets a line per batch.
+    """
+    root = Path(root or settings.MOVIES_ROOT).resolve()
+    settle_seconds = settle_seconds if settle_seconds is not None else _setting('LIBRARY_SETTLE_SECONDS', 5)
+    batch_size = batch_size or _setting('LIBRARY_WATCH_BATCH_SIZE', 20)
+    log = log or logger.info
+
+    if poll or not inotify_available():
+        source = PollingWatcher(root)
+        log(f'Polling {root} every {source.interval}s')
+    else:
+        source = InotifyWatcher(root)
+        log(f'Watching {len(source.directories)} directories under {root} with inotify')
+
+    settling = SettlingFiles(settle_seconds)
+    try:
+        # Catch up on whatever changed while nobody was watching; events from now on are queued
+        counts = import_library(root)
+        log(f"Caught up: {counts['new']} new, {counts['moved']} moved, {counts['changed']} changed, "
+            f"{counts['removed']} removed")
+
+        while stop is None or not stop():
+            files, gone = source.read(timeout=1.0)
+            for path in files:
+                settling.touch(path)
+            paths = settling.ready()
+            for directory in gone:
+                # Everything the manifest had below a directory that left the tree
+                paths.extend(LibraryFile.objects.filter(
+                    path__startswith=os.path.join(directory, '')
+                ).values_list('path', flat=True))
+
+            if source.overflowed:
+                # The kernel dropped events; one full comparison catches up
+                source.overflowed = False
+                close_old_connections()
+                counts = import_library(root)
+                log(f"Event queue overflowed; rescanned: {counts['new']} new, {counts['moved']} moved, "
+                    f"{counts['changed']} changed, {counts['removed']} removed")
+
+            for start in range(0, len(paths), batch_size):
+                close_old_connections()
+                counts = sync_files(paths[start:start + batch_size])
+                if counts['new'] or counts['moved'] or counts['changed'] or counts['removed']:
+                    log(f"{counts['new']} new ({counts['duplicates']} duplicates), {counts['moved']} moved, "
+                        f"{counts['changed']} changed, {counts['removed']} removed, {counts['analyzed']} analyzed")
+    finally:
+        source.close()